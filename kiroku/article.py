@@ -24,6 +24,14 @@ class Article:
         self.tags = []
         self.title = None
         self._cfg = cfg
+        # rendered pieces of the article (dates, headline, tags...), which
+        # are used on several pages, but have to be created only once
+        self.fragments = {}
+
+    @property
+    def fname(self):
+        """Path to the article source file"""
+        return self._fname
 
     def read(self):
         """Read article and transform to html"""
@@ -33,24 +41,47 @@ class Article:
 
     def get_words(self):
         """Return word dictionary out of the html and article attributes"""
+        return self.strip().get_data()
+
+    def strip(self):
+        """Return MLStripper object fed with the article body. It holds both
+        the words and the plain text of the article"""
         ml_stripper = search.MLStripper()
         ml_stripper.feed(self.body)
-        return ml_stripper.get_data()
+        return ml_stripper
+
+    def fragment(self, name, render):
+        """Return the fragment of the given name. It is created by calling
+        render function only if it doesn't exist yet"""
+        try:
+            return self.fragments[name]
+        except KeyError:
+            self.fragments[name] = render()
+            return self.fragments[name]
 
     def created_short(self):
         """Return human created date"""
-        return self.created.strftime("%d %b, %Y")
+        return self.fragment("created_short",
+                             lambda: self.created.strftime("%d %b, %Y"))
 
     def created_detailed(self):
         """Return human created date"""
-        return self.created.strftime("%A, %d %b, %Y, %X")
+        return self.fragment("created_detailed",
+                             lambda: self.created.strftime("%A, %d %b, %Y, "
+                                                           "%X"))
 
     def created_rfc3339(self):
         """Return RFC 3339 formatted date"""
-        return naive_tzinfo.get_rfc3339(self.created, self._cfg['timezone'])
+        return self.fragment("created_rfc3339",
+                             lambda: naive_tzinfo.get_rfc3339(
+                                 self.created, self._cfg['timezone']))
 
     def created_rfc822(self):
         """Return RFC 822 formatted date"""
+        return self.fragment("created_rfc822", self._get_rfc822)
+
+    def _get_rfc822(self):
+        """Calculate RFC 822 formatted date"""
         # RFC 822 doesn't allow localized strings
         locale.setlocale(locale.LC_ALL, "C")
         date = naive_tzinfo.get_rfc822(self.created, self._cfg['timezone'])
@@ -61,7 +92,8 @@ class Article:
         """Return processed article and its fields"""
         html = attrs = None
         with open(self._fname) as fobj:
-            html, attrs = rest.BlogArticle(fobj.read()).publish()
+            html, attrs = rest.BlogArticle(
+                fobj.read(), self._cfg['html_writer']).publish()
         return html, attrs
 
     def _process_attrs(self, attrs):
@@ -128,4 +160,6 @@ class Article:
 
     def get_short_body(self):
         """Return part of the HTML body up to first <!-- more --> comment"""
-        return self.body.split("<!-- more -->")[0].strip()
+        return self.fragment("short_body",
+                             lambda: self.body.split("<!-- more -->")[0]
+                             .strip())
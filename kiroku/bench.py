@@ -0,0 +1,440 @@
+"""
+Benchmarks for kiroku
+"""
+import bisect
+import contextlib
+import datetime
+import itertools
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import time
+import traceback
+
+from kiroku import naive_tzinfo
+from kiroku import rest
+from kiroku import search
+
+
+# syllables of the words in the generated articles
+SYLLABLES = ("ka", "ri", "to", "me", "su", "no", "ha", "ru", "ki", "mo",
+             "ta", "ne", "shi", "ro", "ya", "mi", "ku", "se", "na", "po")
+CODE_LINES = ("def %s(%s):", "    %s = %s + 1", "    return %s(%s)",
+              "for %s in %s:", "    print(%s, %s)")
+# build runs of the site benchmark
+SITE_RUNS = ("cold", "warm", "edit")
+
+
+def percentile(values, pct):
+    """Return pct percentile (nearest rank method) of the values"""
+    if not values:
+        return 0
+    values = sorted(values)
+    rank = max(int(math.ceil(pct / 100.0 * len(values))), 1)
+    return values[rank - 1]
+
+
+def read_query_log(fname):
+    """Return list of (scope, phrase) tuples out of the query log. Every line
+    of the log is a search phrase, optionally prefixed by the partition
+    name and a tab character, i.e. "tag-python<TAB>asyncio loop"."""
+    queries = []
+    with open(fname) as fobj:
+        for line in fobj:
+            line = line.rstrip("\n")
+            if not line.strip():
+                continue
+            scope = None
+            if "\t" in line:
+                scope, line = line.split("\t", 1)
+            queries.append((scope or None, line))
+    return queries
+
+
+def search_bench(build_dir, queries, index_fname=None, repeat=1):
+    """Replay queries against the built site search. Return dictionary with
+    the results"""
+    start = time.perf_counter()
+    site = search.SiteSearch(build_dir, index_fname)
+    index = site.get_index(site.index_fname)
+    load_time = time.perf_counter() - start
+
+    latencies = []
+    fetched = []
+    found = 0
+    try:
+        for _ in range(repeat):
+            for scope, phrase in queries:
+                start = time.perf_counter()
+                headlines, size = site.query(phrase, scope)
+                latencies.append(time.perf_counter() - start)
+                fetched.append(size)
+                found += bool(headlines)
+    finally:
+        site.close()
+
+    return {"index": os.path.basename(site.index_fname),
+            "index_size": index.size,
+            "load_time": load_time,
+            "queries": len(latencies),
+            "found": found,
+            "p50": percentile(latencies, 50),
+            "p99": percentile(latencies, 99),
+            "bytes_per_query": (sum(fetched) / len(fetched)
+                                if fetched else 0)}
+
+
+def print_search_bench(result):
+    """Print out search_bench() results"""
+    print("Index:            %s (%d bytes)" %
+          (result["index"], result["index_size"]))
+    print("Index load time:  %.3f ms" % (result["load_time"] * 1000))
+    print("Queries:          %d (%d with results)" %
+          (result["queries"], result["found"]))
+    print("Latency p50:      %.3f ms" % (result["p50"] * 1000))
+    print("Latency p99:      %.3f ms" % (result["p99"] * 1000))
+    print("Bytes per query:  %.0f" % result["bytes_per_query"])
+
+
+def _vocabulary(rnd, size):
+    """Return list of size unique words made out of the syllables"""
+    words = set()
+    while len(words) < size:
+        words.add("".join(rnd.choice(SYLLABLES)
+                          for _ in range(rnd.randint(1, 4))))
+    return sorted(words)
+
+
+def _sentence(rnd, words):
+    """Return random sentence"""
+    sentence = " ".join(rnd.choice(words) for _ in range(rnd.randint(5, 15)))
+    return sentence.capitalize() + "."
+
+
+def _paragraph(rnd, words):
+    """Return random paragraph of the text, wrapped at 79 characters"""
+    text = " ".join(_sentence(rnd, words) for _ in range(rnd.randint(2, 6)))
+    lines = []
+    line = ""
+    for word in text.split():
+        if line and len(line) + len(word) > 78:
+            lines.append(line)
+            line = ""
+        line = (line + " " + word) if line else word
+    lines.append(line)
+    return "\n".join(lines)
+
+
+def _code_block(rnd, words):
+    """Return random Python code block"""
+    lines = ["   " + pattern % (rnd.choice(words), rnd.choice(words))
+             for pattern in CODE_LINES]
+    return ".. code:: python\n\n" + "\n".join(lines)
+
+
+def generate_corpus(path, articles=100, tags=20, tags_per_article=3,
+                    paragraphs=8, code_density=0.2, seed=0):
+    """Write articles reST files into the path directory. Tags are chosen
+    with Zipf distribution - the first tag is the most popular one, every
+    paragraph is followed by the code block with code_density probability.
+    The same seed gives the same articles. Return list of the written file
+    names"""
+    rnd = random.Random(seed)
+    words = _vocabulary(rnd, 2000)
+    tag_names = ["tag %s" % word for word in _vocabulary(rnd, tags)]
+    weights = list(itertools.accumulate(1.0 / rank
+                                        for rank in range(1, tags + 1)))
+    created = datetime.datetime(2010, 1, 1, 8, 0, 0)
+
+    os.makedirs(path, exist_ok=True)
+    fnames = []
+    for num in range(articles):
+        created += datetime.timedelta(hours=rnd.randint(1, 72))
+        art_tags = set()
+        while len(art_tags) < min(tags_per_article, tags):
+            art_tags.add(tag_names[bisect.bisect(weights, rnd.random() *
+                                                 weights[-1])])
+
+        body = []
+        for par in range(paragraphs):
+            body.append(_paragraph(rnd, words))
+            if par == 0:
+                body.append(".. more")
+            if rnd.random() < code_density:
+                body.append(_code_block(rnd, words))
+
+        fname = os.path.join(path, "%s_article_%05d.rst" %
+                             (created.strftime("%Y-%m-%d"), num))
+        with open(fname, "w") as fobj:
+            fobj.write(":title: %s\n:datetime: %s\n:tags: %s\n\n%s\n" %
+                       (_sentence(rnd, words)[:-1],
+                        created.strftime("%Y-%m-%d %H:%M:%S"),
+                        ", ".join(sorted(art_tags)),
+                        "\n\n".join(body)))
+        fnames.append(fname)
+    return fnames
+
+
+def _peak_rss(rusage):
+    """Return peak resident set size in bytes out of the resource usage"""
+    # Linux reports it in kilobytes, macOS in bytes
+    if sys.platform == "darwin":
+        return rusage.ru_maxrss
+    return rusage.ru_maxrss * 1024
+
+
+def _measure_build(kiroku):
+    """Build the site in the child process. Return dictionary with the build
+    statistics, wall time and peak memory of the build"""
+    read_fd, write_fd = os.pipe()
+    start = time.perf_counter()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        status = 1
+        try:
+            with open(os.devnull, "w", encoding="utf-8") as devnull, \
+                    contextlib.redirect_stdout(devnull):
+                data = kiroku.build().to_dict()
+            with os.fdopen(write_fd, "w") as fobj:
+                json.dump(data, fobj)
+            status = 0
+        except Exception:
+            traceback.print_exc()
+        finally:
+            os._exit(status)
+
+    os.close(write_fd)
+    with os.fdopen(read_fd) as fobj:
+        data = fobj.read()
+    _, status, rusage = os.wait4(pid, 0)
+    wall = time.perf_counter() - start
+    if status:
+        raise RuntimeError("Build of `%s' failed" % kiroku.path)
+
+    pages = sum(1 for fname in os.listdir(os.path.join(kiroku.path, "build"))
+                if fname.endswith(".html"))
+    data = json.loads(data)
+    return {"wall": wall,
+            "build_wall": data["wall"],
+            "pages": pages,
+            "pages_per_second": pages / wall if wall else 0,
+            "files_written": data["files_written"],
+            "bytes_written": data["bytes_written"],
+            "cache_hits": data["cache_hits"],
+            "peak_rss": _peak_rss(rusage)}
+
+
+def _init_site(path, make_kiroku):
+    """Initialize the site in the path, which must not exist, without the
+    sample articles"""
+    with open(os.devnull, "w", encoding="utf-8") as devnull, \
+            contextlib.redirect_stdout(devnull):
+        if make_kiroku(path).init():
+            raise RuntimeError("Cannot initialize `%s'" % path)
+    shutil.rmtree(os.path.join(path, "articles"))
+
+
+def site_bench(path, make_kiroku, **corpus):
+    """Initialize the site in the path, which must not exist, fill it with
+    the generated articles (see generate_corpus for corpus arguments) and
+    measure the cold build, the no-op rebuild and the rebuild after the edit
+    of single article. make_kiroku is the callable returning Kiroku object
+    for the path. Every build is run in separate process. Return dictionary
+    with the results"""
+    start = time.perf_counter()
+    _init_site(path, make_kiroku)
+    result = {"init": time.perf_counter() - start}
+
+    fnames = generate_corpus(os.path.join(path, "articles"), **corpus)
+    result["articles"] = len(fnames)
+
+    for run in SITE_RUNS:
+        if run == "edit" and fnames:
+            with open(fnames[0], "a") as fobj:
+                fobj.write("\nOne more paragraph.\n")
+            stat = os.stat(fnames[0])
+            os.utime(fnames[0], ns=(stat.st_atime_ns,
+                                    stat.st_mtime_ns + 10 ** 9))
+        result[run] = _measure_build(make_kiroku(path))
+
+    return result
+
+
+def print_site_bench(result):
+    """Print out site_bench() results"""
+    print("Articles:         %d" % result["articles"])
+    print("Init:             %.3f s" % result["init"])
+    row = "%-10s %10s %10s %10s %12s %14s"
+    print(row % ("build", "wall [s]", "pages", "pages/s", "cache hits",
+                 "peak RSS [MiB]"))
+    for run in SITE_RUNS:
+        data = result[run]
+        print(row % (run, "%.3f" % data["wall"], data["pages"],
+                     "%.1f" % data["pages_per_second"], data["cache_hits"],
+                     "%.1f" % (data["peak_rss"] / 1048576)))
+
+
+def _timeit(func, repeat, min_time):
+    """Return list of repeat samples of the func call time. Every sample is
+    the average of as many calls, as needed to take at least min_time"""
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    loops = max(int(math.ceil(min_time / elapsed)), 1) if elapsed else 1000
+
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        samples.append((time.perf_counter() - start) / loops)
+    return samples
+
+
+def _micro_benchmarks(kiroku):
+    """Return dictionary of the hot path benchmarks run on the site of the
+    given Kiroku object, which articles are already gathered"""
+    art = kiroku.articles[0]
+    with open(art.fname) as fobj:
+        source = fobj.read()
+
+    def template():
+        kiroku._templ("headline", {"article_url": art.html_fname,
+                                   "title": art.title,
+                                   "datetime": "",
+                                   "human_date": "",
+                                   "tags": ""})
+
+    def tag_cloud():
+        kiroku.tag_cloud = None
+        kiroku._calculate_tag_cloud()
+
+    def json_data():
+        # articles cache their fragments, so drop them to measure the
+        # creation of the data rather than the cache lookup
+        for article in kiroku.articles:
+            article.fragments = {}
+        kiroku._create_json_data()
+
+    def strip():
+        stripper = search.MLStripper()
+        stripper.feed(art.body)
+        stripper.get_data()
+
+    return {"template": template,
+            "publish": lambda: rest.BlogArticle(source).publish(),
+            "mlstripper": strip,
+            "json_data": json_data,
+            "tag_cloud": tag_cloud,
+            "rfc3339": lambda: naive_tzinfo.get_rfc3339(art.created,
+                                                        "Europe/Warsaw")}
+
+
+def micro_bench(path, make_kiroku, repeat=10, min_time=0.05, **corpus):
+    """Initialize the site with the generated articles in the path, which
+    must not exist (see generate_corpus for corpus arguments), and measure
+    the hot paths of the build - template rendering, reST publishing,
+    HTML stripping, search data creation, tag cloud calculation and date
+    formatting. Return dictionary with the results, which can be stored as a
+    baseline"""
+    _init_site(path, make_kiroku)
+    generate_corpus(os.path.join(path, "articles"), **corpus)
+
+    kiroku = make_kiroku(path)
+    result = {"python": platform.python_version(),
+              "corpus": corpus,
+              "benchmarks": {}}
+    with open(os.devnull, "w", encoding="utf-8") as devnull, \
+            contextlib.redirect_stdout(devnull):
+        kiroku._prepare_build_dir()
+        kiroku._walk()
+        for name, func in sorted(_micro_benchmarks(kiroku).items()):
+            samples = _timeit(func, repeat, min_time)
+            result["benchmarks"][name] = {
+                "median": statistics.median(samples),
+                "mean": statistics.mean(samples),
+                "stdev": (statistics.stdev(samples) if len(samples) > 1
+                          else 0),
+                "samples": samples}
+    return result
+
+
+def print_micro_bench(result):
+    """Print out micro_bench() results"""
+    row = "%-12s %14s %14s"
+    print(row % ("benchmark", "median [us]", "stdev [us]"))
+    for name, data in sorted(result["benchmarks"].items()):
+        print(row % (name, "%.2f" % (data["median"] * 1e6),
+                     "%.2f" % (data["stdev"] * 1e6)))
+
+
+def mann_whitney(baseline, current):
+    """Return one-sided p-value of the Mann-Whitney U test (with the normal
+    approximation) for the hypothesis, that the current samples are bigger
+    than the baseline ones"""
+    values = sorted([(value, 0) for value in baseline] +
+                    [(value, 1) for value in current])
+    ranks = [0] * len(values)
+    idx = 0
+    while idx < len(values):
+        end = idx
+        while end + 1 < len(values) and values[end + 1][0] == values[idx][0]:
+            end += 1
+        for pos in range(idx, end + 1):
+            # ties get the average rank
+            ranks[pos] = (idx + end) / 2 + 1
+        idx = end + 1
+
+    size_a, size_b = len(baseline), len(current)
+    u_stat = (sum(rank for rank, (_, group) in zip(ranks, values) if group) -
+              size_b * (size_b + 1) / 2)
+    sigma = math.sqrt(size_a * size_b * (size_a + size_b + 1) / 12)
+    if not sigma:
+        return 1.0
+    z_score = (u_stat - size_a * size_b / 2 - 0.5) / sigma
+    return 0.5 * math.erfc(z_score / math.sqrt(2))
+
+
+def compare_micro_bench(baseline, current, threshold=0.05, alpha=0.01):
+    """Compare micro_bench() results against the baseline ones. Benchmark is
+    considered as regressed, if its median is more than threshold (relative)
+    slower, and the slowdown is statistically significant at alpha level.
+    Return list of dictionaries with the comparison of every benchmark"""
+    rows = []
+    for name, data in sorted(current["benchmarks"].items()):
+        if name not in baseline["benchmarks"]:
+            continue
+        base = baseline["benchmarks"][name]
+        change = data["median"] / base["median"] - 1
+        p_value = mann_whitney(base["samples"], data["samples"])
+        status = "ok"
+        if change > threshold and p_value < alpha:
+            status = "regression"
+        elif (change < -threshold and
+              mann_whitney(data["samples"], base["samples"]) < alpha):
+            status = "improvement"
+        rows.append({"name": name,
+                     "baseline": base["median"],
+                     "current": data["median"],
+                     "change": change,
+                     "p_value": p_value,
+                     "status": status})
+    return rows
+
+
+def print_comparison(rows):
+    """Print out compare_micro_bench() results"""
+    row = "%-12s %14s %14s %9s %9s  %s"
+    print(row % ("benchmark", "baseline [us]", "current [us]", "change",
+                 "p-value", "status"))
+    for data in rows:
+        print(row % (data["name"], "%.2f" % (data["baseline"] * 1e6),
+                     "%.2f" % (data["current"] * 1e6),
+                     "%+.1f%%" % (data["change"] * 100),
+                     "%.4f" % data["p_value"], data["status"]))
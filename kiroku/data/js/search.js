@@ -4,7 +4,8 @@
  */
 (function () {
     "use strict";
-    var data,
+    var indexes = {},
+        chunks = {},
         templates;
 
     if (!String.prototype.swap) {
@@ -20,26 +21,76 @@
         };
     }
 
+    function utf8Bytes(str) {
+        /* jshint nonstandard: true */
+        var binary = unescape(encodeURIComponent(str)),
+            bytes = [],
+            idx;
+
+        for (idx = 0; idx < binary.length; idx++) {
+            bytes.push(binary.charCodeAt(idx));
+        }
+        return bytes;
+    }
+
+    function fnv1a(bytes, seed) {
+        /* jshint bitwise: false */
+        var hash = seed;
+
+        bytes.forEach(function (byte) {
+            hash ^= byte;
+            hash = Math.imul(hash, 0x01000193) >>> 0;
+        });
+        return hash >>> 0;
+    }
+
+    function bloomHas(word) {
+        /* jshint bitwise: false */
+        var bloom = templates.b,
+            bytes = utf8Bytes(word),
+            first = fnv1a(bytes, 0x811c9dc5),
+            second = (fnv1a(bytes, 0x5bd1e995) | 1) >>> 0,
+            pos,
+            idx;
+
+        if (!bloom.bits) {
+            bloom.bits = atob(bloom.b);
+        }
+
+        for (idx = 0; idx < bloom.k; idx++) {
+            pos = (first + idx * second) % bloom.m;
+            if (!(bloom.bits.charCodeAt(pos >> 3) & (1 << (pos & 7)))) {
+                return false;
+            }
+        }
+        return true;
+    }
+
+    function splitWords(searchString) {
+        var words = [];
+
+        searchString.split(" ").forEach(function (item) {
+            if (item) {
+                words.push(item);
+            }
+        });
+        return words;
+    }
+
     function notFound(searchString) {
         $("article").html(templates.n.swap({'sp': searchString}));
     }
 
-    function parseItems(searchString) {
+    function findItems(data, words) {
         var res = {},
             artIds = [],
             weights = {},
             weights2 = {},
             weights3 = [],
-            html = [],
-            words = [],
+            ids = [],
+            first = true,
             notFoundFlag = false;
 
-        searchString.split(" ").forEach(function (item) {
-            if (item) {
-                words.push(item);
-            }
-        });
-
         words.forEach(function (item) {
             if (!data.w[item]) {
                 notFoundFlag = true;
@@ -49,13 +100,13 @@
         });
 
         if (notFoundFlag) {
-            notFound(searchString);
-            return false;
+            return ids;
         }
 
         $.each(res, function (item, value) {
             var tempIds = [];
-            if (!artIds.length) {
+            if (first) {
+                first = false;
                 value.forEach(function (artWeight) {
                     artIds.push(artWeight[0]);
                     weights[artWeight[0]] = artWeight[1];
@@ -71,6 +122,9 @@
                 });
                 artIds = tempIds;
             }
+            // no article contains all of the words so far, so none will
+            // contain the rest of them either
+            return artIds.length > 0;
         });
 
         artIds.forEach(function (artId) {
@@ -89,17 +143,206 @@
 
         weights3.forEach(function (weight) {
             weights2[weight].forEach(function (idx) {
-                html.push(data.a[idx]);
+                ids.push(idx);
+            });
+        });
+
+        return ids;
+    }
+
+    function escapeHtml(text) {
+        return $("<div>").text(text).html();
+    }
+
+    function escapeRegExp(text) {
+        return text.replace(/[.*+?^${}()|[\]\\]/g, "\\$&");
+    }
+
+    function loadChunk(num) {
+        if (!chunks[num]) {
+            chunks[num] = window.fetch("snippets/" + num + ".json.gz")
+            .then(function (res) {
+                return res.arrayBuffer();
+            })
+            .then(function (buf) {
+                var bytes = new Uint8Array(buf);
+                // server might already decompressed the data for us
+                if (bytes[0] === 0x1f && bytes[1] === 0x8b) {
+                    return new Response(new Blob([buf]).stream()
+                        .pipeThrough(new window.DecompressionStream("gzip")))
+                        .json();
+                }
+                return new Response(buf).json();
             });
+        }
+        return chunks[num];
+    }
+
+    function makeSnippet(entry, words) {
+        var text = entry.t,
+            start = text.length,
+            end,
+            html = [],
+            pattern = new RegExp("(" + words.map(escapeRegExp).join("|") +
+                                 ")", "i");
+
+        words.forEach(function (word) {
+            var offsets = entry.o[word];
+            if (offsets && offsets[0] < start) {
+                start = offsets[0];
+            }
         });
+        if (start === text.length) {
+            start = 0;
+        }
+
+        start = Math.max(0, start - 60);
+        if (start > 0) {
+            // don't cut the words in half
+            start = text.indexOf(" ", start) + 1;
+        }
+        end = Math.min(text.length, start + 200);
+        if (end < text.length && text.lastIndexOf(" ", end) > start) {
+            end = text.lastIndexOf(" ", end);
+        }
 
-        if (html.length === 0) {
+        text.slice(start, end).split(pattern).forEach(function (part, idx) {
+            html.push(idx % 2 ? "<mark>" + escapeHtml(part) + "</mark>" :
+                      escapeHtml(part));
+        });
+
+        return (start > 0 ? "… " : "") + html.join("") +
+            (end < text.length ? " …" : "");
+    }
+
+    function showSnippets(words, artIds) {
+        if (!window.fetch || !window.DecompressionStream) {
+            return;
+        }
+
+        artIds.forEach(function (artId) {
+            loadChunk(Math.floor(artId / templates.c))
+            .then(function (chunk) {
+                if (chunk[artId]) {
+                    $('.search-result[data-id="' + artId + '"]')
+                    .append('<p class="snippet">' +
+                            makeSnippet(chunk[artId], words) + '</p>');
+                }
+            })
+            .catch(function () {
+                return;
+            });
+        });
+    }
+
+    function showResults(searchString, words, data, ids) {
+        var html = [],
+            artIds = [];
+
+        if (ids.length === 0) {
             notFound(searchString);
+            return;
+        }
+
+        ids.forEach(function (idx) {
+            // partitions are using their own ids, global ones are in "i"
+            var artId = data.i ? data.i[idx] : idx;
+            if (templates.c) {
+                artIds.push(artId);
+                html.push('<div class="search-result" data-id="' + artId +
+                          '">' + data.a[idx] + '</div>');
+            } else {
+                html.push(data.a[idx]);
+            }
+        });
+
+        $("article").html(templates.r.swap({'sp': searchString}) +
+                          html.join(" "));
+
+        if (templates.c) {
+            showSnippets(words, artIds);
+        }
+    }
+
+    function loadIndex(fname, callback) {
+        if (indexes[fname]) {
+            callback(indexes[fname]);
         } else {
-            $("article").html(templates.r.swap({'sp': searchString}) +
-                              html.join(" "));
+            $.getJSON(fname, {async: false})
+            .done(function (res) {
+                indexes[fname] = res;
+                callback(res);
+            });
         }
-        return false;
+    }
+
+    function pageScope() {
+        // Search partition for the current page, if it was generated. Page
+        // numbers are appended as "-N", while the date archives use "_" for
+        // separating the year and month, so the names cannot be mixed up.
+        // The year index (archives_years.html) has no year, so no partition.
+        var page = window.location.pathname.split("/").pop(),
+            match = /^(tag-.+)\.html$/.exec(page),
+            scopes = [];
+
+        if (match) {
+            // tag itself may end with "-N", so try the full name first
+            scopes = [match[1], match[1].replace(/-\d+$/, "")];
+        } else {
+            match = /^archives_(\d{4})(?:_\d{2})?(?:-\d+)?\.html$/.exec(page);
+            if (match) {
+                scopes = [match[1]];
+            }
+        }
+
+        return scopes.filter(function (scope) {
+            return templates.p && templates.p.indexOf(scope) > -1;
+        })[0] || null;
+    }
+
+    function search(searchString) {
+        var words = splitWords(searchString),
+            scope = pageScope();
+
+        // Reject the phrase with unknown word early, before downloading
+        // entire search index
+        if (templates.b && !words.every(bloomHas)) {
+            notFound(searchString);
+            return;
+        }
+
+        function searchAll() {
+            if (templates.s) {
+                // index is too big, ask the search service instead
+                $.getJSON(templates.s, {q: searchString})
+                .done(function (data) {
+                    showResults(searchString, words, data,
+                                data.a.map(function (item, idx) {
+                                    return idx;
+                                }));
+                });
+                return;
+            }
+            loadIndex("search.json", function (data) {
+                showResults(searchString, words, data,
+                            findItems(data, words));
+            });
+        }
+
+        if (!scope) {
+            searchAll();
+            return;
+        }
+
+        // Try smaller, scoped index first, and fall back to the global one
+        loadIndex("search-" + scope + ".json", function (data) {
+            var ids = findItems(data, words);
+            if (ids.length) {
+                showResults(searchString, words, data, ids);
+            } else {
+                searchAll();
+            }
+        });
     }
 
     $(function () {
@@ -119,16 +362,7 @@
                 searchString = this.value;
                 event.preventDefault();
                 $(document).attr('title', templates.t);
-
-                if (!data) {
-                    $.getJSON("search.json", {async: false})
-                    .done(function (res) {
-                        data = res;
-                        parseItems(searchString);
-                    });
-                } else {
-                    parseItems(searchString);
-                }
+                search(searchString);
             }
         });
     });
@@ -6,7 +6,11 @@ See README for details
 from argparse import ArgumentParser, Namespace, RawDescriptionHelpFormatter
 import collections
 import configparser
+import contextlib
+import datetime
 import gettext
+import hashlib
+import itertools
 import json
 import locale
 import math
@@ -14,19 +18,42 @@ import operator
 import os
 import re
 import shutil
+import subprocess
 import sys
+import tempfile
 
 from kiroku import article
+from kiroku import bench
+from kiroku import minify
 from kiroku import misc
+from kiroku import profiling
 from kiroku import rest
 from kiroku import rss
+from kiroku import search
+from kiroku import server
+from kiroku import stats
 from kiroku import template
+from kiroku import trace
 
 
 APP_NAME = "kiroku"
 MODULE_DIR = os.path.dirname(os.path.realpath(os.path.abspath(__file__)))
 DATA_DIR = os.path.join(MODULE_DIR, "data")
 LOCALE_DIR = os.path.join(DATA_DIR, 'locale')
+FRAGMENTS_CACHE = os.path.join(".cache", "fragments.json")
+DEPENDENCIES_CACHE = os.path.join(".cache", "dependencies.json")
+# record of every build is appended to this file in the site directory
+HISTORY_FNAME = "build_history.jsonl"
+# templates used for rendering the cached article fragments
+FRAGMENT_TEMPLATES = ("headline", "article_tag")
+TAG_CLOUD_FNAME = "tag_cloud.html"
+# index of the date archives, named after them, but without the year number
+ARCHIVE_YEARS_FNAME = "archives_years.html"
+# tag cloud references for the pages, when it is written to separate file
+TAG_CLOUD_SSI = '<!--#include virtual="%(server_root)s%(fname)s" -->'
+TAG_CLOUD_SCRIPT = ('<span id="tag-cloud"></span><script>'
+                    '$("#tag-cloud").load("%(server_root)s%(fname)s");'
+                    '</script>')
 
 CONFIG = {'server_name': "localhost",
           'server_root': "/",
@@ -35,7 +62,40 @@ CONFIG = {'server_name': "localhost",
           'site_desc': "Yet another blog",
           'site_footer': "The footer",
           'locale': "",
-          'timezone': "UTC"}
+          'timezone': "UTC",
+          'search_partitions': "",
+          'search_snippets': "false",
+          'search_service': "",
+          'tag_cloud_mode': "inline",
+          'index_size': "5",
+          'page_size': "0",
+          'archive_partitions': "",
+          'minify_html': "false",
+          'html_writer': "html4",
+          'budget_page': "",
+          'budget_search': "",
+          'budget_assets': "",
+          'budget_tag_cloud': ""}
+# output size budgets options and their labels
+BUDGETS = (("budget_page", "Page size"),
+           ("budget_search", "Search data size"),
+           ("budget_assets", "CSS and JS size"),
+           ("budget_tag_cloud", "Tag cloud size"))
+# number of the biggest files reported for the exceeded budget
+BUDGET_OFFENDERS = 10
+SIZE_UNITS = {"": 1, "k": 1024, "m": 1024 * 1024}
+# defaults for the build command options
+BUILD_OPTIONS = {'writer_report': False,
+                 'timings': False,
+                 'timings_json': None,
+                 'trace': None,
+                 'profile': None,
+                 'memory': False,
+                 'slowest': 0,
+                 'node_profile': False,
+                 'article_budget': None,
+                 'prometheus': None,
+                 'history': True}
 
 
 def get_i18n_strings(_):
@@ -55,13 +115,16 @@ def get_i18n_strings(_):
             "i18n_search_results": _("Results for phrase \"{sp}\""),
             "i18n_search_not_found": _("No results for phrase \"{sp}\""),
             "i18n_subscribe": _("Subscribe"),
-            "i18n_subscribe_desc": _("Subscribe via RSS")}
+            "i18n_subscribe_desc": _("Subscribe via RSS"),
+            "i18n_newer": _("Newer"),
+            "i18n_older": _("Older"),
+            "i18n_archive_dates": _("Archives by date")}
 
 
 def build(opts, cfg):
-    """Build the site"""
-    kiroku = Kiroku(cfg, opts.path)
-    return kiroku.build()
+    """Build the site. Return exit code"""
+    kiroku = Kiroku(cfg, opts.path, opts)
+    return 1 if kiroku.build().errors else 0
 
 
 def init(opts, cfg):
@@ -70,6 +133,189 @@ def init(opts, cfg):
     return kiroku.init()
 
 
+def serve_search(opts, cfg):
+    """Serve search queries out of the binary index"""
+    fname = os.path.join(opts.path, "build", "search.idx")
+    if not os.path.exists(fname):
+        print("There is no `%s' file. Set `search_service' option and build "
+              "the site first." % fname)
+        return 1
+    return server.serve(fname, opts.host, opts.port, opts.workers)
+
+
+def search_bench(opts, cfg):
+    """Replay the query log against the built site search index"""
+    build_dir = os.path.join(opts.path, "build")
+    if not os.path.exists(os.path.join(build_dir, "templates.json")):
+        print("There is no search data in `%s'. Build the site first." %
+              build_dir)
+        return 1
+
+    index_fname = None
+    if opts.index:
+        index_fname = os.path.join(build_dir, opts.index)
+
+    result = bench.search_bench(build_dir, bench.read_query_log(opts.log),
+                                index_fname, opts.repeat)
+    bench.print_search_bench(result)
+    return 0
+
+
+def _bench_kiroku(cfg):
+    """Return callable making Kiroku objects for the benchmarks, which
+    builds don't go to the build history"""
+    return lambda path: Kiroku(cfg, path, Namespace(history=False))
+
+
+def site_bench(opts, cfg):
+    """Generate synthetic site and measure its builds"""
+    path = opts.path
+    if path is None:
+        tmp_dir = tempfile.mkdtemp()
+        path = os.path.join(tmp_dir, "site")
+    elif os.path.exists(path):
+        print("File or directory `%s' exists. Remove it, or choose another "
+              "directory." % path)
+        return 1
+
+    try:
+        result = bench.site_bench(path, _bench_kiroku(cfg),
+                                  articles=opts.articles, tags=opts.tags,
+                                  tags_per_article=opts.tags_per_article,
+                                  paragraphs=opts.paragraphs,
+                                  code_density=opts.code_density,
+                                  seed=opts.seed)
+    finally:
+        if opts.path is None:
+            shutil.rmtree(tmp_dir)
+
+    bench.print_site_bench(result)
+    if opts.json:
+        with open(opts.json, "w") as fobj:
+            json.dump(result, fobj, indent=2)
+    return 0
+
+
+def micro_bench(opts, cfg):
+    """Measure the build hot paths, optionally comparing them against the
+    baseline"""
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        result = bench.micro_bench(os.path.join(tmp_dir, "site"),
+                                   _bench_kiroku(cfg),
+                                   repeat=opts.repeat,
+                                   articles=opts.articles, seed=opts.seed)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    bench.print_micro_bench(result)
+    if opts.save:
+        with open(opts.save, "w") as fobj:
+            json.dump(result, fobj, indent=2)
+
+    if not opts.compare:
+        return 0
+
+    with open(opts.compare) as fobj:
+        baseline = json.load(fobj)
+    if (baseline["python"] != result["python"] or
+            baseline["corpus"] != result["corpus"]):
+        print("Warning: baseline was made with different Python version or "
+              "corpus.")
+    rows = bench.compare_micro_bench(baseline, result,
+                                     opts.threshold, opts.alpha)
+    bench.print_comparison(rows)
+    return 1 if any(row["status"] == "regression" for row in rows) else 0
+
+
+def stats_history(opts, cfg):
+    """Print build history of the site"""
+    fname = os.path.join(opts.path, HISTORY_FNAME)
+    if not os.path.exists(fname):
+        print("There is no `%s' file. Build the site first." % fname)
+        return 1
+    stats.print_history(stats.read_history(fname), opts.last, opts.jump)
+    return 0
+
+
+def _git_commit(path):
+    """Return abbreviated hash of the HEAD commit of the git repository in
+    the path, or None if it's not available"""
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                                cwd=path, stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL,
+                                universal_newlines=True)
+    except OSError:
+        return None
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
+def _split_option(value):
+    """Return list of items out of comma separated config option value"""
+    return [item.strip().lower() for item in value.split(",")
+            if item.strip()]
+
+
+def _is_enabled(value):
+    """Return boolean value of the config option"""
+    return configparser.ConfigParser.BOOLEAN_STATES.get(value.strip().lower(),
+                                                        False)
+
+
+def _parse_size(value):
+    """Return size in bytes out of the config option value, which is the
+    number optionally followed by k or M unit (kB, KiB, MB and MiB are
+    accepted as well), or None if it's empty. Raise ValueError for anything
+    else, including the bare unit"""
+    value = value.strip().lower()
+    if not value:
+        return None
+    number = value
+    if number.endswith("ib"):
+        number = number[:-2]
+    elif number.endswith("b"):
+        number = number[:-1]
+    if not number:
+        raise ValueError("no number in size `%s'" % value)
+    unit = number[-1] if number[-1] in SIZE_UNITS else ""
+    return int(float(number[:len(number) - len(unit)]) * SIZE_UNITS[unit])
+
+
+def _get_stat(fname):
+    """Return modification time and size of the file"""
+    stat = os.stat(fname)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def _joined(items, separator=" "):
+    """Yield items with separator between them - lazy version of
+    separator.join(items)"""
+    for idx, item in enumerate(items):
+        if idx:
+            yield separator
+        yield item
+
+
+def _pages(items, size):
+    """Yield lists of size items taken out of items iterable, one page at a
+    time"""
+    items = iter(items)
+    while True:
+        page = list(itertools.islice(items, size))
+        if not page:
+            return
+        yield page
+
+
+def _page_fname(base, num):
+    """Return file name for the page number num (counting from 1) of the
+    paginated base page, i.e. archives.html, archives-2.html and so on"""
+    if num == 1:
+        return "%s.html" % base
+    return "%s-%d.html" % (base, num)
+
+
 def _minify_css(fname):
     """Minify CSS (destructive!)"""
     comments = re.compile(r'/\*.*?\*/')
@@ -94,58 +340,232 @@ class Kiroku:
     blog/portal/website correctly.
     """
 
-    def __init__(self, config, path='.'):
+    def __init__(self, config, path='.', options=None):
         self._about_fname = None
         self._sorted_articles = []
         self._cfg = config
         self.path = path
         self.articles = []
         self.tag_cloud = None
+        # templates the tag cloud is rendered from
+        self._tag_cloud_uses = set()
         self.tags = collections.defaultdict(list)
         self._templ = template.Template(config, path)
+        self._fragments = {}
+        self.minified_bytes = 0
+        # written page file name -> size in bytes
+        self.page_sizes = {}
+        # config key -> output size budget in bytes
+        self._budgets = {}
+        self.stats = stats.BuildStats()
+        self.options = Namespace(**dict(BUILD_OPTIONS,
+                                        **vars(options or Namespace())))
 
     def build(self):
-        """Convert articles against the template to build directory"""
-        if not os.path.exists(os.path.join(self.path, "build")):
-            os.makedirs(os.path.join(self.path, "build", "images"))
-            shutil.copytree(os.path.join(self.path, ".css"),
-                            os.path.join(self.path, "build/css"))
-            shutil.copytree(os.path.join(self.path, ".js"),
-                            os.path.join(self.path, "build/js"))
-            for fname in os.listdir(os.path.join(self.path, "build", "css")):
-                if fname.endswith(".css"):
-                    _minify_css(os.path.join(self.path, "build", "css", fname))
-
-        self._walk()
-        self._calculate_tag_cloud()
-        self._create_json_data()
-        self._about()
-        self._save()
-
-        # copy all the other files and directories content, besides rst files
+        """Convert articles against the template to build directory. Return
+        BuildStats object with the build statistics and errors"""
+        phases = [("prepare", self._prepare_build_dir),
+                  ("load cache", self._load_caches),
+                  ("walk", self._walk)]
+        if self.options.writer_report:
+            phases.append(("writer report", self._writer_report))
+        phases += [("tag cloud", self._calculate_tag_cloud),
+                   ("save tag cloud", self._save_tag_cloud),
+                   ("json data", self._create_json_data),
+                   ("about", self._about),
+                   ("articles", self._save),
+                   ("copy files", self._copy_files),
+                   ("tag pages", self._tag_pages),
+                   ("index", self._index),
+                   ("archive", self._archive),
+                   ("date archives", self._date_archives),
+                   ("rss", self._rss),
+                   ("store cache", self._store_caches)]
+        try:
+            self._budgets = self._read_budgets()
+        except ValueError as err:
+            self.stats.errors.append(str(err))
+            print(err)
+            print("…failed.")
+            return self.stats
+        if self._budgets:
+            phases.append(("budgets", self._check_budgets))
+
+        monitors = []
+        # memory monitor goes first, so that the snapshots are taken after
+        # the profiler is disabled
+        memory = profiling.MemoryMonitor() if self.options.memory else None
+        if memory:
+            monitors.append(memory)
+        if self.options.profile:
+            monitors.append(profiling.PhaseProfiler(self.options.profile))
+
+        node_profile = (rest.NodeProfile() if self.options.node_profile
+                        else None)
+        previous_node_profile = rest.set_node_profile(node_profile)
+        tracer = trace.Tracer() if self.options.trace else trace.TRACER
+        previous = trace.set_tracer(tracer)
+        try:
+            with tracer.span("build", "build", path=self.path):
+                for name, method in phases:
+                    with self._phase(name, tracer, monitors):
+                        method()
+        finally:
+            trace.set_tracer(previous)
+            rest.set_node_profile(previous_node_profile)
+            if memory:
+                memory.stop()
+
+        self.stats.articles = len(self.articles)
+        self.stats.finish()
+        if _is_enabled(self._cfg['minify_html']):
+            print("HTML minification saved %d bytes." % self.minified_bytes)
+        if self.options.timings:
+            self.stats.print_timings()
+        if self.options.timings_json:
+            self.stats.write_json(self.options.timings_json)
+        if self.options.trace:
+            tracer.write(self.options.trace)
+        for monitor in monitors:
+            monitor.report()
+        if node_profile:
+            node_profile.report()
+        if self.options.slowest:
+            self.stats.print_slowest(self.options.slowest)
+        if self.options.article_budget is not None:
+            for fname, total in self.stats.over_budget(
+                    self.options.article_budget):
+                self.stats.errors.append("Article `%s' took %.3f s, over the "
+                                         "time budget of %.3f s" %
+                                         (fname, total,
+                                          self.options.article_budget))
+        if self.options.prometheus:
+            self.stats.write_prometheus(self.options.prometheus)
+        if self.options.history:
+            stats.append_history(os.path.join(self.path, HISTORY_FNAME),
+                                 self._history_record())
+
+        for error in self.stats.errors:
+            print(error)
+        print("…failed." if self.stats.errors else "…all done.")
+        return self.stats
+
+    def _history_record(self):
+        """Return record of the finished build for the build history"""
+        build_dir = os.path.join(self.path, "build")
+        search_bytes = sum(os.path.getsize(os.path.join(build_dir, fname))
+                           for fname in os.listdir(build_dir)
+                           if fname.startswith("search") and
+                           fname.endswith((".json", ".idx")))
+        # size of the whole output, not only of the files written by this
+        # build, which depends on how many of them were up to date
+        output_bytes = sum(os.path.getsize(os.path.join(root, fname))
+                           for root, _, files in os.walk(build_dir)
+                           for fname in files)
+        return {"time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "commit": _git_commit(self.path),
+                "articles": self.stats.articles,
+                "wall": self.stats.wall,
+                "cpu": self.stats.cpu,
+                "files_written": self.stats.files_written,
+                "bytes_written": self.stats.bytes_written,
+                "output_bytes": output_bytes,
+                "search_bytes": search_bytes,
+                "errors": len(self.stats.errors),
+                "phases": {name: wall for name, wall, _ in self.stats.phases}}
+
+    @contextlib.contextmanager
+    def _phase(self, name, tracer, monitors):
+        """Context manager measuring the build phase with the stats, the
+        tracer and the optional profilers"""
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(self.stats.phase(name))
+            stack.enter_context(tracer.span(name, "phase"))
+            for monitor in monitors:
+                stack.enter_context(monitor.phase(name))
+            yield
+
+    def _prepare_build_dir(self):
+        """Create build directory with the style and scripts, if it doesn't
+        exist yet"""
+        if os.path.exists(os.path.join(self.path, "build")):
+            return
+
+        os.makedirs(os.path.join(self.path, "build", "images"))
+        shutil.copytree(os.path.join(self.path, ".css"),
+                        os.path.join(self.path, "build/css"))
+        shutil.copytree(os.path.join(self.path, ".js"),
+                        os.path.join(self.path, "build/js"))
+        for fname in os.listdir(os.path.join(self.path, "build", "css")):
+            if fname.endswith(".css"):
+                _minify_css(os.path.join(self.path, "build", "css", fname))
+
+    def _load_caches(self):
+        """Read the data stored by the previous build"""
+        self._load_fragments()
+        self._load_dependencies()
+
+    def _store_caches(self):
+        """Store the data for the next build"""
+        self._store_fragments()
+        self._store_dependencies()
+
+    def _copy_files(self):
+        """Copy all the other files and directories content from articles
+        directory, besides rst files. Files, which size and modification
+        time are the same as of their copy, are skipped"""
+        favicon = os.path.join(self.path, "build", "images", "favicon.ico")
         _, dirs, files = next(os.walk(os.path.join(self.path, "articles")))
         for dirname in dirs:
-            if os.path.exists(os.path.join(self.path, "build", dirname)):
-                shutil.rmtree(os.path.join(self.path, "build", dirname))
-            shutil.copytree(os.path.join(self.path, "articles", dirname),
-                            os.path.join(self.path, "build", dirname))
+            self._copy_tree(os.path.join(self.path, "articles", dirname),
+                            os.path.join(self.path, "build", dirname),
+                            {favicon})
         for fname in files:
             if fname.lower().endswith("rst"):
                 continue
-
-            if os.path.exists(os.path.join(self.path, "build", fname)):
-                os.unlink(os.path.join(self.path, "build", fname))
-            shutil.copy(os.path.join(self.path, "articles", fname),
-                        os.path.join(self.path, "build", fname))
-
-        shutil.copy(os.path.join(self.path, ".templates/favicon.ico"),
-                    os.path.join(self.path, "build/images"))
-        self._tag_pages()
-        self._index()
-        self._archive()
-        self._rss()
-        print("…all done.")
-        return 0
+            self._copy_file(os.path.join(self.path, "articles", fname),
+                            os.path.join(self.path, "build", fname))
+
+        os.makedirs(os.path.dirname(favicon), exist_ok=True)
+        self._copy_file(os.path.join(self.path, ".templates/favicon.ico"),
+                        favicon)
+
+    def _copy_tree(self, src, dst, keep=()):
+        """Make dst directory a copy of the src directory. Files which are
+        not in src anymore are removed, unless they are in keep"""
+        copied = set(keep)
+        for root, _, files in os.walk(src):
+            target = os.path.normpath(os.path.join(dst,
+                                                   os.path.relpath(root, src)))
+            os.makedirs(target, exist_ok=True)
+            for fname in files:
+                copied.add(os.path.join(target, fname))
+                self._copy_file(os.path.join(root, fname),
+                                os.path.join(target, fname))
+
+        for root, _, files in os.walk(dst):
+            for fname in files:
+                if os.path.join(root, fname) not in copied:
+                    os.unlink(os.path.join(root, fname))
+
+    def _copy_file(self, src, dst):
+        """Copy the file with its modification time, unless the copy is up
+        to date"""
+        if os.path.exists(dst):
+            src_stat, dst_stat = os.stat(src), os.stat(dst)
+            if (src_stat.st_size == dst_stat.st_size and
+                    src_stat.st_mtime_ns == dst_stat.st_mtime_ns):
+                self.stats.skipped()
+                return
+            os.unlink(dst)
+
+        shutil.copy2(src, dst)
+        self._written(dst)
+
+    def _written(self, *fnames):
+        """Count the files written into the build directory"""
+        for fname in fnames:
+            self.stats.written(os.path.getsize(fname))
 
     def _rss(self):
         """Write rss.xml file"""
@@ -153,17 +573,21 @@ class Kiroku:
             return
 
         print("Writing RSS file…")
-        rssobj = rss.Rss(self._cfg, self.path)
+        with self._templ.tracker.page("rss.xml"):
+            rssobj = rss.Rss(self._cfg, self.path, self._templ)
+
+            for art in self.articles[:10]:
+                data = {"article_title": art.title,
+                        "article_link": art.html_fname,
+                        "pub_date": art.created_rfc822(),
+                        "item_desc": art.get_short_body()}
+                rssobj.add(data)
 
-        for art in self.articles[:10]:
-            data = {"article_title": art.title,
-                    "article_link": art.html_fname,
-                    "pub_date": art.created_rfc822(),
-                    "item_desc": art.get_short_body()}
-            rssobj.add(data)
+            content = rssobj.get()
 
         with open(os.path.join(self.path, "build", "rss.xml"), "w") as fobj:
-            fobj.write(rssobj.get())
+            fobj.write(content)
+        self._written(os.path.join(self.path, "build", "rss.xml"))
 
     def _join_tags(self, tags):
         """Parse tags and return them as string of tags separated with comma"""
@@ -173,46 +597,143 @@ class Kiroku:
                 for tag_ in tags]
         return ', '.join(data)
 
+    def _art_tags(self, art):
+        """Return (cached) tags links for the article"""
+        self._templ.tracker.use("article_tag")
+        return art.fragment("tags", lambda: self._join_tags(art.tags))
+
+    def _headline(self, art):
+        """Return (cached) headline HTML for the article"""
+        self._templ.tracker.use("headline", "article_tag")
+        return art.fragment("headline", lambda: self._templ(
+            "headline", {"article_url": art.html_fname,
+                         "title": art.title,
+                         "datetime": art.created_rfc3339(),
+                         "human_date": art.created_short(),
+                         "tags": self._art_tags(art)}))
+
     def _create_json_data(self):
         """Create data utilized on the client side - that includes search
         data, articles metadata (titles, links, tags dates and so on),
         template for the search output, etc"""
         print("Writing json data files…")
-        with open(os.path.join(self.path, "build", "templates.json"),
-                  "w") as fobj:
-            json.dump({"w": "<h1>%(i18n_search_progress)s</h1>" % self._cfg,
-                       "r": "<h1>%(i18n_search_results)s</h1>" % self._cfg,
-                       "t":  self._cfg["i18n_search_results_ttile"] +
-                       " - " + self._cfg["site_name"],
-                       "n": "<h1>%(i18n_search_not_found)s</h1>" % self._cfg},
-                      fobj, ensure_ascii=False)
-
         words = {"a": [],  # article data
                  "w": {}}  # word list
         _ids = []
-        for art in self.articles:
-            art_tags = self._join_tags(art.tags)
+        art_words_list = []
+        snippets = _is_enabled(self._cfg['search_snippets'])
+        snippets_dir = os.path.join(self.path, "build", "snippets")
+        if os.path.exists(snippets_dir):
+            shutil.rmtree(snippets_dir)
+        if snippets:
+            os.makedirs(snippets_dir)
+        chunk = {}
 
-            words['a'].append(self._templ("headline",
-                                          {"article_url": art.html_fname,
-                                           "title": art.title,
-                                           "datetime": art.created_rfc3339(),
-                                           "human_date": art.created_short(),
-                                           "tags": art_tags}))
+        for art in self.articles:
+            words['a'].append(self._headline(art))
 
             _ids.append(art.html_fname)
             idx = _ids.index(art.html_fname)
 
-            art_words = art.get_words()
+            with self.stats.article_step(art.fname, "words"):
+                stripped = art.strip()
+                art_words = stripped.get_data()
+            art_words_list.append((idx, art_words))
+
+            if snippets and idx == len(_ids) - 1:
+                if chunk and (idx // search.SNIPPET_CHUNK !=
+                              min(chunk) // search.SNIPPET_CHUNK):
+                    self._save_snippets(chunk)
+                    chunk = {}
+                chunk[idx] = stripped
+
             for word in art_words:
                 if word not in words["w"]:
                     words["w"][word] = [(idx, art_words[word])]
                 else:
                     words["w"][word].append((idx, art_words[word]))
 
-        with open(os.path.join(self.path, "build", "search.json"),
-                  "w") as fobj:
-            json.dump(words, fobj, ensure_ascii=False)
+        if chunk:
+            self._save_snippets(chunk)
+
+        templates = {"w": "<h1>%(i18n_search_progress)s</h1>" % self._cfg,
+                     "r": "<h1>%(i18n_search_results)s</h1>" % self._cfg,
+                     "t":  self._cfg["i18n_search_results_ttile"] +
+                     " - " + self._cfg["site_name"],
+                     "n": "<h1>%(i18n_search_not_found)s</h1>" % self._cfg}
+
+        # vocabulary filter, so that the queries with unknown words can be
+        # rejected on the client side without downloading search.json. It's
+        # capped in size, and left out if it would pass most of the words.
+        bloom = search.BloomFilter(len(words["w"]),
+                                   max_bytes=search.BLOOM_MAX_BYTES)
+        if bloom.error_rate() <= search.BLOOM_MAX_ERROR:
+            for word in words["w"]:
+                bloom.add(word)
+            templates["b"] = bloom.to_dict()
+
+        if snippets:
+            templates["c"] = search.SNIPPET_CHUNK
+
+        if self._cfg['search_service']:
+            templates["s"] = self._cfg['search_service']
+            search.write_binary_index(os.path.join(self.path, "build",
+                                                   "search.idx"), words)
+            self._written(os.path.join(self.path, "build", "search.idx"))
+
+        partitions = self._search_partitions(words["a"], art_words_list)
+        if partitions:
+            templates["p"] = sorted(partitions)
+
+        fnames = {"templates.json": templates, "search.json": words}
+        for scope, data in partitions.items():
+            fnames["search-%s.json" % scope] = data
+
+        for fname, data in fnames.items():
+            with open(os.path.join(self.path, "build", fname), "w") as fobj:
+                json.dump(data, fobj, ensure_ascii=False)
+            self._written(os.path.join(self.path, "build", fname))
+
+    def _save_snippets(self, chunk):
+        """Write compressed chunk of the articles plain text, used for
+        displaying the search result snippets"""
+        fname = os.path.join(self.path, "build", "snippets", "%d.json.gz" %
+                             (min(chunk) // search.SNIPPET_CHUNK))
+        search.write_snippet_chunk(fname, chunk)
+        self._written(fname)
+
+    def _search_partitions(self, headlines, art_words_list):
+        """Return smaller search indexes scoped to the single tag and/or year,
+        depending on search_partitions option. Keys are the partition names,
+        which are either tag-<tag_url> or the year."""
+        kinds = _split_option(self._cfg['search_partitions'])
+        if not kinds:
+            return {}
+
+        scopes = collections.defaultdict(list)
+        for art, (idx, art_words) in zip(self.articles, art_words_list):
+            if "tag" in kinds:
+                for tag in art.tags:
+                    scopes["tag-" + tag.translate(misc.TR_TABLE)].append(
+                        (idx, art_words))
+            if "year" in kinds:
+                scopes[str(art.created.year)].append((idx, art_words))
+
+        snippets = _is_enabled(self._cfg['search_snippets'])
+        partitions = {}
+        for scope, items in scopes.items():
+            data = {"a": [], "w": {}}
+            if snippets:
+                # global article ids, for fetching the snippets
+                data["i"] = [idx for idx, _ in items]
+            for local_idx, (idx, art_words) in enumerate(items):
+                data["a"].append(headlines[idx])
+                for word in art_words:
+                    data["w"].setdefault(word, []).append(
+                        (local_idx, art_words[word]))
+            partitions[scope] = data
+
+        return partitions
 
     def _tag_pages(self):
         """Create pages for the tag links"""
@@ -224,88 +745,138 @@ class Kiroku:
                 tags[tag].append(art)
 
         for tag in tags:
-            titles = []
-            for art in tags[tag]:
-                art_tags = self._join_tags(art.tags)
-                titles.append(self._templ("headline",
-                                          {"article_url": art.html_fname,
-                                           "title": art.title,
-                                           "datetime": art.created_rfc3339(),
-                                           "human_date": art.created_short(),
-                                           "tags": art_tags}))
-
             title = self._cfg['i18n_art_tags'] % tag
 
-            with open(os.path.join(self.path, "build", "tag-%s.html" %
-                                   tag.translate(misc.TR_TABLE)), "w") as fobj:
-
+            with self._templ.tracker.recording() as uses:
                 data = {"title": title + " - ",
                         "header": self._templ("header", {"title": title}),
-                        "body": " ".join(titles),
                         "class_index": "current",
                         "class_arch": "",
                         "class_about": "",
                         "footer": "",
-                        "tag_cloud": self.tag_cloud}
-
-                fobj.write(self._templ("main", data))
+                        "tag_cloud": self._tag_cloud_slot()}
+            self._write_pages("tag-%s" % tag.translate(misc.TR_TABLE),
+                              tags[tag], int(self._cfg['page_size']), data,
+                              self._headline, uses)
 
     def _index(self):
         """Create index.html for the main site entry"""
         print("Creating `index.html'…")
 
-        titles = []
-        for art in self.articles[:5]:
-            short_body = art.body.split("<!-- more -->")[0]
-            art_tags = self._join_tags(art.tags)
-
-            titles.append(self._templ("article_short",
-                                      {"article_url": art.html_fname,
-                                       "title": art.title,
-                                       "datetime": art.created_rfc3339(),
-                                       "human_date": art.created_short(),
-                                       "short_body": short_body,
-                                       "tags": art_tags}))
-
-        with open(os.path.join(self.path, "build", "index.html"), "w") as fobj:
-            fobj.write(self._templ("main",
-                                   {"title": "",
-                                    "header": "",
-                                    "body": " ".join(titles),
-                                    "class_index": "current",
-                                    "class_arch": "",
-                                    "class_about": "",
-                                    "footer": "",
-                                    "tag_cloud": self.tag_cloud}))
+        # the older articles are on the archive pages, so the main page is
+        # never paginated
+        articles = self.articles[:int(self._cfg['index_size'])]
+
+        with self._templ.tracker.recording() as uses:
+            data = {"title": "",
+                    "header": "",
+                    "class_index": "current",
+                    "class_arch": "",
+                    "class_about": "",
+                    "footer": "",
+                    "tag_cloud": self._tag_cloud_slot()}
+        self._write_pages("index", articles, 0, data, self._article_short,
+                          uses)
+
+    def _article_short(self, art):
+        """Return the short version of the article for the index pages"""
+        return self._templ("article_short",
+                           {"article_url": art.html_fname,
+                            "title": art.title,
+                            "datetime": art.created_rfc3339(),
+                            "human_date": art.created_short(),
+                            "short_body": art.get_short_body(),
+                            "tags": self._art_tags(art)})
 
     def _archive(self):
         """Create archive.html for the site"""
         print("Create archive page…")
 
-        titles = []
-        for art in self.articles[5:]:
-            art_tags = self._join_tags(art.tags)
-            titles.append(self._templ("headline",
-                                      {"article_url": art.html_fname,
-                                       "title": art.title,
-                                       "datetime": art.created_rfc3339(),
-                                       "human_date": art.created_short(),
-                                       "tags": art_tags}))
-
         title = self._cfg['i18n_archives']
 
-        with open(os.path.join(self.path, "build", "archives.html"),
-                  "w") as fobj:
-            fobj.write(self._templ("main",
-                                   {"title": title + " - ",
-                                    "header": self._templ("header",
-                                                          {"title": title}),
-                                    "body": " ".join(titles),
-                                    "class_index": "",
-                                    "class_arch": "current",
-                                    "class_about": "",
-                                    "footer": "",
-                                    "tag_cloud": self.tag_cloud}))
+        with self._templ.tracker.recording() as uses:
+            footer = ""
+            if _split_option(self._cfg['archive_partitions']):
+                footer = self._templ("archive_link",
+                                     {"url": ARCHIVE_YEARS_FNAME,
+                                      "label":
+                                      self._cfg['i18n_archive_dates']})
+            data = {"title": title + " - ",
+                    "header": self._templ("header", {"title": title}),
+                    "class_index": "",
+                    "class_arch": "current",
+                    "class_about": "",
+                    "footer": footer,
+                    "tag_cloud": self._tag_cloud_slot()}
+        self._write_pages("archives",
+                          self.articles[int(self._cfg['index_size']):],
+                          int(self._cfg['page_size']), data, self._headline,
+                          uses)
+
+    def _date_archives(self):
+        """Create per year and/or per month archive pages, depending on the
+        archive_partitions option, and the year index linking them. All of
+        them are made in single pass over sorted articles, with only one
+        year worth of the articles kept at a time."""
+        kinds = _split_option(self._cfg['archive_partitions'])
+        if not kinds:
+            return
+
+        print("Creating date archive pages…")
+
+        years = []
+        # templates of the year index, rendered along with the other pages
+        years_uses = set()
+        for year, arts in itertools.groupby(
+                self.articles, key=lambda art: art.created.year):
+            arts = list(arts)
+            months = []
+            for month, month_arts in itertools.groupby(
+                    arts if "month" in kinds else [],
+                    key=lambda art: art.created.month):
+                label = datetime.date(year, month, 1).strftime("%B")
+                fname = "archives_%d_%02d.html" % (year, month)
+                self._archive_page(fname, "%s %d" % (label, year),
+                                   (self._headline(art)
+                                    for art in month_arts))
+                with self._templ.tracker.recording(years_uses):
+                    months.append(self._templ("archive_link",
+                                              {"url": fname,
+                                               "label": label}))
+
+            year_label = str(year)
+            if "year" in kinds:
+                fname = "archives_%d.html" % year
+                self._archive_page(fname, year_label,
+                                   (self._headline(art) for art in arts))
+                with self._templ.tracker.recording(years_uses):
+                    year_label = self._templ("archive_link",
+                                             {"url": fname, "label": year})
+            with self._templ.tracker.recording(years_uses):
+                years.append(self._templ("archive_year",
+                                         {"year": year_label,
+                                          "count": len(arts),
+                                          "months": " ".join(months)}))
+
+        self._archive_page(ARCHIVE_YEARS_FNAME, None, years, years_uses)
+
+    def _archive_page(self, fname, label, body, uses=()):
+        """Write archive page titled with the label, out of the body items.
+        Uses are the templates the body items were rendered from, if they
+        are not rendered lazily."""
+        title = self._cfg['i18n_archives']
+        if label:
+            title = "%s: %s" % (title, label)
+
+        with self._templ.tracker.recording(set(uses)) as uses:
+            data = {"title": title + " - ",
+                    "header": self._templ("header", {"title": title}),
+                    "class_index": "",
+                    "class_arch": "current",
+                    "class_about": "",
+                    "footer": "",
+                    "tag_cloud": self._tag_cloud_slot()}
+        self._write_page(fname, data, _joined(body), uses)
 
     def _save(self):
         """
@@ -313,28 +884,96 @@ class Kiroku:
         """
         print("Saving articles…")
         for art in self.articles:
-            art_tags = self._join_tags(art.tags)
-            header = self._templ("article_header",
-                                 {"title": art.title,
-                                  "datetime": art.created_rfc3339(),
-                                  "human_date": art.created_short()})
-            footer = self._templ("article_footer",
-                                 {'rfc_date': art.created_rfc3339(),
-                                  "datetime": art.created_detailed(),
-                                  "human_date": art.created_detailed(),
-                                  "tags": art_tags})
-
-            with open(os.path.join(self.path, "build", art.html_fname),
-                      "w") as fobj:
-                fobj.write(self._templ("main",
-                                       {"title": art.title + " - ",
-                                        "header": header,
-                                        "body": art.body,
-                                        "class_index": "current",
-                                        "class_arch": "",
-                                        "class_about": "",
-                                        "footer": footer,
-                                        "tag_cloud": self.tag_cloud}))
+            with self._templ.tracker.recording() as uses:
+                art_tags = self._art_tags(art)
+                header = self._templ("article_header",
+                                     {"title": art.title,
+                                      "datetime": art.created_rfc3339(),
+                                      "human_date": art.created_short()})
+                footer = self._templ("article_footer",
+                                     {'rfc_date': art.created_rfc3339(),
+                                      "datetime": art.created_detailed(),
+                                      "human_date": art.created_detailed(),
+                                      "tags": art_tags})
+                data = {"title": art.title + " - ",
+                        "header": header,
+                        "class_index": "current",
+                        "class_arch": "",
+                        "class_about": "",
+                        "footer": footer,
+                        "tag_cloud": self._tag_cloud_slot()}
+
+            with self.stats.article_step(art.fname, "write"):
+                size = self._write_page(art.html_fname, data, (art.body,),
+                                        uses)
+            self.stats.article_size(art.fname, output=size)
+
+    def _write_page(self, fname, data, body, uses=()):
+        """Write the page into the build directory using main template.
+        Body is an iterable of strings, which are streamed into the file
+        between the parts of the template, without joining them into one
+        string. If minify_html option is set, page is minified on the way to
+        the file. Return number of written bytes. Uses are the templates the
+        data was rendered from; they are recorded as the dependencies of the
+        page together with the templates used for the body."""
+        data["body"] = body
+        with self._templ.tracker.page(fname):
+            self._templ.tracker.use(*uses)
+            chunks = self._templ.get("main").chunks(data, "body")
+            minifier = None
+            if _is_enabled(self._cfg['minify_html']):
+                minifier = minify.HtmlMinifier()
+                chunks = minifier.filter(chunks)
+
+            with trace.span(fname, "write"), \
+                    open(os.path.join(self.path, "build", fname),
+                         "wb") as fobj:
+                fobj.writelines(chunks)
+                size = fobj.tell()
+        self.stats.written(size)
+        self.page_sizes[fname] = size
+
+        if minifier:
+            self.minified_bytes += minifier.saved
+        return size
+
+    def _write_pages(self, base, items, size, data, render, uses=()):
+        """Write the items rendered by render callable into the pages of size
+        items each - base.html, base-2.html and so on, with the pagination
+        links at the bottom. Pages are rendered and written one by one. If
+        size is zero, all of the items goes into single base.html page. Uses
+        are the templates the data was rendered from."""
+        count = max(math.ceil(len(items) / size), 1) if size else 1
+        pages = _pages(items, size) if size and items else [items]
+
+        for num, page in enumerate(pages, 1):
+            body = _joined(render(item) for item in page)
+            page_uses = uses
+            if count > 1:
+                with self._templ.tracker.recording(set(uses)) as page_uses:
+                    pagination = self._pagination(base, num, count)
+                body = itertools.chain(body, (pagination,))
+            self._write_page(_page_fname(base, num), dict(data), body,
+                             page_uses)
+
+    def _pagination(self, base, num, count):
+        """Return links to the newer and older pages for the page num out of
+        count pages"""
+        newer = older = ""
+        if num > 1:
+            newer = self._templ("pagination_link",
+                                {"url": _page_fname(base, num - 1),
+                                 "class": "newer",
+                                 "label": self._cfg['i18n_newer']})
+        if num < count:
+            older = self._templ("pagination_link",
+                                {"url": _page_fname(base, num + 1),
+                                 "class": "older",
+                                 "label": self._cfg['i18n_older']})
+        return self._templ("pagination", {"newer": newer,
+                                          "older": older,
+                                          "page": num,
+                                          "pages": count})
 
     def _walk(self):
         """Walk through the flat list of the articles and gather all of the
@@ -356,6 +995,46 @@ class Kiroku:
                                reverse=True)
         print("…done. Articles found: %d" % len(self.articles))
 
+    def _writer_report(self):
+        """Print size of the article bodies produced by each of the
+        available HTML writers"""
+        writers = sorted(rest.WRITERS)
+        row = "%-40s" + " %10s" * (len(writers) + 1)
+
+        print("Article body size (bytes) per writer:")
+        print(row % tuple(["article"] + writers + ["diff"]))
+
+        totals = [0] * len(writers)
+        for art in self.articles:
+            with open(art.fname) as fobj:
+                source = fobj.read()
+
+            sizes = []
+            for name in writers:
+                if name == self._cfg['html_writer']:
+                    html = art.body
+                else:
+                    html = self._publish_uncounted(source, name)
+                sizes.append(len(html.encode("utf-8")))
+
+            totals = [total + size for total, size in zip(totals, sizes)]
+            print(row % tuple([os.path.basename(art.fname)[:40]] + sizes +
+                              ["%+d" % (sizes[-1] - sizes[0])]))
+
+        print(row % tuple(["total"] + totals +
+                          ["%+d" % (totals[-1] - totals[0])]))
+
+    @staticmethod
+    def _publish_uncounted(source, writer):
+        """Return article body published with the writer, which is left out
+        of the node profile, since the article is already counted"""
+        node_profile = rest.set_node_profile(None)
+        try:
+            html, _ = rest.BlogArticle(source, writer).publish()
+        finally:
+            rest.set_node_profile(node_profile)
+        return html
+
     def _about(self):
         """Save special page "about" """
         if not self._about_fname:
@@ -365,32 +1044,115 @@ class Kiroku:
         print("Generating about page…")
 
         with open(self._about_fname) as fobj:
-            html, dummy = rest.BlogArticle(fobj.read()).publish()
+            html, dummy = rest.BlogArticle(fobj.read(),
+                                           self._cfg['html_writer']).publish()
 
         title = self._cfg["i18n_about"]
 
-        with open(os.path.join(self.path, "build", "about.html"), "w") as fobj:
-            fobj.write(self._templ("main",
-                                   {"title": title + " - ",
-                                    "header": self._templ("header",
-                                                          {"title": title}),
-                                    "body": html,
-                                    "class_index": "",
-                                    "class_arch": "",
-                                    "class_about": "current",
-                                    "footer": "",
-                                    "tag_cloud": self.tag_cloud}))
+        with self._templ.tracker.recording() as uses:
+            data = {"title": title + " - ",
+                    "header": self._templ("header", {"title": title}),
+                    "class_index": "",
+                    "class_arch": "",
+                    "class_about": "current",
+                    "footer": "",
+                    "tag_cloud": self._tag_cloud_slot()}
+        self._write_page("about.html", data, (html,), uses)
 
     def _harvest(self, fname):
         """Gather all the necessary info for the article"""
         print("Processing `%s'" % fname)
         art = article.Article(fname, self._cfg)
-        art.read()
+        with trace.span(os.path.basename(fname), "article"), \
+                self.stats.article_step(fname, "publish"):
+            art.read()
+        self.stats.article_size(fname, source=os.path.getsize(fname))
         self.articles.append(art)
 
+        cached = self._fragments.get(os.path.basename(fname))
+        hit = bool(cached) and cached["stat"] == _get_stat(fname)
+        if hit:
+            art.fragments.update(cached["fragments"])
+        self.stats.cached(hit)
+
         for tag in art.tags:
             self.tags[tag].append(fname)
 
+    def _fragments_signature(self):
+        """Return hash of everything but the articles, the fragments depend
+        on - the config and the templates used for rendering them"""
+        sha = hashlib.sha1(json.dumps(self._cfg, sort_keys=True,
+                                      default=str).encode("utf-8"))
+        for name in FRAGMENT_TEMPLATES:
+            # read through the Template, so that the templates are recorded
+            # in its sources even if all of the fragments come from cache
+            try:
+                self._templ.get(name)
+                digest = self._templ.sources[name][1]
+            except OSError:
+                digest = ""
+            sha.update(("%s:%s" % (name, digest)).encode("utf-8"))
+        return sha.hexdigest()
+
+    def _load_fragments(self):
+        """Read article fragments cached by the previous build. Cache is
+        dropped entirely if the config or any of the templates used for the
+        fragments has changed"""
+        self._fragments = {}
+        try:
+            with open(os.path.join(self.path, FRAGMENTS_CACHE)) as fobj:
+                data = json.load(fobj)
+        except (IOError, ValueError):
+            return
+
+        if data.get("signature") == self._fragments_signature():
+            self._fragments = data["articles"]
+
+    def _store_fragments(self):
+        """Save article fragments for the next build"""
+        articles = {}
+        for art in self.articles:
+            if art.fname and os.path.exists(art.fname):
+                articles[os.path.basename(art.fname)] = {
+                    "stat": _get_stat(art.fname),
+                    "fragments": art.fragments}
+
+        fname = os.path.join(self.path, FRAGMENTS_CACHE)
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        with open(fname, "w") as fobj:
+            json.dump({"signature": self._fragments_signature(),
+                       "articles": articles}, fobj, ensure_ascii=False)
+
+    def _load_dependencies(self):
+        """Read the templates used by the pages in the previous build, and
+        report the pages, which are affected by changed templates. It's
+        informative only, all of the pages are written anyway."""
+        try:
+            with open(os.path.join(self.path, DEPENDENCIES_CACHE)) as fobj:
+                data = json.load(fobj)
+        except (IOError, ValueError):
+            return
+
+        changed = sorted(name for name, (fname, digest)
+                         in data["templates"].items()
+                         if fname != self._templ.find(name) or
+                         self._templ.registry.changed(fname, digest))
+        if changed:
+            pages = [page for page, used in data["pages"].items()
+                     if not set(used).isdisjoint(changed)]
+            print("Templates changed since last build: %s (used by %d "
+                  "pages)" % (", ".join(changed), len(pages)))
+
+    def _store_dependencies(self):
+        """Save the templates used by every page for the next build"""
+        fname = os.path.join(self.path, DEPENDENCIES_CACHE)
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        with open(fname, "w") as fobj:
+            json.dump({"templates": self._templ.sources,
+                       "pages": {page: sorted(used) for page, used
+                                 in self._templ.tracker.pages.items()}},
+                      fobj, ensure_ascii=False)
+
     def _calculate_tag_cloud(self):
         """Calculate tag cloud."""
         print("Calculating tag cloud…")
@@ -418,16 +1180,107 @@ class Kiroku:
             self.tag_cloud[tag] = size
 
         tag_cloud = []
-        for key in sorted(self.tags):
-            tag_url = key.translate(misc.TR_TABLE)
-            tag_cloud.append(self._templ("tag",
-                                         {"size": self.tag_cloud[key],
-                                          "tag": key,
-                                          "tag_url": tag_url,
-                                          "count": tag_weight[key]}))
+        with self._templ.tracker.recording(self._tag_cloud_uses):
+            for key in sorted(self.tags):
+                tag_url = key.translate(misc.TR_TABLE)
+                tag_cloud.append(self._templ("tag",
+                                             {"size": self.tag_cloud[key],
+                                              "tag": key,
+                                              "tag_url": tag_url,
+                                              "count": tag_weight[key]}))
 
         self.tag_cloud = " ".join(tag_cloud)
 
+    def _read_budgets(self):
+        """Return dictionary of the output size budgets set in the config,
+        keyed by the option name. Raise ValueError with the message for the
+        user, if any of them is not a valid size"""
+        budgets = {}
+        for key, _ in BUDGETS:
+            try:
+                budget = _parse_size(self._cfg[key])
+            except ValueError:
+                raise ValueError("Invalid value `%s' of `%s' option. Use "
+                                 "number of bytes, optionally followed by k "
+                                 "or M unit." % (self._cfg[key].strip(), key))
+            if budget is not None:
+                budgets[key] = budget
+        return budgets
+
+    def _budget_sizes(self, key):
+        """Return list of (name, size) tuples of the output checked against
+        the budget of the given config key"""
+        build_dir = os.path.join(self.path, "build")
+        if key == "budget_page":
+            return list(self.page_sizes.items())
+        if key == "budget_search":
+            fnames = [fname for fname in os.listdir(build_dir)
+                      if fname.startswith("search") and
+                      (fname.endswith(".json") or fname == "search.idx")]
+            snippets_dir = os.path.join(build_dir, "snippets")
+            if os.path.isdir(snippets_dir):
+                fnames.extend(os.path.join("snippets", fname)
+                              for fname in os.listdir(snippets_dir))
+            return [(fname, os.path.getsize(os.path.join(build_dir, fname)))
+                    for fname in fnames]
+        if key == "budget_assets":
+            return [("css and js", sum(
+                os.path.getsize(os.path.join(root, fname))
+                for dirname in ("css", "js")
+                for root, _, files in os.walk(os.path.join(build_dir,
+                                                           dirname))
+                for fname in files))]
+        return [(TAG_CLOUD_FNAME, len((self.tag_cloud or "").encode("utf-8")))]
+
+    def _check_budgets(self):
+        """Check size of the output against the budgets set in the config.
+        Biggest files over the exceeded budget are reported, and the build
+        fails"""
+        for key, label in BUDGETS:
+            budget = self._budgets.get(key)
+            if budget is None:
+                continue
+
+            over = sorted(((size, name) for name, size in
+                           self._budget_sizes(key) if size > budget),
+                          reverse=True)
+            if not over:
+                continue
+
+            print("%s budget of %d bytes exceeded by %d file(s):" %
+                  (label, budget, len(over)))
+            for size, name in over[:BUDGET_OFFENDERS]:
+                print("  %s: %d bytes (+%d)" % (name, size, size - budget))
+            self.stats.errors.append("%s budget of %d bytes exceeded" %
+                                     (label, budget))
+
+    def _save_tag_cloud(self):
+        """Write the tag cloud into separate file, unless it should be
+        placed directly on every page"""
+        if self._cfg['tag_cloud_mode'] not in ("ssi", "script"):
+            return
+
+        fname = os.path.join(self.path, "build", TAG_CLOUD_FNAME)
+        with self._templ.tracker.page(TAG_CLOUD_FNAME), \
+                open(fname, "w", encoding="utf-8") as fobj:
+            self._templ.tracker.use(*self._tag_cloud_uses)
+            fobj.write(self.tag_cloud)
+        self._written(fname)
+
+    def _tag_cloud_slot(self):
+        """Return the tag cloud markup for the pages. Depending on the
+        tag_cloud_mode option, it is either the tag cloud itself (inline),
+        server side include directive (ssi), or the small script which
+        loads the tag cloud file (script)"""
+        data = {"server_root": self._cfg['server_root'],
+                "fname": TAG_CLOUD_FNAME}
+        if self._cfg['tag_cloud_mode'] == "ssi":
+            return TAG_CLOUD_SSI % data
+        if self._cfg['tag_cloud_mode'] == "script":
+            return TAG_CLOUD_SCRIPT % data
+        self._templ.tracker.use(*self._tag_cloud_uses)
+        return self.tag_cloud
+
     def init(self):
         """Initialize given directory with details"""
         if os.path.exists(self.path):
@@ -471,8 +1324,136 @@ def parse_commandline(args=None):
                                      "provided, default `articles' will be "
                                      "processed.")
     build_cmd.add_argument("path", default=".", nargs='?')
+    build_cmd.add_argument("--timings", action="store_true",
+                           help="Print wall and CPU time of every build "
+                           "phase")
+    build_cmd.add_argument("--timings-json", metavar="FILE",
+                           help="Write build timings, number of articles, "
+                           "written and skipped files and bytes into the "
+                           "JSON file")
+    build_cmd.add_argument("--trace", metavar="FILE",
+                           help="Record build phases, articles parsing and "
+                           "translation, template renders and file writes "
+                           "into the FILE in Chrome trace event format")
+    build_cmd.add_argument("--profile", metavar="DIR",
+                           help="Profile every build phase and write the "
+                           "results into .pstats files in the DIR")
+    build_cmd.add_argument("--memory", action="store_true",
+                           help="Trace memory allocations, report traced "
+                           "memory and peak RSS after every build phase and "
+                           "the top allocation sites")
+    build_cmd.add_argument("--slowest", metavar="N", type=int, default=0,
+                           help="Print N slowest articles with the time "
+                           "spent in parsing, words extraction and page "
+                           "write, and their source and output size")
+    build_cmd.add_argument("--article-budget", metavar="SECONDS",
+                           type=float, help="Fail the build, if processing "
+                           "of any article takes longer than SECONDS")
+    build_cmd.add_argument("--node-profile", action="store_true",
+                           help="Print number of the reST nodes and time "
+                           "spent in translating them into HTML per node "
+                           "type, and time spent in the docutils transforms")
+    build_cmd.add_argument("--no-history", dest="history",
+                           action="store_false",
+                           help="Don't append the build record to the "
+                           "%s file" % HISTORY_FNAME)
+    build_cmd.add_argument("--prometheus", metavar="FILE",
+                           help="Write build metrics into the FILE in "
+                           "Prometheus text format, e.g. for node_exporter "
+                           "textfile collector")
+    build_cmd.add_argument("--writer-report", action="store_true",
+                           help="Report size of the articles markup produced "
+                           "by each of the HTML writers (see `html_writer' "
+                           "option)")
     build_cmd.set_defaults(func=build)
 
+    serve_cmd = subparser.add_parser("serve-search", help="Serve search "
+                                     "queries (/search?q=) out of the binary "
+                                     "index, created during build if "
+                                     "`search_service' option is set.")
+    serve_cmd.add_argument("path", default=".", nargs='?')
+    serve_cmd.add_argument("--host", default="127.0.0.1")
+    serve_cmd.add_argument("--port", default=8001, type=int)
+    serve_cmd.add_argument("--workers", default=1, type=int,
+                           help="Number of processes sharing the index")
+    serve_cmd.set_defaults(func=serve_search)
+
+    sbench_cmd = subparser.add_parser("search-bench", help="Replay the "
+                                      "query log against built site search "
+                                      "and report latency, fetched bytes "
+                                      "and index load time.")
+    sbench_cmd.add_argument("path", default=".", nargs='?')
+    sbench_cmd.add_argument("--log", required=True,
+                            help="Query log, one phrase per line, optionally "
+                            "prefixed by the partition name and a tab")
+    sbench_cmd.add_argument("--index", help="Index file to use, relative to "
+                            "the build directory (search.json, search.idx). "
+                            "By default it is guessed from templates.json")
+    sbench_cmd.add_argument("--repeat", default=1, type=int)
+    sbench_cmd.set_defaults(func=search_bench)
+
+    bench_cmd = subparser.add_parser("bench", help="Generate reproducible "
+                                     "synthetic site and measure its "
+                                     "initialization, cold build, no-op "
+                                     "rebuild and rebuild after single "
+                                     "article edit.")
+    bench_cmd.add_argument("path", nargs='?',
+                           help="Directory for the generated site, which "
+                           "must not exist. Temporary one is used and "
+                           "removed by default")
+    bench_cmd.add_argument("--articles", default=100, type=int)
+    bench_cmd.add_argument("--tags", default=20, type=int,
+                           help="Number of tags, which are assigned to the "
+                           "articles with Zipf distribution")
+    bench_cmd.add_argument("--tags-per-article", default=3, type=int)
+    bench_cmd.add_argument("--paragraphs", default=8, type=int,
+                           help="Number of paragraphs of every article")
+    bench_cmd.add_argument("--code-density", default=0.2, type=float,
+                           help="Probability of the code block after the "
+                           "paragraph")
+    bench_cmd.add_argument("--seed", default=0, type=int)
+    bench_cmd.add_argument("--json", metavar="FILE",
+                           help="Write the results into the JSON file")
+    bench_cmd.set_defaults(func=site_bench)
+
+    mbench_cmd = subparser.add_parser("micro-bench", help="Measure the build "
+                                      "hot paths on the generated site. "
+                                      "Results can be stored as a baseline, "
+                                      "and compared against it - command "
+                                      "fails on regression.")
+    mbench_cmd.add_argument("--articles", default=50, type=int)
+    mbench_cmd.add_argument("--seed", default=0, type=int)
+    mbench_cmd.add_argument("--repeat", default=10, type=int,
+                            help="Number of samples of every benchmark")
+    mbench_cmd.add_argument("--save", metavar="FILE",
+                            help="Store the results as the baseline")
+    mbench_cmd.add_argument("--compare", metavar="FILE",
+                            help="Compare the results against the baseline")
+    mbench_cmd.add_argument("--threshold", default=0.05, type=float,
+                            help="Relative slowdown of the median, which is "
+                            "tolerated (default 0.05)")
+    mbench_cmd.add_argument("--alpha", default=0.01, type=float,
+                            help="Significance level of the Mann-Whitney U "
+                            "test of the slowdown (default 0.01)")
+    mbench_cmd.set_defaults(func=micro_bench, path=None)
+
+    stats_cmd = subparser.add_parser("stats", help="Show statistics of the "
+                                     "site builds.")
+    stats_subparser = stats_cmd.add_subparsers()
+    history_cmd = stats_subparser.add_parser("history", help="Show recent "
+                                             "builds out of the build "
+                                             "history, with the jumps of "
+                                             "build time and output size "
+                                             "flagged, and the trend.")
+    history_cmd.add_argument("path", default=".", nargs='?')
+    history_cmd.add_argument("--last", default=20, type=int,
+                             help="Number of builds to show")
+    history_cmd.add_argument("--jump", default=0.25, type=float,
+                             help="Relative growth over the median of the "
+                             "previous %d builds, which is flagged "
+                             "(default 0.25)" % stats.HISTORY_WINDOW)
+    history_cmd.set_defaults(func=stats_history)
+
     arguments = parser.parse_args(args)
     if arguments == Namespace():  # empty namespace is not what's expected
         parser.print_help()
@@ -0,0 +1,180 @@
+"""
+Minify - streaming HTML minifier for the generated pages
+"""
+import codecs
+import re
+
+
+# content of those elements is passed as is
+RAW_ELEMENTS = frozenset(("pre", "code", "script", "style", "textarea"))
+# end tags, which may be omitted in valid HTML document, since they are
+# always followed by the sibling of the same kind or the end of the parent
+OPTIONAL_END = frozenset(("li", "dt", "dd", "option", "tr", "td", "th",
+                          "thead", "tbody", "tfoot"))
+VOID_ELEMENTS = frozenset(("area", "base", "br", "col", "embed", "hr", "img",
+                           "input", "link", "meta", "param", "source",
+                           "track", "wbr"))
+
+TAG_NAME = re.compile(r"<(/?)([a-zA-Z][a-zA-Z0-9-]*)")
+ATTRIBUTE = re.compile(r"""\s+([^\s"'=<>`/]+)(?:\s*=\s*(?:"([^"]*)"|"""
+                       r"""'([^']*)'|([^\s"'=<>`]+)))?""")
+TAG_END = re.compile(r"\s*(/?)>$")
+UNQUOTED = re.compile(r"""[^\s"'=<>`]+""")
+WHITESPACE = re.compile(r"\s+")
+
+
+class HtmlMinifier:
+    """Minify HTML fed in pieces. Whitespace is collapsed, optional end tags
+    and the quotes around attribute values are dropped, together with the
+    comments, except the server side includes (<!--#...-->) and the
+    conditional ones (<!--[if ...]>). Content of pre, code, script, style and
+    textarea elements is left untouched."""
+
+    def __init__(self):
+        """Initialize object"""
+        self.size_in = 0
+        self.size_out = 0
+        self._buffer = ""
+        self._raw = None
+        self._raw_end = None
+        self._space = False
+
+    @property
+    def saved(self):
+        """Return number of bytes saved so far"""
+        return self.size_in - self.size_out
+
+    def filter(self, chunks):
+        """Yield minified utf-8 encoded chunks out of the utf-8 encoded
+        chunks"""
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        for chunk in chunks:
+            self.size_in += len(chunk)
+            data = self.feed(decoder.decode(chunk)).encode("utf-8")
+            if data:
+                self.size_out += len(data)
+                yield data
+
+        data = self.feed(decoder.decode(b"", True), True).encode("utf-8")
+        if data:
+            self.size_out += len(data)
+            yield data
+
+    def feed(self, text, final=False):
+        """Return minified part of the text. Incomplete tags and comments at
+        the end of the text are kept until next call, or returned as is, if
+        final is set."""
+        buf = self._buffer + text
+        out = []
+        pos = 0
+        while pos < len(buf):
+            if self._raw:
+                match = self._raw_end.search(buf, pos)
+                if not match:
+                    # part of the closing tag could be at the very end
+                    safe = max(pos, len(buf) - len(self._raw) - 2)
+                    out.append(buf[pos:safe])
+                    pos = safe
+                    break
+                out.append(buf[pos:match.start()])
+                pos = match.start()
+                self._raw = None
+                continue
+
+            if buf.startswith("<", pos):
+                if buf.startswith("<!--", pos):
+                    end = buf.find("-->", pos + 4)
+                    if end == -1:
+                        break
+                    end += 3
+                    if buf[pos + 4:pos + 5] in ("#", "["):
+                        out.append(buf[pos:end])
+                        self._space = False
+                    pos = end
+                    continue
+
+                end = buf.find(">", pos)
+                if end == -1:
+                    break
+                out.append(self._tag(buf[pos:end + 1]))
+                pos = end + 1
+                continue
+
+            end = buf.find("<", pos)
+            if end == -1:
+                end = len(buf)
+            out.append(self._text(buf[pos:end]))
+            pos = end
+
+        self._buffer = buf[pos:]
+        if final:
+            out.append(self._buffer)
+            self._buffer = ""
+        return "".join(out)
+
+    def _text(self, text):
+        """Return text with collapsed whitespace"""
+        text = WHITESPACE.sub(" ", text)
+        if self._space and text.startswith(" "):
+            text = text[1:]
+        if text:
+            self._space = text.endswith(" ")
+        return text
+
+    def _tag(self, tag):
+        """Return minified tag"""
+        self._space = False
+        match = TAG_NAME.match(tag)
+        if not match:
+            return tag
+
+        closing = match.group(1)
+        name = match.group(2).lower()
+        if closing:
+            return "" if name in OPTIONAL_END else "</%s>" % name
+
+        attrs = []
+        pos = match.end()
+        while True:
+            attr = ATTRIBUTE.match(tag, pos)
+            if not attr:
+                break
+            attrs.append(attr.groups())
+            pos = attr.end()
+
+        end = TAG_END.match(tag, pos)
+        if not end:
+            # something we don't understand, leave it alone
+            self._set_raw(name, False)
+            return tag
+
+        self_closing = bool(end.group(1))
+        self._set_raw(name, self_closing)
+
+        out = ["<", match.group(2)]
+        for attr_name, double, single, bare in attrs:
+            out.append(" " + attr_name)
+            if double is not None:
+                out.append("=" + self._value(double, '"'))
+            elif single is not None:
+                out.append("=" + self._value(single, "'"))
+            elif bare is not None:
+                out.append("=" + bare)
+
+        if self_closing and name not in VOID_ELEMENTS:
+            out.append(" /")
+        out.append(">")
+        return "".join(out)
+
+    def _set_raw(self, name, self_closing):
+        """Switch to raw mode, if the tag opens one of the raw elements"""
+        if name in RAW_ELEMENTS and not self_closing:
+            self._raw = name
+            self._raw_end = re.compile("</%s(?=[\\s>])" % name, re.I)
+
+    @staticmethod
+    def _value(value, quote):
+        """Return attribute value without the quotes, if possible"""
+        if UNQUOTED.fullmatch(value) and not value.endswith("/"):
+            return value
+        return quote + value + quote
@@ -0,0 +1,145 @@
+"""
+Profiling - per build phase CPU profiles and memory snapshots
+"""
+import contextlib
+import cProfile
+import os
+import re
+import resource
+import sys
+import tracemalloc
+
+
+# number of stack frames stored for every traced allocation
+TRACE_FRAMES = 1
+
+
+def peak_rss():
+    """Return peak resident set size of the process in bytes"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports it in kilobytes, macOS in bytes
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def _mib(size):
+    """Return size in bytes formatted as mebibytes"""
+    return "%.1f" % (size / 1048576)
+
+
+class PhaseProfiler:
+    """Profile every build phase separately and write the results into
+    NN-phase_name.pstats files in the given directory"""
+
+    def __init__(self, directory):
+        """Initialize object"""
+        self.directory = directory
+        self.files = []
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Context manager profiling the named phase"""
+        os.makedirs(self.directory, exist_ok=True)
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            fname = os.path.join(self.directory, "%02d-%s.pstats" %
+                                 (len(self.files) + 1,
+                                  re.sub(r"\W+", "_", name)))
+            profiler.dump_stats(fname)
+            self.files.append(fname)
+
+    def report(self):
+        """Print the written profiles"""
+        print("Profiles of %d phases written to `%s' (see `python -m "
+              "pstats FILE')." % (len(self.files), self.directory))
+
+
+class MemoryMonitor:
+    """Take tracemalloc snapshot and peak RSS at the end of every build
+    phase. Tracing is started with the first phase, if it isn't running
+    already."""
+
+    def __init__(self, limit=10):
+        """Initialize object"""
+        self.limit = limit
+        # (phase name, traced memory, peak RSS, biggest allocation growth)
+        self.phases = []
+        self._snapshot = None
+        self._started = False
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Context manager taking the memory snapshot after the phase"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACE_FRAMES)
+            self._started = True
+        try:
+            yield
+        finally:
+            snapshot = self._take_snapshot()
+            growth = None
+            if self._snapshot is not None:
+                # differences are sorted by the absolute value, so the
+                # biggest release would shadow the growth
+                diff = snapshot.compare_to(self._snapshot, "lineno")
+                growth = max(diff, key=lambda stat: stat.size_diff,
+                             default=None)
+                if growth is not None and growth.size_diff <= 0:
+                    growth = None
+            elif snapshot.traces:
+                growth = snapshot.statistics("lineno")[0]
+            self.phases.append((name, tracemalloc.get_traced_memory()[0],
+                                peak_rss(), growth))
+            self._snapshot = snapshot
+
+    @staticmethod
+    def _take_snapshot():
+        """Return snapshot without the allocations made by the tracing,
+        profiling and importing machinery"""
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, cProfile.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+            tracemalloc.Filter(False, "<unknown>")))
+
+    def top(self):
+        """Return the biggest allocation sites alive at the end of the last
+        phase"""
+        if self._snapshot is None:
+            return []
+        return self._snapshot.statistics("lineno")[:self.limit]
+
+    def stop(self):
+        """Stop tracing, if it was started by the monitor"""
+        if self._started:
+            tracemalloc.stop()
+            self._started = False
+
+    def report(self):
+        """Print memory usage of the phases and the top allocation sites"""
+        row = "%-20s %16s %14s  %s"
+        print(row % ("phase", "traced [MiB]", "peak RSS [MiB]",
+                     "biggest growth"))
+        previous = 0
+        for name, traced, rss, growth in self.phases:
+            site = ""
+            if growth is not None:
+                frame = growth.traceback[0]
+                size = getattr(growth, "size_diff", growth.size)
+                site = "%s:%d (+%d KiB)" % (frame.filename, frame.lineno,
+                                            size // 1024)
+            print(row % (name, "%s %+.1f" % (_mib(traced),
+                                             (traced - previous) / 1048576),
+                         _mib(rss), site))
+            previous = traced
+
+        print("Top %d allocation sites:" % self.limit)
+        for stat in self.top():
+            frame = stat.traceback[0]
+            print("  %10s KiB %8d blocks  %s:%d" % (stat.size // 1024,
+                                                    stat.count,
+                                                    frame.filename,
+                                                    frame.lineno))
@@ -2,12 +2,20 @@
 This module is responsible for conversion between reST and HTML with some
 goods added.
 """
+import collections
+import contextlib
 import imp
 import re
+import time
 
 from docutils import core
 from docutils import nodes
+from docutils import transforms
+from docutils.readers import standalone
 from docutils.writers import html4css1
+from docutils.writers import html5_polyglot
+
+from kiroku import trace
 
 try:
     imp.find_module("pygments")
@@ -16,17 +24,98 @@ except ImportError:
     SETTINGS = {'syntax_highlight': 'none'}
 
 
-class CustomHTMLTranslator(html4css1.HTMLTranslator):
+class NodeProfile:
     """
-    Base class for reST files translations.
-    There are couple of customizations for docinfo fields behaviour and
-    abbreviations and acronyms.
+    Count and time spent in the translator visits and departures per node
+    type, and in the docutils transforms, summed up over all the published
+    articles.
+    """
+    def __init__(self):
+        """Initialize object"""
+        # node type -> [count, time]
+        self.nodes = collections.defaultdict(lambda: [0, 0.0])
+        # transform class name -> [count, time]
+        self.transforms = collections.defaultdict(lambda: [0, 0.0])
+
+    @contextlib.contextmanager
+    def node(self, name, count=1):
+        """Context manager measuring the visit or departure of the node"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.nodes[name][0] += count
+            self.nodes[name][1] += time.perf_counter() - start
+
+    @contextlib.contextmanager
+    def transforms_of(self, transformer):
+        """Context manager measuring each of the transforms applied by the
+        transformer.apply_transforms() called within it"""
+        applied = transformer.applied
+        transformer.applied = _MeasuredTransforms(self.transforms)
+        try:
+            yield
+        finally:
+            applied.extend(transformer.applied)
+            transformer.applied = applied
+
+    def report(self):
+        """Print the tables of node types and transforms by the total
+        time"""
+        row = "%-32s %8s %10s"
+        for title, table in (("node", self.nodes),
+                             ("transform", self.transforms)):
+            print(row % (title, "count", "time [s]"))
+            for name, (count, total) in sorted(table.items(),
+                                               key=lambda item: item[1][1],
+                                               reverse=True):
+                print(row % (name[:32], count, "%.4f" % total))
+
+
+class _MeasuredTransforms(list):
+    """List of the applied transforms, which Transformer.apply_transforms
+    appends to right after each of the transforms is applied. Time between
+    the appends is the time spent in the transform."""
+    def __init__(self, stats):
+        """Initialize list, recording into stats dictionary"""
+        super().__init__()
+        self.stats = stats
+        self.start = time.perf_counter()
+
+    def append(self, item):
+        """Record the transform (item is the priority, transform class,
+        pending node and kwargs tuple) and the time spent in it"""
+        stat = self.stats[item[1].__name__]
+        stat[0] += 1
+        stat[1] += time.perf_counter() - self.start
+        super().append(item)
+        self.start = time.perf_counter()
+
+
+# node profile of the articles translation; set to the NodeProfile object to
+# enable it
+NODE_PROFILE = None
+
+
+def set_node_profile(profile):
+    """Set the current node profile. Return the previous one"""
+    global NODE_PROFILE
+    previous = NODE_PROFILE
+    NODE_PROFILE = profile
+    return previous
+
+
+class BlogTranslatorMixin:
+    """
+    Customizations for reST files translations, common for all the HTML
+    translators: docinfo fields behaviour, abbreviations and acronyms and
+    inline code.
     """
     def __init__(self, document):
         """
         Set some nice defaults for articles translations
         """
-        html4css1.HTMLTranslator.__init__(self, document)
+        super().__init__(document)
         self.initial_header_level = 2
         self.head = []
         self.meta = []
@@ -36,6 +125,25 @@ class CustomHTMLTranslator(html4css1.HTMLTranslator):
         self.stylesheet = []
         self.generator = ('')
 
+    def dispatch_visit(self, node):
+        """
+        Call the visit method, measuring it, if node profile is enabled
+        """
+        if NODE_PROFILE is None:
+            return super().dispatch_visit(node)
+        with NODE_PROFILE.node(node.__class__.__name__):
+            return super().dispatch_visit(node)
+
+    def dispatch_departure(self, node):
+        """
+        Call the depart method, measuring it, if node profile is enabled.
+        Only visits are counted.
+        """
+        if NODE_PROFILE is None:
+            return super().dispatch_departure(node)
+        with NODE_PROFILE.node(node.__class__.__name__, 0):
+            return super().dispatch_departure(node)
+
     def visit_section(self, node):
         """
         Don't affect document, just keep track of the section levels
@@ -114,6 +222,21 @@ class CustomHTMLTranslator(html4css1.HTMLTranslator):
         BlogArticle.ATTRS[key.lower()] = val.strip()
 
 
+class CustomHTMLTranslator(BlogTranslatorMixin, html4css1.HTMLTranslator):
+    """
+    Base class for reST files translations.
+    There are couple of customizations for docinfo fields behaviour and
+    abbreviations and acronyms.
+    """
+
+
+class Html5Translator(BlogTranslatorMixin, html5_polyglot.HTMLTranslator):
+    """
+    Translator producing HTML5 markup, with the same customizations as
+    CustomHTMLTranslator.
+    """
+
+
 class BlogBodyWriter(html4css1.Writer):
     """
     Custom Writer class for generating HTML partial with the article
@@ -124,7 +247,59 @@ class BlogBodyWriter(html4css1.Writer):
 
     def translate(self):
         self.document.settings.output_encoding = "utf-8"
-        html4css1.Writer.translate(self)
+        with trace.span("translate", "docutils"):
+            html4css1.Writer.translate(self)
+
+
+class BlogHtml5Writer(html5_polyglot.Writer):
+    """
+    Writer class for generating HTML5 partial with the article. Output is
+    leaner than the one from BlogBodyWriter - no tables for the layout, and
+    less of the legacy markup.
+    """
+    def __init__(self):
+        html5_polyglot.Writer.__init__(self)
+        self.translator_class = Html5Translator
+
+    def translate(self):
+        self.document.settings.output_encoding = "utf-8"
+        with trace.span("translate", "docutils"):
+            html5_polyglot.Writer.translate(self)
+
+
+# writers to choose from with html_writer option
+WRITERS = {"html4": BlogBodyWriter,
+           "html5": BlogHtml5Writer}
+
+
+class BlogTransformer(transforms.Transformer):
+    """
+    Transformer measuring the docutils transforms applied to the article
+    """
+    def apply_transforms(self):
+        """
+        Apply the transforms, measuring them, if node profile is enabled
+        """
+        with trace.span("transforms", "docutils"):
+            if NODE_PROFILE is None:
+                return super().apply_transforms()
+            with NODE_PROFILE.transforms_of(self):
+                return super().apply_transforms()
+
+
+class BlogReader(standalone.Reader):
+    """
+    Reader tracing the parsing, and providing documents with the
+    BlogTransformer
+    """
+    def new_document(self):
+        document = super().new_document()
+        document.transformer = BlogTransformer(document)
+        return document
+
+    def parse(self):
+        with trace.span("parse", "docutils"):
+            super().parse()
 
 
 class BlogArticle(object):
@@ -133,17 +308,22 @@ class BlogArticle(object):
 
     ATTRS = {}
 
-    def __init__(self, rest_str):
-        """Initialize the objects"""
+    def __init__(self, rest_str, writer="html4"):
+        """Initialize the objects. Writer is the name of the writer out of
+        the WRITERS"""
         BlogArticle.ATTRS = {}
         self.rest_str = rest_str
+        self.writer = writer
 
     def publish(self):
         """return items: the article attrs and the html itself"""
         html_output = core.publish_string(self.rest_str,
-                                          writer=BlogBodyWriter(),
+                                          reader=BlogReader(),
+                                          writer=WRITERS[self.writer](),
                                           settings_overrides=SETTINGS)
-        html_output = html_output.decode("utf-8").strip()
+        if isinstance(html_output, bytes):
+            html_output = html_output.decode("utf-8")
+        html_output = html_output.strip()
         html_output = html_output.replace("<!-- more -->", "\n<!-- more -->\n")
         return html_output, self._return_parsed_attrs()
 
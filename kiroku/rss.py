@@ -7,10 +7,11 @@ from kiroku import template
 
 class Rss:
     """Rss representation class"""
-    def __init__(self, cfg, path='.'):
-        """Initialize RSS container"""
+    def __init__(self, cfg, path='.', templ=None):
+        """Initialize RSS container. Already existing Template object can be
+        passed as templ, so that the templates are not read again"""
         self.items = []
-        self._templ = template.Template(cfg, path)
+        self._templ = templ or template.Template(cfg, path)
 
     def add(self, item):
         """Add rss item to the list. Parameter item is a dictionary which
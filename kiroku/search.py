@@ -6,9 +6,57 @@ somehow hard to do it right statically for Polish language. For sure there
 are existing ready solutions for such task implemented for English language
 (see Sphinx project or https://pypi.python.org/pypi/stemming)
 """
+import abc
+import base64
 import collections
+import gzip
 from html import parser
+import json
+import math
+import mmap
+import os
 import re
+import struct
+
+
+FNV_OFFSET = 0x811c9dc5
+FNV_PRIME = 0x01000193
+# second hash seed used for the double hashing in the Bloom filter
+BLOOM_SEED = 0x5bd1e995
+# maximal size of the Bloom filter in bytes, since it's sent to every page
+# within templates.json; bigger vocabularies get higher false positive rate
+BLOOM_MAX_BYTES = 1024
+# false positive rate, above which the filter is not worth sending at all
+BLOOM_MAX_ERROR = 0.5
+# number of articles stored in single snippet text chunk
+SNIPPET_CHUNK = 16
+# number of stored offsets for each word in the snippet text
+SNIPPET_OFFSETS = 3
+
+# Binary index layout. All the numbers are little endian unsigned ints,
+# offsets are counted from the beginning of the file:
+#   header - magic, version, number of articles, number of hash table slots
+#   article table - (articles + 1) offsets of the headlines
+#   hash table - slots with word offset, word length, postings offset and
+#                postings count; empty slot has zero word length
+#   data - utf-8 encoded words, postings (article id, weight) and headlines
+INDEX_MAGIC = b"KRSI"
+INDEX_VERSION = 1
+_HEADER = struct.Struct("<4sIII")
+_OFFSET = struct.Struct("<I")
+_SLOT = struct.Struct("<IIII")
+_POSTING = struct.Struct("<II")
+
+
+def fnv1a(data, seed=FNV_OFFSET):
+    """Return 32 bit FNV-1a hash of the provided bytes. It's trivial to
+    compute the very same value on the client side, which is why it is used
+    instead of built in hash()."""
+    hash_ = seed
+    for byte in data:
+        hash_ ^= byte
+        hash_ = (hash_ * FNV_PRIME) & 0xffffffff
+    return hash_
 
 
 class MLStripper(parser.HTMLParser):
@@ -21,6 +69,9 @@ class MLStripper(parser.HTMLParser):
         self.reset()
         self.tag_stack = ['root']
         self.words = collections.defaultdict(list)
+        self.text = []
+        self.offsets = collections.defaultdict(list)
+        self._text_len = 0
 
     def handle_starttag(self, tag, attrs):
         """Store the tag on the stack"""
@@ -43,9 +94,22 @@ class MLStripper(parser.HTMLParser):
                       'b': 2,
                       'i': 2}
         weight = weight_map.get(self.tag_stack[-1], 1)
-        data = re.sub(r"[^\w0-9]+", " ", data)
-        for word in data.split():
-            self.words[word.lower()].append(weight)
+        text = " ".join(data.split())
+        if not text:
+            return
+
+        if self.text:
+            self.text.append(" ")
+            self._text_len += 1
+
+        for match in re.finditer(r"\w+", text):
+            word = match.group().lower()
+            self.words[word].append(weight)
+            if len(self.offsets[word]) < SNIPPET_OFFSETS:
+                self.offsets[word].append(self._text_len + match.start())
+
+        self.text.append(text)
+        self._text_len += len(text)
 
     def get_data(self):
         """Return dictionary containning words as the keys and weights as a
@@ -56,3 +120,330 @@ class MLStripper(parser.HTMLParser):
                 weight = sum(self.words[key])
                 weights[key] = weight
         return dict(weights)
+
+    def get_text(self):
+        """Return plain text of the HTML with collapsed white spaces"""
+        return "".join(self.text)
+
+    def get_offsets(self):
+        """Return dictionary of words and the list of its first offsets in
+        the plain text"""
+        return {key: val for key, val in self.offsets.items() if len(key) > 1}
+
+
+def write_snippet_chunk(fname, snippets):
+    """Write compressed snippet chunk. Snippets is a dictionary with article
+    ids as keys and MLStripper objects as values."""
+    data = {idx: {"t": stripper.get_text(), "o": stripper.get_offsets()}
+            for idx, stripper in snippets.items()}
+    with open(fname, "wb") as fobj:
+        # mtime is fixed, so that unchanged chunks are byte-identical
+        with gzip.GzipFile(fileobj=fobj, mode="wb", mtime=0) as gzobj:
+            gzobj.write(json.dumps(data, ensure_ascii=False).encode("utf-8"))
+
+
+def split_query(query):
+    """Return unique words out of the search phrase, the same way as
+    search.js does"""
+    words = []
+    for word in query.split(" "):
+        if word and word not in words:
+            words.append(word)
+    return words
+
+
+def rank(postings):
+    """Return article ids matching all of the words, ordered by the weight,
+    the same way as search.js does. Postings is a list of (article id,
+    weight) pairs iterables, one for every searched word."""
+    weights = None
+    for items in postings:
+        if weights is None:
+            weights = dict(items)
+        else:
+            weights = {idx: weights[idx] + weight for idx, weight in items
+                       if idx in weights}
+    if not weights:
+        return []
+    return sorted(weights, key=lambda idx: (-weights[idx], idx))
+
+
+def write_binary_index(fname, data):
+    """Write search data (the same as in search.json) as the binary index,
+    suitable for memory mapping"""
+    headlines = [item.encode("utf-8") for item in data["a"]]
+    words = [(word.encode("utf-8"), postings)
+             for word, postings in data["w"].items()]
+
+    slots = 1
+    while slots < len(words) * 2:
+        slots *= 2
+
+    offset = (_HEADER.size + _OFFSET.size * (len(headlines) + 1) +
+              _SLOT.size * slots)
+    table = [(0, 0, 0, 0)] * slots
+    blob = []
+
+    for word, postings in words:
+        pos = fnv1a(word) & (slots - 1)
+        while table[pos][1]:
+            pos = (pos + 1) & (slots - 1)
+        post_offset = offset + len(word)
+        table[pos] = (offset, len(word), post_offset, len(postings))
+        blob.append(word)
+        blob.extend(_POSTING.pack(idx, weight) for idx, weight in postings)
+        offset = post_offset + _POSTING.size * len(postings)
+
+    art_table = [offset]
+    for headline in headlines:
+        blob.append(headline)
+        art_table.append(art_table[-1] + len(headline))
+
+    with open(fname, "wb") as fobj:
+        fobj.write(_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, len(headlines),
+                                slots))
+        fobj.writelines(_OFFSET.pack(item) for item in art_table)
+        fobj.writelines(_SLOT.pack(*item) for item in table)
+        fobj.writelines(blob)
+
+
+class Index(abc.ABC):
+    """Base class for the search indexes. Subclasses provides postings()
+    and headline() methods, and the articles and size attributes."""
+
+    articles = 0
+    size = 0
+    # global article ids, for the partitions
+    ids = None
+
+    @abc.abstractmethod
+    def postings(self, word):
+        """Return iterable over (article id, weight) pairs for the word, or
+        None if there is no such word in the index"""
+
+    @abc.abstractmethod
+    def headline(self, idx):
+        """Return headline HTML for the article id"""
+
+    def search(self, query):
+        """Return ranked article ids for the search phrase"""
+        postings = []
+        for word in split_query(query):
+            items = self.postings(word)
+            if items is None:
+                return []
+            postings.append(items)
+        return rank(postings)
+
+    def close(self):
+        """Release the resources"""
+
+
+class JsonIndex(Index):
+    """Search index in the JSON format - search.json or its partitions"""
+
+    def __init__(self, fname):
+        """Read the index file"""
+        with open(fname, "rb") as fobj:
+            raw = fobj.read()
+        self.size = len(raw)
+        data = json.loads(raw.decode("utf-8"))
+        self._words = data["w"]
+        self._headlines = data["a"]
+        self.ids = data.get("i")
+        self.articles = len(self._headlines)
+
+    def postings(self, word):
+        """Return list of [article id, weight] pairs for the word, or None if
+        there is no such word in the index"""
+        return self._words.get(word)
+
+    def headline(self, idx):
+        """Return headline HTML for the article id"""
+        return self._headlines[idx]
+
+
+class BinaryIndex(Index):
+    """Read only, memory mapped binary search index. Lookups doesn't copy
+    the data out of the map, so that number of processes can share one
+    index without the memory penalty."""
+
+    def __init__(self, fname):
+        """Map the index file"""
+        with open(fname, "rb") as fobj:
+            self._mmap = mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+        self.size = len(self._mmap)
+
+        magic, version, self.articles, self._slots = \
+            _HEADER.unpack_from(self._mmap)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            self.close()
+            raise ValueError("`%s' is not a search index file, or it is in "
+                             "unsupported version" % fname)
+
+        self._art_table = _HEADER.size
+        self._slot_table = (self._art_table +
+                            _OFFSET.size * (self.articles + 1))
+
+    def postings(self, word):
+        """Return iterator over (article id, weight) pairs for the word, or
+        None if there is no such word in the index"""
+        data = word.encode("utf-8")
+        pos = fnv1a(data) & (self._slots - 1)
+        while True:
+            offset, length, post_offset, count = _SLOT.unpack_from(
+                self._mmap, self._slot_table + pos * _SLOT.size)
+            if not length:
+                return None
+            if self._view[offset:offset + length] == data:
+                return _POSTING.iter_unpack(
+                    self._view[post_offset:post_offset +
+                               count * _POSTING.size])
+            pos = (pos + 1) & (self._slots - 1)
+
+    def headline(self, idx):
+        """Return headline HTML for the article id"""
+        start, end = struct.unpack_from(
+            "<II", self._mmap, self._art_table + idx * _OFFSET.size)
+        return str(self._view[start:end], "utf-8")
+
+    def close(self):
+        """Release the map"""
+        self._view.release()
+        self._mmap.close()
+
+
+def open_index(fname):
+    """Return index object for the file, either JSON or binary one"""
+    with open(fname, "rb") as fobj:
+        magic = fobj.read(len(INDEX_MAGIC))
+    if magic == INDEX_MAGIC:
+        return BinaryIndex(fname)
+    return JsonIndex(fname)
+
+
+class SiteSearch:
+    """Search the built site the same way as the search.js does: reject the
+    phrases with unknown words using the Bloom filter, try the page scoped
+    partition first, then ask the search service (using the binary index) or
+    fall back to search.json. Every query reports the number of bytes the
+    browser would need to fetch (with the empty cache) to get the result."""
+
+    def __init__(self, build_dir, index_fname=None):
+        """Read templates.json out of the build directory. Optional
+        index_fname overrides the global index."""
+        self.build_dir = build_dir
+        with open(os.path.join(build_dir, "templates.json"), "rb") as fobj:
+            raw = fobj.read()
+        self.templates_size = len(raw)
+        self.templates = json.loads(raw.decode("utf-8"))
+        self.bloom = None
+        if "b" in self.templates:
+            self.bloom = BloomFilter.from_dict(self.templates["b"])
+
+        if index_fname:
+            self.index_fname = index_fname
+        elif self.templates.get("s"):
+            self.index_fname = os.path.join(build_dir, "search.idx")
+        else:
+            self.index_fname = os.path.join(build_dir, "search.json")
+        self._indexes = {}
+
+    def get_index(self, fname):
+        """Return (cached) index for the file"""
+        if fname not in self._indexes:
+            self._indexes[fname] = open_index(fname)
+        return self._indexes[fname]
+
+    def query(self, phrase, scope=None):
+        """Return list of the headlines and number of fetched bytes for the
+        search phrase. Scope is the partition name, as in templates.json"""
+        words = split_query(phrase)
+        if self.bloom and not all(word in self.bloom for word in words):
+            return [], 0
+
+        fetched = 0
+        if scope and scope in self.templates.get("p", []):
+            index = self.get_index(os.path.join(self.build_dir,
+                                                "search-%s.json" % scope))
+            fetched += index.size
+            ids = index.search(phrase)
+            if ids:
+                return [index.headline(idx) for idx in ids], fetched
+
+        index = self.get_index(self.index_fname)
+        headlines = [index.headline(idx) for idx in index.search(phrase)]
+        if self.templates.get("s"):
+            # only the response from the service goes over the wire
+            fetched += len(json.dumps({"a": headlines},
+                                      ensure_ascii=False).encode("utf-8"))
+        else:
+            fetched += index.size
+        return headlines, fetched
+
+    def close(self):
+        """Close all opened indexes"""
+        for index in self._indexes.values():
+            index.close()
+        self._indexes = {}
+
+
+class BloomFilter:
+    """Compact, probabilistic set of words. It may answer "yes" for the word
+    which was never added, but never answers "no" for a word which was
+    added. Used on the client side for rejecting the queries with unknown
+    words before fetching the search index."""
+
+    def __init__(self, capacity, error_rate=0.01, max_bytes=None):
+        """Initialize filter sized for capacity words with expected false
+        positive rate, but not bigger than max_bytes, if provided"""
+        self.capacity = max(capacity, 1)
+        size = -self.capacity * math.log(error_rate) / math.log(2) ** 2
+        self.size = max(int(math.ceil(size / 8)), 1) * 8
+        if max_bytes:
+            self.size = min(self.size, max_bytes * 8)
+        self.hashes = max(int(round(self.size / self.capacity *
+                                    math.log(2))), 1)
+        self.bits = bytearray(self.size // 8)
+
+    def error_rate(self):
+        """Return expected false positive rate of the filter filled up to
+        its capacity"""
+        return (1 - math.exp(-self.hashes * self.capacity /
+                             self.size)) ** self.hashes
+
+    def _positions(self, word):
+        """Yield bit positions for the word (double hashing)"""
+        data = word.encode("utf-8")
+        first = fnv1a(data)
+        second = fnv1a(data, BLOOM_SEED) | 1
+        for idx in range(self.hashes):
+            yield (first + idx * second) % self.size
+
+    def add(self, word):
+        """Add word to the filter"""
+        for pos in self._positions(word):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, word):
+        for pos in self._positions(word):
+            if not self.bits[pos >> 3] & 1 << (pos & 7):
+                return False
+        return True
+
+    def to_dict(self):
+        """Return JSON serializable representation of the filter"""
+        return {"m": self.size,
+                "k": self.hashes,
+                "b": base64.b64encode(bytes(self.bits)).decode("ascii")}
+
+    @classmethod
+    def from_dict(cls, data):
+        """Recreate filter out of the to_dict() output"""
+        bloom = cls.__new__(cls)
+        bloom.capacity = None
+        bloom.size = data["m"]
+        bloom.hashes = data["k"]
+        bloom.bits = bytearray(base64.b64decode(data["b"]))
+        return bloom
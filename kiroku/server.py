@@ -0,0 +1,123 @@
+"""
+Search service - minimal asyncio HTTP server answering the search queries
+out of the memory mapped binary index, for the sites which search index is
+too big for sending it to the browser.
+"""
+import asyncio
+import json
+import os
+import signal
+import socket
+from urllib import parse
+
+from kiroku import search
+
+
+RESPONSE = ("HTTP/1.1 %(status)s\r\n"
+            "Content-Type: application/json; charset=utf-8\r\n"
+            "Content-Length: %(length)d\r\n"
+            "Access-Control-Allow-Origin: *\r\n"
+            "Connection: close\r\n\r\n")
+
+
+class SearchService:
+    """Answer /search?q= requests using provided BinaryIndex"""
+
+    def __init__(self, index):
+        """Initialize service"""
+        self.index = index
+
+    def query(self, phrase):
+        """Return response data for the search phrase: the headlines ("a")
+        and global article ids ("i"), so that the client can treat it as the
+        regular search index."""
+        ids = self.index.search(phrase)
+        return {"a": [self.index.headline(idx) for idx in ids],
+                "i": ids}
+
+    def respond(self, target):
+        """Return status and body for the request target"""
+        url = parse.urlsplit(target)
+        if url.path.rstrip("/") != "/search":
+            return "404 Not Found", {"error": "not found"}
+
+        phrase = parse.parse_qs(url.query).get("q", [""])[0]
+        return "200 OK", self.query(phrase)
+
+    async def handle(self, reader, writer):
+        """Handle single HTTP connection"""
+        try:
+            request = await reader.readline()
+            # skip the headers, there is nothing interesting for us there
+            while (await reader.readline()).strip():
+                pass
+
+            try:
+                method, target, _ = request.decode("latin-1").split(" ", 2)
+            except ValueError:
+                method, target = None, None
+
+            if method not in ("GET", "HEAD"):
+                status, data = "400 Bad Request", {"error": "bad request"}
+            else:
+                status, data = self.respond(target)
+
+            body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+            writer.write((RESPONSE % {"status": status,
+                                      "length": len(body)}).encode("ascii"))
+            if method != "HEAD":
+                writer.write(body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def serve(self, sock):
+        """Serve forever on the provided, listening socket"""
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        server = loop.run_until_complete(asyncio.start_server(self.handle,
+                                                              sock=sock))
+        try:
+            loop.run_forever()
+        finally:
+            server.close()
+            loop.run_until_complete(server.wait_closed())
+            loop.close()
+
+
+def serve(index_fname, host="127.0.0.1", port=8001, workers=1):
+    """Start the search service. The index is mapped once, before forking
+    the workers, so all of them share the same pages of memory."""
+    index = search.BinaryIndex(index_fname)
+    service = SearchService(index)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(128)
+    sock.setblocking(False)
+
+    print("Serving search on http://%s:%d/search?q= (%d worker(s))…" %
+          (host, port, workers))
+
+    children = []
+    for _ in range(workers - 1):
+        pid = os.fork()
+        if pid == 0:
+            children = []
+            break
+        children.append(pid)
+
+    try:
+        service.serve(sock)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+        sock.close()
+
+    return 0
@@ -0,0 +1,269 @@
+"""
+Build statistics - timings of the build phases and the output summary
+"""
+import contextlib
+import json
+import os
+import statistics
+import time
+
+
+# measured steps of the article processing
+ARTICLE_STEPS = ("publish", "words", "write")
+# build history record keys checked for the jumps, with their labels
+HISTORY_METRICS = (("wall", "build time"),
+                   ("output_bytes", "output"),
+                   ("search_bytes", "search index"))
+# number of the previous builds, which median is the reference for the jumps
+HISTORY_WINDOW = 5
+
+
+class BuildStats:
+    """Collect wall and CPU time of the build phases, the numbers of
+    processed articles and written files, article fragments cache hits and
+    misses and the build errors"""
+
+    def __init__(self):
+        """Initialize object"""
+        # (phase name, wall time, cpu time)
+        self.phases = []
+        self.articles = 0
+        self.files_written = 0
+        self.files_skipped = 0
+        self.bytes_written = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.errors = []
+        self.wall = 0
+        self.cpu = 0
+        # article file name -> time spent in every step, source and output
+        # size
+        self.article_stats = {}
+        self._start = (time.perf_counter(), time.process_time())
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Context manager measuring the time spent in the named phase"""
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - wall,
+                                time.process_time() - cpu))
+
+    def cached(self, hit):
+        """Count article fragments cache hit or miss"""
+        if hit:
+            self.cache_hits += 1
+        else:
+            self.cache_misses += 1
+
+    def _article(self, fname):
+        """Return statistics dictionary of the article"""
+        if fname not in self.article_stats:
+            self.article_stats[fname] = dict.fromkeys(ARTICLE_STEPS, 0)
+            self.article_stats[fname].update(source=0, output=0)
+        return self.article_stats[fname]
+
+    @contextlib.contextmanager
+    def article_step(self, fname, step):
+        """Context manager measuring the time spent in the processing step
+        of the article"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._article(fname)[step] += time.perf_counter() - start
+
+    def article_size(self, fname, source=None, output=None):
+        """Set size (in bytes) of the article source and/or output file"""
+        data = self._article(fname)
+        if source is not None:
+            data["source"] = source
+        if output is not None:
+            data["output"] = output
+
+    def slowest(self, count):
+        """Return list of count (file name, statistics, total time) tuples of
+        the slowest articles"""
+        result = [(fname, data, sum(data[step] for step in ARTICLE_STEPS))
+                  for fname, data in self.article_stats.items()]
+        result.sort(key=lambda item: item[2], reverse=True)
+        return result[:count]
+
+    def over_budget(self, budget):
+        """Return list of (file name, total time) tuples of the articles,
+        which processing took more than budget seconds"""
+        return [(fname, total)
+                for fname, _, total in self.slowest(len(self.article_stats))
+                if total > budget]
+
+    def written(self, size):
+        """Count written file of the given size (in bytes)"""
+        self.files_written += 1
+        self.bytes_written += size
+
+    def skipped(self):
+        """Count file, which was up to date, so it wasn't written"""
+        self.files_skipped += 1
+
+    def finish(self):
+        """Stop the overall build time measurement"""
+        self.wall = time.perf_counter() - self._start[0]
+        self.cpu = time.process_time() - self._start[1]
+
+    @property
+    def articles_per_second(self):
+        """Return build throughput"""
+        return self.articles / self.wall if self.wall else 0
+
+    def to_dict(self):
+        """Return statistics as a dictionary"""
+        return {"articles": self.articles,
+                "files_written": self.files_written,
+                "files_skipped": self.files_skipped,
+                "bytes_written": self.bytes_written,
+                "cache_hits": self.cache_hits,
+                "cache_misses": self.cache_misses,
+                "errors": self.errors,
+                "wall": self.wall,
+                "cpu": self.cpu,
+                "articles_per_second": self.articles_per_second,
+                "phases": [{"name": name, "wall": wall, "cpu": cpu}
+                           for name, wall, cpu in self.phases]}
+
+    def write_json(self, fname):
+        """Write statistics into the JSON file"""
+        with open(fname, "w") as fobj:
+            json.dump(self.to_dict(), fobj, indent=2)
+
+    def write_prometheus(self, fname, timestamp=None):
+        """Write statistics into the file in Prometheus text format, suitable
+        for the node_exporter textfile collector. File is replaced
+        atomically, so that the collector never reads the partial one"""
+        metrics = [("duration_seconds", "Wall time of the build",
+                    [("", self.wall)]),
+                   ("cpu_seconds", "CPU time of the build",
+                    [("", self.cpu)]),
+                   ("phase_duration_seconds", "Wall time of the build phase",
+                    [('{phase="%s"}' % name.replace('"', '\\"'), wall)
+                     for name, wall, _ in self.phases]),
+                   ("articles", "Number of processed articles",
+                    [("", self.articles)]),
+                   ("files_written", "Number of written files",
+                    [("", self.files_written)]),
+                   ("files_skipped", "Number of up to date files, which "
+                    "weren't written", [("", self.files_skipped)]),
+                   ("bytes_written", "Size of the written files",
+                    [("", self.bytes_written)]),
+                   ("cache_hits", "Number of article fragments cache hits",
+                    [("", self.cache_hits)]),
+                   ("cache_misses", "Number of article fragments cache "
+                    "misses", [("", self.cache_misses)]),
+                   ("errors", "Number of build errors",
+                    [("", len(self.errors))]),
+                   ("last_run_timestamp_seconds", "Time of the build end",
+                    [("", time.time() if timestamp is None
+                      else timestamp)])]
+
+        lines = []
+        for name, desc, samples in metrics:
+            lines.append("# HELP kiroku_build_%s %s." % (name, desc))
+            lines.append("# TYPE kiroku_build_%s gauge" % name)
+            for labels, value in samples:
+                lines.append("kiroku_build_%s%s %r" % (name, labels, value))
+
+        tmp_fname = fname + ".tmp"
+        with open(tmp_fname, "w") as fobj:
+            fobj.write("\n".join(lines) + "\n")
+        os.replace(tmp_fname, fname)
+
+    def print_timings(self):
+        """Print the table with the phase timings"""
+        row = "%-20s %10s %10s %6s"
+        print(row % ("phase", "wall [s]", "cpu [s]", "wall%"))
+        for name, wall, cpu in self.phases:
+            print(row % (name, "%.3f" % wall, "%.3f" % cpu,
+                         "%.1f" % (100.0 * wall / self.wall
+                                   if self.wall else 0)))
+        print(row % ("total", "%.3f" % self.wall, "%.3f" % self.cpu, ""))
+        print("Articles: %d (%.1f/s), files written: %d (%d bytes), "
+              "skipped: %d" % (self.articles, self.articles_per_second,
+                               self.files_written, self.bytes_written,
+                               self.files_skipped))
+
+    def print_slowest(self, count):
+        """Print the table with count slowest articles"""
+        row = "%-40s" + " %9s" * (len(ARTICLE_STEPS) + 1) + " %12s %12s"
+        print(row % (("article",) + ARTICLE_STEPS +
+                     ("total [s]", "source [B]", "output [B]")))
+        for fname, data, total in self.slowest(count):
+            print(row % ((os.path.basename(fname)[:40],) +
+                         tuple("%.3f" % data[step] for step in ARTICLE_STEPS) +
+                         ("%.3f" % total, data["source"], data["output"])))
+
+
+def append_history(fname, record):
+    """Append the build record to the JSONL history file"""
+    with open(fname, "a") as fobj:
+        fobj.write(json.dumps(record, sort_keys=True) + "\n")
+
+
+def read_history(fname):
+    """Return list of the build records out of the JSONL history file.
+    Broken lines are skipped"""
+    records = []
+    with open(fname) as fobj:
+        for line in fobj:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
+
+
+def history_jumps(records, jump):
+    """Return list of lists of (label, relative change) tuples for every
+    record, which metric is bigger by more than jump (relative) than the
+    median of the previous HISTORY_WINDOW builds"""
+    result = []
+    for idx, record in enumerate(records):
+        flags = []
+        previous = records[max(idx - HISTORY_WINDOW, 0):idx]
+        for key, label in HISTORY_METRICS:
+            values = [item[key] for item in previous if item.get(key)]
+            if not values or not record.get(key):
+                continue
+            reference = statistics.median(values)
+            change = record[key] / reference - 1
+            if change > jump:
+                flags.append((label, change))
+        result.append(flags)
+    return result
+
+
+def print_history(records, count=20, jump=0.25):
+    """Print the count last build records with the jumps flagged, and the
+    trend over them"""
+    flags = history_jumps(records, jump)[-count:]
+    records = records[-count:]
+    row = "%-19s %-9s %8s %9s %13s %13s  %s"
+    print(row % ("date", "commit", "articles", "time [s]", "output [KiB]",
+                 "search [KiB]", "jumps"))
+    for record, jumps in zip(records, flags):
+        print(row % (record.get("time", "")[:19],
+                     (record.get("commit") or "-")[:9],
+                     record.get("articles", 0),
+                     "%.3f" % record.get("wall", 0),
+                     "%.1f" % (record.get("output_bytes", 0) / 1024),
+                     "%.1f" % (record.get("search_bytes", 0) / 1024),
+                     ", ".join("%s %+.0f%%" % (label, change * 100)
+                               for label, change in jumps)))
+
+    if len(records) > 1:
+        trend = []
+        for key, label in HISTORY_METRICS:
+            first, last = records[0].get(key), records[-1].get(key)
+            if first and last is not None:
+                trend.append("%s %+.1f%%" % (label, (last / first - 1) * 100))
+        print("Trend over %d builds: %s" % (len(records), ", ".join(trend)))
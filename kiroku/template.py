@@ -1,62 +1,329 @@
 """
 Template - simple template mechanism for kiroku
 """
+import contextlib
+import hashlib
 import os
 import re
 
+from kiroku import trace
+
+
+# templates shipped with kiroku, used when site doesn't have its own copy
+DATA_TEMPLATES = os.path.join(os.path.dirname(os.path.realpath(
+    os.path.abspath(__file__))), "data", "templates")
+# %(key)s style placeholder, or escaped percent sign
+PLACEHOLDER = re.compile(r"%(?:(%)|\(([^)]*)\)([-#0 +]*\d*(?:\.\d+)?"
+                         r"[diouxXeEfFgGcrsa]))")
+
+
+class CompiledTemplate:
+    """Template string split into the literal parts and placeholders once,
+    so that rendering is just filling up the slots, without copying the
+    config dictionary or parsing format string all over again.
+
+    Values from the defaults (which is the config, constant for the whole
+    build) are substituted during the compilation, so only the slots for
+    the keys which are not in the config are left for the rendering. Note,
+    that the defaults are bound at that time."""
+
+    def __init__(self, source, defaults):
+        """Compile source template. Defaults is the dictionary with the
+        values for the keys not provided during the rendering"""
+        self.source = source
+        self.defaults = defaults
+        self.parts = []
+        # (part index, key, format string) - format is None for plain %s
+        self.slots = []
+        # keys substituted with the default values
+        self.folded = frozenset()
+        self._unfolded = None
+        self._encoded = None
+        self._compile()
+        if self.parts is not None:
+            self._fold()
+            self._encoded = [None if part is None else part.encode("utf-8")
+                             for part in self.parts]
+
+    def _compile(self):
+        """Split the source into the parts and slots"""
+        literal = []
+        pos = 0
+        while True:
+            idx = self.source.find("%", pos)
+            if idx == -1:
+                literal.append(self.source[pos:])
+                break
+
+            literal.append(self.source[pos:idx])
+            match = PLACEHOLDER.match(self.source, idx)
+            if not match:
+                # leave it for the % operator to report the problem
+                self.parts = None
+                return
+
+            if match.group(1):
+                literal.append("%")
+            else:
+                self.parts.append("".join(literal))
+                literal = []
+                spec = match.group(3)
+                self.slots.append((len(self.parts), match.group(2),
+                                   None if spec == "s" else "%" + spec))
+                self.parts.append(None)
+            pos = match.end()
+
+        self.parts.append("".join(literal))
+
+    def _fold(self):
+        """Substitute slots for the keys existing in defaults with their
+        values, and merge them with surrounding literal parts. Original
+        parts and slots are kept for the case when data overrides some of
+        the defaults."""
+        slots = {slot[0]: slot for slot in self.slots}
+        parts = []
+        new_slots = []
+        folded = set()
+        literal = []
+
+        for idx, part in enumerate(self.parts):
+            if idx not in slots:
+                literal.append(part)
+                continue
+
+            _, key, format_ = slots[idx]
+            if key in self.defaults:
+                value = self.defaults[key]
+                try:
+                    literal.append(str(value) if format_ is None
+                                   else format_ % (value,))
+                    folded.add(key)
+                    continue
+                except (TypeError, ValueError):
+                    # keep it for rendering, maybe data will fix it
+                    pass
+
+            parts.append("".join(literal))
+            literal = []
+            new_slots.append((len(parts), key, format_))
+            parts.append(None)
+
+        parts.append("".join(literal))
+
+        self._unfolded = (self.parts, self.slots)
+        self.parts = parts
+        self.slots = new_slots
+        self.folded = frozenset(folded)
+
+    def __call__(self, data):
+        """Return the template interpolated by data and defaults. Data from
+        data argument will overwrite the defaults."""
+        if not isinstance(data, dict):
+            data = dict(data)
+
+        if self.parts is None:
+            _data = dict(self.defaults)
+            _data.update(data)
+            return self.source % _data
+
+        if self.folded and not self.folded.isdisjoint(data):
+            parts, slots = self._unfolded
+        else:
+            parts, slots = self.parts, self.slots
+
+        parts = parts[:]
+        for idx, key, format_ in slots:
+            value = data[key] if key in data else self.defaults[key]
+            parts[idx] = str(value) if format_ is None else format_ % (value,)
+        return "".join(parts)
+
+    def chunks(self, data, stream_key):
+        """Yield the template interpolated by data as utf-8 encoded chunks.
+        Value for the stream_key is an iterable of strings, which are
+        yielded one by one, between precomputed parts of the template,
+        instead of being joined into one big string."""
+        if not isinstance(data, dict):
+            data = dict(data)
+
+        if self.parts is None:
+            data = dict(data)
+            data[stream_key] = "".join(data[stream_key])
+            yield self(data).encode("utf-8")
+            return
+
+        if self.folded and not self.folded.isdisjoint(data):
+            parts, slots = self._unfolded
+            encoded = [None if part is None else part.encode("utf-8")
+                       for part in parts]
+        else:
+            slots, encoded = self.slots, self._encoded
+
+        slots = {idx: (key, format_) for idx, key, format_ in slots}
+        for idx, part in enumerate(encoded):
+            if part is not None:
+                yield part
+                continue
+
+            key, format_ = slots[idx]
+            value = data[key] if key in data else self.defaults[key]
+            if key == stream_key and format_ is None:
+                for item in value:
+                    yield item.encode("utf-8")
+            else:
+                if key == stream_key:
+                    value = "".join(value)
+                yield (str(value) if format_ is None
+                       else format_ % (value,)).encode("utf-8")
+
+
+class TemplateRegistry:
+    """Process wide store of the template files, shared by all of the
+    Template objects. Entries are keyed by the absolute file path, so that
+    they stay valid when the working directory changes, and validated by
+    the file modification time and size, so that the file is read again only
+    when it was touched. Content hash tells, if it was really changed."""
+
+    def __init__(self):
+        """Initialize object"""
+        # path: ((mtime, size), content, digest)
+        self._entries = {}
+
+    def load(self, fname):
+        """Return content of the template file (without comments and empty
+        lines) and its digest"""
+        fname = os.path.abspath(fname)
+        stat = os.stat(fname)
+        key = (stat.st_mtime_ns, stat.st_size)
+        entry = self._entries.get(fname)
+        if entry and entry[0] == key:
+            return entry[1], entry[2]
+
+        with open(fname) as fobj:
+            content = _strip_template(fobj.read())
+        digest = hashlib.sha1(content.encode("utf-8")).hexdigest()
+        self._entries[fname] = (key, content, digest)
+        return content, digest
+
+    def changed(self, fname, digest):
+        """Return True, if the template file content is other than the one
+        identified by the digest, or the file is gone"""
+        try:
+            return self.load(fname)[1] != digest
+        except OSError:
+            return True
+
+
+REGISTRY = TemplateRegistry()
+
+
+class DependencyTracker:
+    """Record, which templates were used for rendering of the pages. Only
+    the templates used within page() or recording() blocks are recorded;
+    parts rendered once and shared by many pages are recorded separately and
+    passed to use() on every page they are placed on."""
+
+    def __init__(self):
+        """Initialize object"""
+        # page file name: set of template names
+        self.pages = {}
+        self._recording = []
+
+    def use(self, *names):
+        """Record templates as used by all the open recordings"""
+        for used in self._recording:
+            used.update(names)
+
+    @contextlib.contextmanager
+    def recording(self, used=None):
+        """Context manager yielding the set of templates used within it.
+        Templates are added to the used set, if provided"""
+        used = set() if used is None else used
+        self._recording.append(used)
+        try:
+            yield used
+        finally:
+            self._recording.pop()
+
+    @contextlib.contextmanager
+    def page(self, fname):
+        """Context manager recording the templates used within it as the
+        dependencies of the fname page"""
+        with self.recording() as used:
+            yield
+        self.pages[fname] = used
+
 
 class Template:
     """Simple class for cooking up partials out of the templates."""
 
-    def __init__(self, config, path='.'):
-        """Initialize object"""
+    def __init__(self, config, path='.', registry=None):
+        """Initialize object. Template files are read through the registry,
+        the process wide REGISTRY by default"""
         self.templates = {}
+        self.compiled = {}
+        # template name: (file name, digest)
+        self.sources = {}
         self.path = path
+        self.registry = registry if registry is not None else REGISTRY
+        self.tracker = DependencyTracker()
         self._cfg = config
 
     def __call__(self, template_name, data):
         """Return string, out of the provided template intrepolated by the
         data and default strings from the config"""
-        if template_name not in self.templates:
+        if trace.TRACER.enabled:
+            with trace.TRACER.span(template_name, "template"):
+                return self.get(template_name)(data)
+        return self.get(template_name)(data)
+
+    def get(self, template_name):
+        """Return compiled template - callable, which takes the data and
+        returns interpolated template"""
+        if template_name not in self.compiled:
             self._read_template(template_name)
 
-        return self._get_updated_template(self.templates[template_name], data)
+        self.tracker.use(template_name)
+        return self.compiled[template_name]
 
-    def _get_updated_template(self, template, data):
-        """Return the template string interpolated by data and default strings
-        from config. Data from data argument will overwrite the defaults."""
-        _data = {}
-        _data.update(self._cfg)
-        data = _data.update(data)
-        return template % _data
+    def find(self, template_name):
+        """Return path to the template file. Templates missing in the site
+        .templates directory (i.e. introduced in newer version of kiroku)
+        are taken from the kiroku data directory."""
+        candidates = [os.path.join(directory, "%s%s" % (template_name, ext))
+                      for directory in (os.path.join(self.path, ".templates"),
+                                        DATA_TEMPLATES)
+                      for ext in (".html", ".xml")]
+        for fname in candidates:
+            if os.path.exists(fname):
+                return fname
+        return candidates[0]
 
     def _read_template(self, template_name):
         """
-        Return the template out of the template name - so it is the basename
-        of the template file without the file extension.
-
-        Note, that all html comments (<!-- -->) will be truncated.
-        If compress is set to True all of trailing spaces will be removed out
-        of the template (you can call it "minifying" html)
+        Read the template out of the template name - so it is the basename
+        of the template file without the file extension, and compile it.
+        See find() for the template lookup, and _strip_template() for the
+        preprocessing.
         """
+        fname = self.find(template_name)
+        content, digest = self.registry.load(fname)
+        self.templates[template_name] = content
+        self.sources[template_name] = (fname, digest)
+        self.compiled[template_name] = CompiledTemplate(content, self._cfg)
 
-        templ = []
-        comments = re.compile("<!--.*?-->", re.DOTALL)
 
-        try:
-            with open(os.path.join(self.path, ".templates/%s.html" %
-                                   template_name)) as fobj:
-                content = fobj.read()
-        except IOError:
-            with open(os.path.join(self.path, ".templates/%s.xml" %
-                                   template_name)) as fobj:
-                content = fobj.read()
-
-        content = re.sub(comments, "", content)
-
-        for line in content.split("\n"):
-            if not line:
-                continue
-            templ.append(line + "\n")
+def _strip_template(content):
+    """
+    Return the template content with all html comments (<!-- -->) and the
+    empty lines removed.
+    """
+    templ = []
+    comments = re.compile("<!--.*?-->", re.DOTALL)
+    content = re.sub(comments, "", content)
+
+    for line in content.split("\n"):
+        if not line:
+            continue
+        templ.append(line + "\n")
 
-        self.templates[template_name] = "".join(templ).strip()
+    return "".join(templ).strip()
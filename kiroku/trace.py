@@ -0,0 +1,76 @@
+"""
+Trace - record the build spans in Chrome trace event format, which can be
+loaded into chrome://tracing or Perfetto UI
+"""
+import contextlib
+import json
+import os
+import threading
+import time
+
+
+class Tracer:
+    """Collect complete ("X") trace events for the nested spans"""
+
+    enabled = True
+
+    def __init__(self):
+        """Initialize object"""
+        self.events = []
+        self._origin = time.perf_counter()
+
+    @contextlib.contextmanager
+    def span(self, name, category, **args):
+        """Context manager recording the span of the given name and category.
+        Keyword arguments are stored as the event arguments."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self.events.append({"name": name,
+                                "cat": category,
+                                "ph": "X",
+                                "ts": (start - self._origin) * 1e6,
+                                "dur": (end - start) * 1e6,
+                                "pid": os.getpid(),
+                                "tid": threading.get_ident(),
+                                "args": args})
+
+    def write(self, fname):
+        """Write the trace into JSON file"""
+        meta = {"name": "process_name", "ph": "M", "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "args": {"name": "kiroku build"}}
+        with open(fname, "w") as fobj:
+            json.dump({"traceEvents": [meta] + self.events,
+                       "displayTimeUnit": "ms"}, fobj)
+
+
+class NullTracer:
+    """Tracer, which doesn't record anything"""
+
+    enabled = False
+
+    @contextlib.contextmanager
+    def span(self, name, category, **args):
+        """Do nothing"""
+        yield
+
+
+# the tracer used by all the modules; replaced with Tracer object for the
+# traced builds
+TRACER = NullTracer()
+
+
+def span(name, category, **args):
+    """Return the span context manager of the current tracer"""
+    return TRACER.span(name, category, **args)
+
+
+def set_tracer(tracer):
+    """Set the current tracer. Return the previous one"""
+    global TRACER
+    previous = TRACER
+    TRACER = tracer
+    return previous
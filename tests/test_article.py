@@ -253,6 +253,30 @@ class TestArticle(unittest.TestCase):
         self.assertIn('elit.</p>', art.get_short_body())
         self.assertNotIn('<p>Arcu', art.get_short_body())
 
+    def test_fragment(self):
+        """Test fragment method"""
+        art = article.Article(None, kiroku.CONFIG)
+        self.assertEqual(art.fragments, {})
+        calls = []
+
+        def render():
+            calls.append(1)
+            return "foo"
+
+        self.assertEqual(art.fragment("foo", render), "foo")
+        self.assertEqual(art.fragment("foo", render), "foo")
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(art.fragments, {"foo": "foo"})
+
+        art.created = datetime(2010, 10, 10, 10, 10, 10)
+        self.assertEqual(art.created_short(), "10 Oct, 2010")
+        # cached value is returned
+        art.created = datetime(2011, 11, 11, 11, 11, 11)
+        self.assertEqual(art.created_short(), "10 Oct, 2010")
+
+        art.fragments = {"short_body": "cached"}
+        self.assertEqual(art.get_short_body(), "cached")
+
     def test__process_attrs(self):
         """Test _process_attrs method."""
         # Virtually the same as test_read tests. Nothing new to introduce.
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Tests for benchmarks
+"""
+import collections
+import contextlib
+import copy
+import gettext
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from kiroku import bench
+from kiroku import kiroku
+from kiroku import search
+
+
+def _config():
+    """Return site configuration for the benchmarks, the copy of the default
+    one with the i18n strings"""
+    cfg = copy.deepcopy(kiroku.CONFIG)
+    cfg.update(kiroku.get_i18n_strings(gettext.gettext))
+    return cfg
+
+
+class TestSearchBench(unittest.TestCase):
+    """Check search benchmark"""
+
+    def setUp(self):
+        """Create fake build directory"""
+        self._dir = tempfile.mkdtemp()
+        data = {"a": ["<p>foo</p>", "<p>bar</p>"],
+                "w": {"foo": [[0, 1]], "bar": [[1, 1]]}}
+        with open(os.path.join(self._dir, "search.json"), "w") as fobj:
+            json.dump(data, fobj)
+        search.write_binary_index(os.path.join(self._dir, "search.idx"),
+                                  data)
+        with open(os.path.join(self._dir, "templates.json"), "w") as fobj:
+            json.dump({}, fobj)
+
+    def tearDown(self):
+        """Clean up"""
+        shutil.rmtree(self._dir)
+
+    def test_percentile(self):
+        """Test percentile function"""
+        self.assertEqual(bench.percentile([], 50), 0)
+        self.assertEqual(bench.percentile([3], 99), 3)
+        values = list(range(100, 0, -1))
+        self.assertEqual(bench.percentile(values, 50), 50)
+        self.assertEqual(bench.percentile(values, 99), 99)
+        self.assertEqual(bench.percentile(values, 100), 100)
+
+    def test_read_query_log(self):
+        """Test read_query_log function"""
+        fname = os.path.join(self._dir, "queries.log")
+        with open(fname, "w") as fobj:
+            fobj.write("foo bar\n\n  \ntag-a\tbaz\n\tfoo\n")
+        self.assertEqual(bench.read_query_log(fname),
+                         [(None, "foo bar"), ("tag-a", "baz"),
+                          (None, "foo")])
+
+    def test_search_bench(self):
+        """Test search_bench function"""
+        queries = [(None, "foo"), (None, "bar"), (None, "baz")]
+        result = bench.search_bench(self._dir, queries, repeat=2)
+        self.assertEqual(result["index"], "search.json")
+        self.assertEqual(result["queries"], 6)
+        self.assertEqual(result["found"], 4)
+        self.assertEqual(result["bytes_per_query"], result["index_size"])
+        self.assertLessEqual(result["p50"], result["p99"])
+
+        result = bench.search_bench(self._dir, queries,
+                                    os.path.join(self._dir, "search.idx"))
+        self.assertEqual(result["index"], "search.idx")
+        self.assertEqual(result["found"], 2)
+        bench.print_search_bench(result)
+
+
+class TestSiteBench(unittest.TestCase):
+    """Check synthetic site generation and benchmark"""
+
+    def setUp(self):
+        """Create temporary directory"""
+        self._dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Clean up"""
+        shutil.rmtree(self._dir)
+
+    def _read(self, path):
+        """Return dictionary of file names and contents in the path"""
+        result = {}
+        for fname in os.listdir(path):
+            with open(os.path.join(path, fname)) as fobj:
+                result[fname] = fobj.read()
+        return result
+
+    def test_generate_corpus(self):
+        """Test generate_corpus function"""
+        first = os.path.join(self._dir, "first")
+        fnames = bench.generate_corpus(first, articles=50, tags=10,
+                                       tags_per_article=2, paragraphs=3,
+                                       code_density=0)
+        self.assertEqual(len(fnames), 50)
+        self.assertEqual(sorted(os.listdir(first)),
+                         sorted(os.path.basename(fname) for fname in fnames))
+
+        bench.generate_corpus(os.path.join(self._dir, "second"), articles=50,
+                              tags=10, tags_per_article=2, paragraphs=3,
+                              code_density=0)
+        bench.generate_corpus(os.path.join(self._dir, "third"), articles=50,
+                              tags=10, tags_per_article=2, paragraphs=3,
+                              code_density=0, seed=1)
+        articles = self._read(first)
+        self.assertEqual(articles,
+                         self._read(os.path.join(self._dir, "second")))
+        self.assertNotEqual(articles,
+                            self._read(os.path.join(self._dir, "third")))
+
+        tags = collections.Counter()
+        for content in articles.values():
+            self.assertNotIn(".. code::", content)
+            self.assertEqual(content.count(".. more"), 1)
+            art_tags = content.split("\n")[2]
+            self.assertTrue(art_tags.startswith(":tags: "))
+            art_tags = art_tags[7:].split(", ")
+            self.assertEqual(len(art_tags), 2)
+            tags.update(art_tags)
+        self.assertLessEqual(len(tags), 10)
+        counts = [count for _, count in tags.most_common()]
+        self.assertGreater(counts[0], 2 * counts[-1])
+
+        fnames = bench.generate_corpus(os.path.join(self._dir, "code"),
+                                       articles=1, paragraphs=4,
+                                       code_density=1)
+        with open(fnames[0]) as fobj:
+            self.assertEqual(fobj.read().count(".. code:: python"), 4)
+
+    def test_site_bench(self):
+        """Test site_bench function"""
+        cfg = _config()
+        path = os.path.join(self._dir, "site")
+        result = bench.site_bench(path, kiroku._bench_kiroku(cfg),
+                                  articles=3, paragraphs=2, code_density=0)
+
+        self.assertEqual(result["articles"], 3)
+        self.assertEqual(len(os.listdir(os.path.join(path, "articles"))), 3)
+        self.assertEqual(result["cold"]["cache_hits"], 0)
+        self.assertEqual(result["warm"]["cache_hits"], 3)
+        self.assertEqual(result["edit"]["cache_hits"], 2)
+        for run in bench.SITE_RUNS:
+            self.assertGreater(result[run]["pages"], 3)
+            self.assertGreater(result[run]["pages_per_second"], 0)
+            self.assertGreater(result[run]["peak_rss"], 0)
+
+        with self.assertRaises(RuntimeError):
+            bench.site_bench(path, kiroku._bench_kiroku(cfg))
+
+
+class TestMicroBench(unittest.TestCase):
+    """Check hot paths benchmarks and comparison against the baseline"""
+
+    def _result(self, **samples):
+        """Return micro_bench() like result with the given samples"""
+        return {"python": "3", "corpus": {},
+                "benchmarks": {name: {"median": sorted(values)[2],
+                                      "samples": values}
+                               for name, values in samples.items()}}
+
+    def test_mann_whitney(self):
+        """Test mann_whitney function"""
+        slow = [2.0, 2.1, 2.2, 2.3, 2.4, 2.5, 2.6, 2.7]
+        fast = [1.0, 1.1, 1.2, 1.3, 1.4, 1.5, 1.6, 1.7]
+        self.assertLess(bench.mann_whitney(fast, slow), 0.001)
+        self.assertGreater(bench.mann_whitney(slow, fast), 0.999)
+        self.assertGreater(bench.mann_whitney(fast, fast), 0.4)
+        self.assertEqual(bench.mann_whitney([1], []), 1.0)
+
+    def test_compare_micro_bench(self):
+        """Test compare_micro_bench function"""
+        baseline = self._result(a=[1.0, 1.01, 1.02, 1.03, 1.04],
+                                b=[1.0, 1.01, 1.02, 1.03, 1.04],
+                                c=[1.0, 1.01, 1.02, 1.03, 1.04],
+                                d=[1.0, 1.01, 1.02, 1.03, 1.04])
+        current = self._result(a=[2.0, 2.01, 2.02, 2.03, 2.04],
+                               b=[1.0, 1.01, 1.02, 1.03, 1.05],
+                               c=[0.5, 0.51, 0.52, 0.53, 0.54],
+                               d=[1.0, 1.0, 3.0, 0.9, 3.0],
+                               e=[1.0, 1.0, 1.0, 1.0, 1.0])
+        rows = bench.compare_micro_bench(baseline, current, 0.05, 0.01)
+        self.assertEqual([(row["name"], row["status"]) for row in rows],
+                         [("a", "regression"), ("b", "ok"),
+                          ("c", "improvement"), ("d", "ok")])
+        self.assertAlmostEqual(rows[0]["change"], 1.0 / 1.02)
+
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            bench.print_comparison(rows)
+        self.assertEqual(out.getvalue().splitlines()[1].split()[-1],
+                         "regression")
+
+    def test_micro_bench(self):
+        """Test micro_bench function"""
+        self.assertEqual(len(bench._timeit(lambda: None, 3, 0)), 3)
+
+        cfg = _config()
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            result = bench.micro_bench(os.path.join(tmp_dir, "site"),
+                                       kiroku._bench_kiroku(cfg),
+                                       repeat=2, min_time=0, articles=3,
+                                       code_density=0)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+        self.assertEqual(result["corpus"], {"articles": 3,
+                                            "code_density": 0})
+        self.assertEqual(sorted(result["benchmarks"]),
+                         ["json_data", "mlstripper", "publish", "rfc3339",
+                          "tag_cloud", "template"])
+        for data in result["benchmarks"].values():
+            self.assertEqual(len(data["samples"]), 2)
+            self.assertGreater(data["median"], 0)
+        # results are stored as JSON baselines
+        self.assertEqual(json.loads(json.dumps(result)), result)
+
+
+if __name__ == '__main__':
+    unittest.main()
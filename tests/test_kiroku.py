@@ -2,9 +2,14 @@
 """
 Tests for kiroku module
 """
+import argparse
+import collections
+import contextlib
 import copy
 import datetime
 import gettext
+import gzip
+import io
 import json
 import locale
 import os
@@ -12,10 +17,12 @@ import shutil
 import tempfile
 import time
 import unittest
+from unittest import mock
 from xml.etree import ElementTree
 
 from kiroku import article
 from kiroku import kiroku
+from kiroku import search
 
 
 MOCK_ARTICLES = {'empty.rst': ('', int(time.mktime((2010, 10, 10, 10, 10, 10,
@@ -56,12 +63,12 @@ MOCK_ARTICLES = {'empty.rst': ('', int(time.mktime((2010, 10, 10, 10, 10, 10,
 
 class MockKiroku:
     """Fake Kiroku class"""
-    def __init__(self, cfg, path='.'):
+    def __init__(self, cfg, path='.', options=None):
         """Mock init method"""
 
     def build(self):
         """Fake build method"""
-        return 0
+        return kiroku.stats.BuildStats()
 
     def init(self):
         """Fake init method"""
@@ -82,6 +89,10 @@ class TestKiroku(unittest.TestCase):
         """Prepare kiroku output directory"""
         self._config = copy.deepcopy(kiroku.CONFIG)
         kiroku.CONFIG.update(kiroku.get_i18n_strings(gettext.gettext))
+        # don't record the history of the test builds, unless asked for
+        patcher = mock.patch.dict(kiroku.BUILD_OPTIONS, history=False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
         _curdir = os.path.abspath(os.curdir)
         self._dir = tempfile.mkdtemp()
         os.chdir(self._dir)
@@ -142,6 +153,36 @@ class TestKiroku(unittest.TestCase):
         self.assertEqual(rec.tag_cloud, None)
         self.assertEqual(rec._sorted_articles, [])
         self.assertEqual(rec._about_fname, None)
+        self.assertFalse(rec.options.writer_report)
+
+        rec = kiroku.Kiroku(kiroku.CONFIG, ".", MockArgParse("."))
+        self.assertFalse(rec.options.writer_report)
+        self.assertEqual(rec.options.path, ".")
+
+    def test__writer_report(self):
+        """Test _writer_report method"""
+        rec = kiroku.Kiroku(kiroku.CONFIG, self._dir)
+        rec._harvest(os.path.join(self._dir, "articles", "minimal.rst"))
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            rec._writer_report()
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[1].split(), ["article", "html4", "html5",
+                                            "diff"])
+        self.assertEqual(lines[2].split()[0], "minimal.rst")
+        self.assertEqual(lines[2].split()[1], str(len(rec.articles[0].body)))
+        self.assertEqual(lines[3].split()[0], "total")
+
+        # articles published for the report only are not profiled
+        profile = kiroku.rest.NodeProfile()
+        kiroku.rest.set_node_profile(profile)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                rec._writer_report()
+        finally:
+            self.assertIs(kiroku.rest.set_node_profile(None), profile)
+        self.assertEqual(profile.nodes, {})
+        self.assertEqual(profile.transforms, {})
 
     def test__about(self):
         """Test _about method"""
@@ -231,6 +272,131 @@ class TestKiroku(unittest.TestCase):
             self.assertEqual(data[0].strip(), "<p>five</p>")
             self.assertEqual(data[1].strip(), "<p>six</p>")
 
+    def test__archive_years_link(self):
+        """Test link to the date archives on the archive page"""
+        os.mkdir(os.path.join(self._dir, "build"))
+        with open(os.path.join(self._dir, ".templates/main.html"),
+                  "w") as fobj:
+            fobj.write("%(body)s%(footer)s")
+
+        rec = kiroku.Kiroku(kiroku.CONFIG, self._dir)
+        rec._archive()
+        with open(os.path.join(self._dir, "build/archives.html")) as fobj:
+            self.assertNotIn("archives_years.html", fobj.read())
+
+        kiroku.CONFIG['archive_partitions'] = "year"
+        rec = kiroku.Kiroku(kiroku.CONFIG, self._dir)
+        rec._archive()
+        with open(os.path.join(self._dir, "build/archives.html")) as fobj:
+            self.assertEqual(fobj.read(), '<a href="archives_years.html">'
+                             'Archives by date</a>')
+
+    def test__archive_pages(self):
+        """Test paginated archive"""
+        os.mkdir(os.path.join(self._dir, "build"))
+        cfg = dict(kiroku.CONFIG)
+        cfg['index_size'] = "1"
+        cfg['page_size'] = "2"
+        rec = kiroku.Kiroku(cfg, self._dir)
+
+        for idx, name in enumerate(["zero", "one", "two", "three", "four",
+                                    "five"]):
+            art = article.Article(None, cfg)
+            art.created = datetime.datetime(2010, 10, 10 + idx)
+            art.tags = []
+            art.html_fname = name + ".html"
+            art.title = name
+            art.body = "<p>body</p>"
+            rec.articles.append(art)
+
+        rec._archive()
+
+        with open(os.path.join(self._dir, "build/archives.html")) as fobj:
+            data = fobj.read()
+        self.assertIn("<p>one</p> <p>two</p>", data)
+        self.assertNotIn("<p>three</p>", data)
+        self.assertNotIn('class="newer"', data)
+        self.assertIn('<a class="older" href="archives-2.html">', data)
+        self.assertIn('1 / 3', data)
+
+        with open(os.path.join(self._dir, "build/archives-3.html")) as fobj:
+            data = fobj.read()
+        self.assertIn("<p>five</p>", data)
+        self.assertIn('<a class="newer" href="archives-2.html">', data)
+        self.assertNotIn('class="older"', data)
+        self.assertFalse(os.path.exists(os.path.join(self._dir,
+                                                     "build/archives-4.html")))
+
+        # index page has index_size articles and is not paginated
+        rec._index()
+        self.assertFalse(os.path.exists(os.path.join(self._dir,
+                                                     "build/index-2.html")))
+        with open(os.path.join(self._dir, "build/index.html")) as fobj:
+            data = fobj.read()
+        self.assertIn("*start* zero", data)
+        self.assertNotIn("*start* one", data)
+        self.assertNotIn('class="older"', data)
+
+        # no pagination - only index_size articles on the index page
+        cfg['page_size'] = "0"
+        shutil.rmtree(os.path.join(self._dir, "build"))
+        os.mkdir(os.path.join(self._dir, "build"))
+        rec._index()
+        rec._archive()
+        self.assertEqual(sorted(os.listdir(os.path.join(self._dir, "build"))),
+                         ["archives.html", "index.html"])
+
+    def test__date_archives(self):
+        """Test _date_archives method"""
+        os.mkdir(os.path.join(self._dir, "build"))
+        cfg = dict(kiroku.CONFIG)
+        rec = kiroku.Kiroku(cfg, self._dir)
+
+        for name, date in (("three", datetime.datetime(2013, 9, 8)),
+                           ("two", datetime.datetime(2013, 9, 1)),
+                           ("one", datetime.datetime(2013, 1, 5)),
+                           ("zero", datetime.datetime(2010, 10, 10))):
+            art = article.Article(None, cfg)
+            art.created = date
+            art.tags = []
+            art.html_fname = name + ".html"
+            art.title = name
+            rec.articles.append(art)
+
+        rec._date_archives()
+        self.assertEqual(os.listdir(os.path.join(self._dir, "build")), [])
+
+        cfg['archive_partitions'] = "year, month"
+        rec._date_archives()
+        self.assertEqual(sorted(os.listdir(os.path.join(self._dir, "build"))),
+                         ["archives_2010.html", "archives_2010_10.html",
+                          "archives_2013.html", "archives_2013_01.html",
+                          "archives_2013_09.html", "archives_years.html"])
+
+        with open(os.path.join(self._dir,
+                               "build/archives_2013.html")) as fobj:
+            self.assertEqual(fobj.read(),
+                             "<p>three</p> <p>two</p> <p>one</p>")
+        with open(os.path.join(self._dir,
+                               "build/archives_2013_09.html")) as fobj:
+            self.assertEqual(fobj.read(), "<p>three</p> <p>two</p>")
+        with open(os.path.join(self._dir,
+                               "build/archives_years.html")) as fobj:
+            data = fobj.read()
+        self.assertIn('<a href="archives_2013.html">2013</a> '
+                      '<small>(3)</small>', data)
+        self.assertIn('<a href="archives_2013_01.html">January</a>', data)
+        self.assertLess(data.index("2013"), data.index("2010"))
+
+        # only years
+        shutil.rmtree(os.path.join(self._dir, "build"))
+        os.mkdir(os.path.join(self._dir, "build"))
+        cfg['archive_partitions'] = "year"
+        rec._date_archives()
+        self.assertEqual(sorted(os.listdir(os.path.join(self._dir, "build"))),
+                         ["archives_2010.html", "archives_2013.html",
+                          "archives_years.html"])
+
     def test__calculate_tag_cloud(self):
         """Test _calculate_tag_cloud method"""
         rec = kiroku.Kiroku(kiroku.CONFIG, self._dir)
@@ -257,6 +423,31 @@ class TestKiroku(unittest.TestCase):
         self.assertEqual(rec.tag_cloud,
                          '6\nbar baz\ntag_bar_baz\n2 9\nfoo\ntag_foo\n3')
 
+    def test__tag_cloud_slot(self):
+        """Test _tag_cloud_slot and _save_tag_cloud methods"""
+        cfg = dict(kiroku.CONFIG)
+        cfg['server_root'] = "/blog/"
+        os.mkdir(os.path.join(self._dir, "build"))
+        fname = os.path.join(self._dir, "build", "tag_cloud.html")
+        rec = kiroku.Kiroku(cfg, self._dir)
+        rec.tag_cloud = "<a>foo</a>"
+
+        self.assertEqual(rec._tag_cloud_slot(), "<a>foo</a>")
+        rec._save_tag_cloud()
+        self.assertFalse(os.path.exists(fname))
+
+        cfg['tag_cloud_mode'] = "ssi"
+        self.assertEqual(rec._tag_cloud_slot(),
+                         '<!--#include virtual="/blog/tag_cloud.html" -->')
+        rec._save_tag_cloud()
+        with open(fname) as fobj:
+            self.assertEqual(fobj.read(), "<a>foo</a>")
+
+        cfg['tag_cloud_mode'] = "script"
+        self.assertIn('$("#tag-cloud").load("/blog/tag_cloud.html");',
+                      rec._tag_cloud_slot())
+        self.assertNotIn("foo", rec._tag_cloud_slot())
+
     def test__harvest(self):
         """Test _harvest method"""
         rec = kiroku.Kiroku(kiroku.CONFIG, self._dir)
@@ -414,6 +605,51 @@ class TestKiroku(unittest.TestCase):
         self.assertEqual(sorted(os.listdir(os.path.join(self._dir, "build"))),
                          ['l0', 'l1', 'l2'])
 
+    def test__write_page(self):
+        """Test _write_page method"""
+        os.mkdir(os.path.join(self._dir, "build"))
+        rec = kiroku.Kiroku(kiroku.CONFIG, self._dir)
+        rec._write_page("foo.html", {}, kiroku._joined(["zażółć", "gęślą"]))
+        with open(os.path.join(self._dir, "build", "foo.html"), "rb") as fobj:
+            self.assertEqual(fobj.read().decode("utf-8"), "zażółć gęślą")
+        self.assertEqual(rec.minified_bytes, 0)
+
+        cfg = dict(kiroku.CONFIG)
+        cfg['minify_html'] = "true"
+        rec = kiroku.Kiroku(cfg, self._dir)
+        rec._write_page("foo.html", {}, ['<p  class="a">\n  foo', "</p>"])
+        with open(os.path.join(self._dir, "build", "foo.html")) as fobj:
+            self.assertEqual(fobj.read(), "<p class=a> foo</p>")
+        self.assertEqual(rec.minified_bytes, 5)
+
+    def test__joined(self):
+        """Test _joined function"""
+        self.assertEqual(list(kiroku._joined([])), [])
+        self.assertEqual(list(kiroku._joined(["a"])), ["a"])
+        self.assertEqual("".join(kiroku._joined(iter(["a", "b", "c"]), ", ")),
+                         "a, b, c")
+
+    def test__pages(self):
+        """Test _pages and _page_fname functions"""
+        self.assertEqual(list(kiroku._pages([], 2)), [])
+        self.assertEqual(list(kiroku._pages(range(5), 2)),
+                         [[0, 1], [2, 3], [4]])
+        self.assertEqual(kiroku._page_fname("index", 1), "index.html")
+        self.assertEqual(kiroku._page_fname("tag-foo", 2), "tag-foo-2.html")
+
+    def test__parse_size(self):
+        """Test _parse_size function"""
+        self.assertIsNone(kiroku._parse_size(" "))
+        self.assertEqual(kiroku._parse_size("1000"), 1000)
+        self.assertEqual(kiroku._parse_size("150k"), 150 * 1024)
+        self.assertEqual(kiroku._parse_size("1.5 MB"), 3 * 512 * 1024)
+        self.assertEqual(kiroku._parse_size("10KiB"), 10 * 1024)
+        self.assertRaises(ValueError, kiroku._parse_size, "10 kbit")
+        self.assertRaises(ValueError, kiroku._parse_size, "many")
+        self.assertRaises(ValueError, kiroku._parse_size, "b")
+        self.assertRaises(ValueError, kiroku._parse_size, " B ")
+        self.assertRaises(ValueError, kiroku._parse_size, "KiB")
+
     def test__tag_pages(self):
         """Test _tag_pages method"""
         os.mkdir(os.path.join(self._dir, "build"))
@@ -554,6 +790,359 @@ class TestKiroku(unittest.TestCase):
                                'afile.txt')) as fobj:
             self.assertEqual(fobj.read(), r"bar")
 
+    def test_build_stats(self):
+        """Test build statistics and timings report"""
+        with open(os.path.join(self._dir, 'articles/afile.txt'), "w") as fobj:
+            fobj.write("foo")
+        timings = os.path.join(self._dir, "timings.json")
+        prom = os.path.join(self._dir, "kiroku.prom")
+
+        rec = kiroku.Kiroku(kiroku.CONFIG, self._dir,
+                            argparse.Namespace(timings=True,
+                                               timings_json=timings,
+                                               prometheus=prom,
+                                               history=True))
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            bstats = rec.build()
+        self.assertIn("\ntotal ", out.getvalue())
+        self.assertIs(bstats, rec.stats)
+        self.assertEqual(bstats.cache_misses, 5)
+        self.assertEqual(bstats.errors, [])
+        history = kiroku.stats.read_history(
+            os.path.join(self._dir, kiroku.HISTORY_FNAME))
+        self.assertEqual(len(history), 1)
+        self.assertIsNone(history[0]["commit"])
+        self.assertEqual(history[0]["articles"], 5)
+        self.assertEqual(history[0]["bytes_written"], bstats.bytes_written)
+        self.assertEqual(history[0]["output_bytes"],
+                         sum(os.path.getsize(os.path.join(root, fname))
+                             for root, _, files in
+                             os.walk(os.path.join(self._dir, "build"))
+                             for fname in files))
+        self.assertEqual(history[0]["search_bytes"],
+                         os.path.getsize(os.path.join(self._dir, "build",
+                                                      "search.json")))
+        self.assertIn("walk", history[0]["phases"])
+
+        # nothing changed, output size stays the same, and history is not
+        # written by default in the tests
+        rec = kiroku.Kiroku(kiroku.CONFIG, self._dir,
+                            argparse.Namespace(history=True))
+        with contextlib.redirect_stdout(io.StringIO()):
+            rec.build()
+        rec = kiroku.Kiroku(kiroku.CONFIG, self._dir)
+        with contextlib.redirect_stdout(io.StringIO()):
+            rec.build()
+        history = kiroku.stats.read_history(
+            os.path.join(self._dir, kiroku.HISTORY_FNAME))
+        self.assertEqual(len(history), 2)
+        self.assertLess(history[1]["bytes_written"],
+                        history[0]["bytes_written"])
+        self.assertEqual(history[1]["output_bytes"],
+                         history[0]["output_bytes"])
+        with open(prom) as fobj:
+            self.assertIn("kiroku_build_articles 5\n", fobj.read())
+
+        with open(timings) as fobj:
+            data = json.load(fobj)
+        self.assertEqual(data["articles"], 5)
+        self.assertEqual(data["files_skipped"], 0)
+        self.assertEqual([phase["name"] for phase in data["phases"]][:3],
+                         ["prepare", "load cache", "walk"])
+        self.assertGreater(data["bytes_written"], 0)
+        written = data["files_written"]
+
+        # nothing to copy second time
+        rec = kiroku.Kiroku(kiroku.CONFIG, self._dir)
+        with contextlib.redirect_stdout(io.StringIO()):
+            rec.build()
+        self.assertEqual(rec.stats.cache_hits, 5)
+        self.assertEqual(rec.stats.cache_misses, 0)
+        self.assertEqual(rec.stats.files_skipped, 2)
+        self.assertEqual(rec.stats.files_written, written - 2)
+        self.assertTrue(os.path.exists(os.path.join(self._dir, "build",
+                                                    "images", "favicon.ico")))
+
+        # removed files are removed from the build too
+        with open(os.path.join(self._dir, 'articles/images/x.png'),
+                  "w") as fobj:
+            fobj.write("png")
+        rec = kiroku.Kiroku(kiroku.CONFIG, self._dir)
+        with contextlib.redirect_stdout(io.StringIO()):
+            rec.build()
+        os.unlink(os.path.join(self._dir, 'articles/images/x.png'))
+        rec = kiroku.Kiroku(kiroku.CONFIG, self._dir)
+        with contextlib.redirect_stdout(io.StringIO()):
+            rec.build()
+        self.assertEqual(os.listdir(os.path.join(self._dir, "build",
+                                                 "images")), ["favicon.ico"])
+
+    def test_build_profile(self):
+        """Test profiling the build phases"""
+        directory = os.path.join(self._dir, "profile")
+        rec = kiroku.Kiroku(kiroku.CONFIG, self._dir,
+                            argparse.Namespace(profile=directory))
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            rec.build()
+
+        self.assertIn("03-walk.pstats", os.listdir(directory))
+        self.assertIn("Profiles of 15 phases written", out.getvalue())
+
+    def test_build_slowest(self):
+        """Test slowest articles report and the time budget"""
+        rec = kiroku.Kiroku(kiroku.CONFIG, self._dir,
+                            argparse.Namespace(slowest=3,
+                                               article_budget=0))
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            self.assertTrue(rec.build().errors)
+
+        fname = os.path.join(self._dir, "articles", "minimal.rst")
+        data = rec.stats.article_stats[fname]
+        self.assertGreater(data["publish"], 0)
+        self.assertGreater(data["words"], 0)
+        self.assertGreater(data["write"], 0)
+        self.assertEqual(data["source"], os.path.getsize(fname))
+        self.assertEqual(data["output"],
+                         os.path.getsize(os.path.join(self._dir, "build",
+                                                      "minimal.html")))
+        self.assertIn("Article `%s' took" % fname, out.getvalue())
+        self.assertIn("…failed.", out.getvalue())
+
+        rec = kiroku.Kiroku(kiroku.CONFIG, self._dir,
+                            argparse.Namespace(article_budget=60))
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(rec.build().errors, [])
+
+    def test_build_budgets(self):
+        """Test output size budgets"""
+        rec = kiroku.Kiroku(kiroku.CONFIG, self._dir)
+        with contextlib.redirect_stdout(io.StringIO()):
+            rec.build()
+        self.assertNotIn("budgets", [phase[0] for phase in rec.stats.phases])
+        page = max(rec.page_sizes.values())
+
+        kiroku.CONFIG['budget_page'] = str(page - 1)
+        kiroku.CONFIG['budget_search'] = "1M"
+        kiroku.CONFIG['budget_assets'] = "1"
+        kiroku.CONFIG['budget_tag_cloud'] = "10k"
+        rec = kiroku.Kiroku(kiroku.CONFIG, self._dir)
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            rec.build()
+
+        lines = out.getvalue().splitlines()
+        idx = lines.index("Page size budget of %d bytes exceeded by 1 "
+                          "file(s):" % (page - 1))
+        self.assertTrue(lines[idx + 1].endswith(": %d bytes (+1)" % page))
+        self.assertIn("CSS and JS size budget of 1 bytes exceeded by 1 "
+                      "file(s):", lines)
+        self.assertNotIn("Search data size", out.getvalue())
+        self.assertNotIn("Tag cloud size", out.getvalue())
+        self.assertEqual(rec.stats.errors,
+                         ["Page size budget of %d bytes exceeded" % (page - 1),
+                          "CSS and JS size budget of 1 bytes exceeded"])
+
+        kiroku.CONFIG['budget_page'] = ""
+        kiroku.CONFIG['budget_assets'] = ""
+        kiroku.CONFIG['budget_tag_cloud'] = "10"
+        rec = kiroku.Kiroku(kiroku.CONFIG, self._dir)
+        with contextlib.redirect_stdout(io.StringIO()):
+            rec.build()
+        self.assertEqual(rec.stats.errors,
+                         ["Tag cloud size budget of 10 bytes exceeded"])
+
+        # invalid budget stops the build before anything is done
+        kiroku.CONFIG['budget_tag_cloud'] = ""
+        kiroku.CONFIG['budget_search'] = "1 meg"
+        shutil.rmtree(os.path.join(self._dir, "build"))
+        rec = kiroku.Kiroku(kiroku.CONFIG, self._dir)
+        with contextlib.redirect_stdout(io.StringIO()):
+            rec.build()
+        self.assertEqual(rec.stats.errors,
+                         ["Invalid value `1 meg' of `budget_search' option. "
+                          "Use number of bytes, optionally followed by k or "
+                          "M unit."])
+        self.assertEqual(rec.stats.phases, [])
+        self.assertFalse(os.path.exists(os.path.join(self._dir, "build")))
+
+        # search budget covers the snippet chunks as well
+        kiroku.CONFIG['budget_search'] = "1"
+        kiroku.CONFIG['search_snippets'] = "true"
+        rec = kiroku.Kiroku(kiroku.CONFIG, self._dir)
+        with contextlib.redirect_stdout(io.StringIO()):
+            rec.build()
+        self.assertIn(os.path.join("snippets", "0.json.gz"),
+                      [name for name, _ in rec._budget_sizes("budget_search")])
+
+    def test_build_trace(self):
+        """Test recording the build trace"""
+        fname = os.path.join(self._dir, "trace.json")
+        rec = kiroku.Kiroku(kiroku.CONFIG, self._dir,
+                            argparse.Namespace(trace=fname))
+        with contextlib.redirect_stdout(io.StringIO()):
+            rec.build()
+
+        with open(fname) as fobj:
+            events = json.load(fobj)["traceEvents"]
+        names = collections.defaultdict(set)
+        for event in events:
+            names[event.get("cat")].add(event["name"])
+
+        self.assertEqual(names["build"], {"build"})
+        self.assertIn("walk", names["phase"])
+        self.assertIn("minimal.rst", names["article"])
+        self.assertEqual(names["docutils"],
+                         {"parse", "transforms", "translate"})
+        self.assertIn("headline", names["template"])
+        self.assertIn("index.html", names["write"])
+        self.assertFalse(kiroku.trace.TRACER.enabled)
+
+    def test_dependencies_cached_fragments(self):
+        """Test reporting changes of the templates, which were used only
+        through the cached article fragments in the last build"""
+        for _ in range(2):
+            rec = kiroku.Kiroku(kiroku.CONFIG, self._dir)
+            with contextlib.redirect_stdout(io.StringIO()):
+                rec.build()
+        self.assertEqual(rec.stats.cache_misses, 0)
+
+        with open(os.path.join(self._dir, kiroku.DEPENDENCIES_CACHE)) as fobj:
+            data = json.load(fobj)
+        self.assertIn("headline", data["templates"])
+        self.assertIn("article_tag", data["templates"])
+
+        with open(os.path.join(self._dir, ".templates", "headline.html"),
+                  "w") as fobj:
+            fobj.write("<p>%(title)s!</p>")
+
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            kiroku.Kiroku(kiroku.CONFIG, self._dir)._load_dependencies()
+        pages = [page for page, used in data["pages"].items()
+                 if "headline" in used]
+        self.assertTrue(pages)
+        self.assertEqual(out.getvalue(),
+                         "Templates changed since last build: headline (used "
+                         "by %d pages)\n" % len(pages))
+
+    def test_fragments_cache(self):
+        """Test storing and restoring the article fragments between builds"""
+        rec = kiroku.Kiroku(kiroku.CONFIG, self._dir)
+        with contextlib.redirect_stdout(io.StringIO()):
+            rec.build()
+
+        cache = os.path.join(self._dir, kiroku.FRAGMENTS_CACHE)
+        with open(cache) as fobj:
+            data = json.load(fobj)
+        self.assertEqual(sorted(data['articles']),
+                         ['complete.rst', 'empty.rst', 'full.rst',
+                          'incomplete.rst', 'minimal.rst'])
+        self.assertEqual(data['articles']['minimal.rst']['fragments']
+                         ['headline'], '<p>title</p>')
+
+        # fragments from the cache are used as long as the article is the
+        # same
+        data['articles']['minimal.rst']['fragments']['headline'] = 'cached'
+        with open(cache, "w") as fobj:
+            json.dump(data, fobj)
+
+        rec = kiroku.Kiroku(kiroku.CONFIG, self._dir)
+        with contextlib.redirect_stdout(io.StringIO()):
+            rec.build()
+        with open(os.path.join(self._dir, "build", "tag-foo.html")) as fobj:
+            self.assertEqual(fobj.read(), 'cached')
+
+        # change of the template not used by fragments keeps the cache
+        with open(os.path.join(self._dir, ".templates", "main.html"),
+                  "w") as fobj:
+            fobj.write("%(body)s.")
+
+        rec = kiroku.Kiroku(kiroku.CONFIG, self._dir)
+        with contextlib.redirect_stdout(io.StringIO()):
+            rec.build()
+        with open(os.path.join(self._dir, "build", "tag-foo.html")) as fobj:
+            self.assertEqual(fobj.read(), 'cached.')
+
+        # template change invalidates the cache
+        with open(cache, "w") as fobj:
+            json.dump(data, fobj)
+        with open(os.path.join(self._dir, ".templates", "headline.html"),
+                  "w") as fobj:
+            fobj.write("<p>%(title)s!</p>")
+
+        rec = kiroku.Kiroku(kiroku.CONFIG, self._dir)
+        with contextlib.redirect_stdout(io.StringIO()):
+            rec.build()
+        with open(os.path.join(self._dir, "build", "tag-foo.html")) as fobj:
+            self.assertEqual(fobj.read(), '<p>title!</p>.')
+
+        # article change invalidates its fragments
+        with open(cache) as fobj:
+            data = json.load(fobj)
+        data['articles']['minimal.rst']['fragments']['headline'] = 'cached'
+        with open(cache, "w") as fobj:
+            json.dump(data, fobj)
+        with open(os.path.join(self._dir, "articles", "minimal.rst"),
+                  "a") as fobj:
+            fobj.write("\n\nmore body")
+
+        rec = kiroku.Kiroku(kiroku.CONFIG, self._dir)
+        with contextlib.redirect_stdout(io.StringIO()):
+            rec.build()
+        with open(os.path.join(self._dir, "build", "tag-foo.html")) as fobj:
+            self.assertEqual(fobj.read(), '<p>title!</p>.')
+
+    def test_dependencies(self):
+        """Test recording templates used by the pages"""
+        rec = kiroku.Kiroku(kiroku.CONFIG, self._dir)
+        with contextlib.redirect_stdout(io.StringIO()):
+            rec.build()
+
+        with open(os.path.join(self._dir, kiroku.DEPENDENCIES_CACHE)) as fobj:
+            data = json.load(fobj)
+        self.assertEqual(data["pages"]["tag-foo.html"],
+                         ["article_tag", "header", "headline", "main", "tag"])
+        self.assertEqual(data["pages"]["minimal.html"],
+                         ["article_footer", "article_header", "article_tag",
+                          "main", "tag"])
+        self.assertEqual(data["pages"]["about.html"],
+                         ["header", "main", "tag"])
+        self.assertEqual(data["pages"]["rss.xml"], ["rss_item", "rss_main"])
+        self.assertEqual(data["templates"]["main"][0],
+                         os.path.join(self._dir, ".templates", "main.html"))
+
+        with open(os.path.join(self._dir, ".templates", "header.html"),
+                  "w") as fobj:
+            fobj.write("<p>header two</p>")
+
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            kiroku.Kiroku(kiroku.CONFIG, self._dir)._load_dependencies()
+        pages = [page for page, used in data["pages"].items()
+                 if "header" in used]
+        self.assertEqual(out.getvalue(),
+                         "Templates changed since last build: header (used "
+                         "by %d pages)\n" % len(pages))
+
+        # every page of the paginated listing uses the same header, and tag
+        # cloud placed in the separate file is its dependency instead
+        kiroku.CONFIG['page_size'] = "1"
+        kiroku.CONFIG['tag_cloud_mode'] = "script"
+        rec = kiroku.Kiroku(kiroku.CONFIG, self._dir)
+        with contextlib.redirect_stdout(io.StringIO()):
+            rec.build()
+        with open(os.path.join(self._dir, kiroku.DEPENDENCIES_CACHE)) as fobj:
+            data = json.load(fobj)
+        self.assertEqual(data["pages"]["tag-blog.html"],
+                         data["pages"]["tag-blog-2.html"])
+        self.assertEqual(data["pages"]["tag-blog-2.html"],
+                         ["article_tag", "header", "headline", "main",
+                          "pagination", "pagination_link"])
+        self.assertEqual(data["pages"][kiroku.TAG_CLOUD_FNAME], ["tag"])
+
     def test__join_tags(self):
         """Test _join_tags method"""
         rec = kiroku.Kiroku(kiroku.CONFIG, self._dir)
@@ -611,6 +1200,135 @@ class TestKiroku(unittest.TestCase):
                               'w': {'foo': [[0, 1]],
                                     'bar': [[1, 1]]}})
 
+        with open(os.path.join(self._dir, "build", "templates.json")) as fobj:
+            bloom = search.BloomFilter.from_dict(json.load(fobj)['b'])
+        self.assertIn('foo', bloom)
+        self.assertIn('bar', bloom)
+        self.assertNotIn('baz', bloom)
+
+        # filter, which would pass too many unknown words, is left out
+        max_error = search.BLOOM_MAX_ERROR
+        search.BLOOM_MAX_ERROR = 0
+        try:
+            rec._create_json_data()
+        finally:
+            search.BLOOM_MAX_ERROR = max_error
+        with open(os.path.join(self._dir, "build", "templates.json")) as fobj:
+            self.assertNotIn('b', json.load(fobj))
+
+    def test__search_partitions(self):
+        """Test _search_partitions method"""
+        os.mkdir(os.path.join(self._dir, "build"))
+        rec = kiroku.Kiroku(kiroku.CONFIG, self._dir)
+
+        for name, tags, year in (("foo", ['a', 'b'], 2000),
+                                 ("bar", ['b'], 2001),
+                                 ("foo bar", ['a'], 2001)):
+            art = article.Article(name + ".rst", kiroku.CONFIG)
+            art.html_fname = name + ".html"
+            art.body = name
+            art.title = name
+            art.tags = tags
+            art.created = datetime.datetime(year, 12, 12, 12, 5)
+            rec.articles.append(art)
+
+        self.assertEqual(rec._search_partitions([], []), {})
+
+        rec._cfg['search_partitions'] = 'tag, Year'
+        try:
+            rec._create_json_data()
+        finally:
+            rec._cfg['search_partitions'] = ''
+
+        with open(os.path.join(self._dir, "build", "templates.json")) as fobj:
+            self.assertEqual(json.load(fobj)['p'],
+                             ['2000', '2001', 'tag-a', 'tag-b'])
+
+        with open(os.path.join(self._dir, "build", "search-tag-a.json")) as \
+                fobj:
+            json_data = json.load(fobj)
+            json_data['a'] = [x.strip() for x in json_data['a']]
+            self.assertEqual(json_data,
+                             {'a': ['<p>foo</p>', '<p>foo bar</p>'],
+                              'w': {'foo': [[0, 1], [1, 1]],
+                                    'bar': [[1, 1]]}})
+
+        with open(os.path.join(self._dir, "build", "search-2001.json")) as \
+                fobj:
+            json_data = json.load(fobj)
+            json_data['a'] = [x.strip() for x in json_data['a']]
+            self.assertEqual(json_data,
+                             {'a': ['<p>bar</p>', '<p>foo bar</p>'],
+                              'w': {'foo': [[1, 1]],
+                                    'bar': [[0, 1], [1, 1]]}})
+
+    def test__create_json_data_service(self):
+        """Test binary index creation within _create_json_data method"""
+        os.mkdir(os.path.join(self._dir, "build"))
+        rec = kiroku.Kiroku(kiroku.CONFIG, self._dir)
+        rec._create_json_data()
+        self.assertNotIn("search.idx", os.listdir(os.path.join(self._dir,
+                                                               "build")))
+
+        art = article.Article("foo.rst", kiroku.CONFIG)
+        art.html_fname = "foo.html"
+        art.body = "foo"
+        art.title = "foo"
+        art.created = datetime.datetime(2000, 12, 12, 12, 5)
+        rec.articles = [art]
+
+        rec._cfg['search_service'] = '/search'
+        try:
+            rec._create_json_data()
+        finally:
+            rec._cfg['search_service'] = ''
+
+        with open(os.path.join(self._dir, "build", "templates.json")) as fobj:
+            self.assertEqual(json.load(fobj)['s'], '/search')
+
+        index = search.BinaryIndex(os.path.join(self._dir, "build",
+                                                "search.idx"))
+        self.assertEqual(index.search("foo"), [0])
+        self.assertEqual(index.headline(0).strip(), "<p>foo</p>")
+        index.close()
+
+    def test__save_snippets(self):
+        """Test snippets creation within _create_json_data method"""
+        os.makedirs(os.path.join(self._dir, "build", "snippets"))
+        rec = kiroku.Kiroku(kiroku.CONFIG, self._dir)
+        rec._create_json_data()
+        self.assertFalse(os.path.exists(os.path.join(self._dir, "build",
+                                                     "snippets")))
+
+        for idx in range(20):
+            art = article.Article("a%d.rst" % idx, kiroku.CONFIG)
+            art.html_fname = "a%d.html" % idx
+            art.body = "<p>body of the article%d</p>" % idx
+            art.title = "a%d" % idx
+            art.created = datetime.datetime(2000, 12, 12, 12, 5)
+            rec.articles.append(art)
+
+        rec._cfg['search_snippets'] = 'yes'
+        try:
+            rec._create_json_data()
+        finally:
+            rec._cfg['search_snippets'] = 'false'
+
+        with open(os.path.join(self._dir, "build", "templates.json")) as fobj:
+            self.assertEqual(json.load(fobj)['c'], 16)
+
+        self.assertEqual(sorted(os.listdir(os.path.join(self._dir, "build",
+                                                        "snippets"))),
+                         ['0.json.gz', '1.json.gz'])
+        with gzip.open(os.path.join(self._dir, "build", "snippets",
+                                    "1.json.gz")) as fobj:
+            data = json.loads(fobj.read().decode("utf-8"))
+        self.assertEqual(sorted(data), ['16', '17', '18', '19'])
+        self.assertEqual(data['17'], {'t': 'body of the article17',
+                                      'o': {'body': [0], 'of': [5],
+                                            'the': [8],
+                                            'article17': [12]}})
+
     def test_init(self):
         """Test init() method"""
         rec = kiroku.Kiroku(kiroku.CONFIG, os.path.join(self._dir, "foo"))
@@ -654,6 +1372,29 @@ class TestFunctions(unittest.TestCase):
         arg = MockArgParse(self._dir)
         self.assertEqual(kiroku.build(arg, kiroku.CONFIG), 0)
 
+        def build(_):
+            bstats = kiroku.stats.BuildStats()
+            bstats.errors.append("foo")
+            return bstats
+
+        original, MockKiroku.build = MockKiroku.build, build
+        try:
+            self.assertEqual(kiroku.build(arg, kiroku.CONFIG), 1)
+        finally:
+            MockKiroku.build = original
+
+    def test_stats_history(self):
+        """Test stats_history function"""
+        arg = argparse.Namespace(path=self._dir, last=20, jump=0.25)
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            self.assertEqual(kiroku.stats_history(arg, kiroku.CONFIG), 1)
+            kiroku.stats.append_history(os.path.join(self._dir,
+                                                     kiroku.HISTORY_FNAME),
+                                        {"wall": 1, "commit": "abc1234"})
+            self.assertEqual(kiroku.stats_history(arg, kiroku.CONFIG), 0)
+        self.assertIn("abc1234", out.getvalue())
+
     def test_init(self):
         """Test init funtion"""
         self.assertRaises(TypeError, kiroku.init)
@@ -668,7 +1409,7 @@ class TestFunctions(unittest.TestCase):
         args = MockArgParse(self._dir)
         conf = kiroku.get_config(args)
 
-        self.assertEqual(len(conf), 23)
+        self.assertEqual(len(conf), 38)
         self.assertEqual(conf['locale'], '')
         self.assertEqual(conf['server_name'], 'localhost')
         self.assertEqual(conf['server_protocol'], 'http')
@@ -699,7 +1440,7 @@ class TestFunctions(unittest.TestCase):
         kiroku.CONFIG = copy.deepcopy(self._config)
 
         conf = kiroku.get_config(args)
-        self.assertEqual(len(conf), 23)
+        self.assertEqual(len(conf), 38)
         self.assertEqual(conf['locale'], cur_locale)
         self.assertEqual(conf['server_name'], 'foo.com')
         self.assertEqual(conf['server_protocol'], 'https')
@@ -718,3 +1459,79 @@ class TestFunctions(unittest.TestCase):
 
         arguments = kiroku.parse_commandline(['build'])
         self.assertEqual(arguments.func, kiroku.build)
+        self.assertFalse(arguments.writer_report)
+        arguments = kiroku.parse_commandline(['build', '--writer-report'])
+        self.assertTrue(arguments.writer_report)
+        self.assertFalse(arguments.timings)
+        self.assertIsNone(arguments.timings_json)
+        arguments = kiroku.parse_commandline(['build', '--timings',
+                                              '--timings-json', 'a.json'])
+        self.assertTrue(arguments.timings)
+        self.assertEqual(arguments.timings_json, 'a.json')
+        arguments = kiroku.parse_commandline(['build', '--trace', 'b.json'])
+        self.assertEqual(arguments.trace, 'b.json')
+        arguments = kiroku.parse_commandline(['build', '--profile', 'prof',
+                                              '--memory'])
+        self.assertEqual(arguments.profile, 'prof')
+        self.assertTrue(arguments.memory)
+        arguments = kiroku.parse_commandline(['build', '--slowest', '5',
+                                              '--article-budget', '0.5'])
+        self.assertEqual(arguments.slowest, 5)
+        self.assertEqual(arguments.article_budget, 0.5)
+        arguments = kiroku.parse_commandline(['build', '--node-profile'])
+        self.assertTrue(arguments.node_profile)
+        arguments = kiroku.parse_commandline(['build', '--prometheus',
+                                              'kiroku.prom'])
+        self.assertEqual(arguments.prometheus, 'kiroku.prom')
+        self.assertTrue(arguments.history)
+        arguments = kiroku.parse_commandline(['build', '--no-history'])
+        self.assertFalse(arguments.history)
+
+        arguments = kiroku.parse_commandline(['bench', '--articles', '10',
+                                              '--code-density', '0.5'])
+        self.assertIsNone(arguments.path)
+        self.assertEqual(arguments.articles, 10)
+        self.assertEqual(arguments.tags, 20)
+        self.assertEqual(arguments.code_density, 0.5)
+        self.assertEqual(arguments.func, kiroku.site_bench)
+
+        arguments = kiroku.parse_commandline(['stats', 'history', 'blog',
+                                              '--last', '5'])
+        self.assertEqual(arguments.path, 'blog')
+        self.assertEqual(arguments.last, 5)
+        self.assertEqual(arguments.jump, 0.25)
+        self.assertEqual(arguments.func, kiroku.stats_history)
+
+        arguments = kiroku.parse_commandline(['micro-bench', '--compare',
+                                              'base.json'])
+        self.assertIsNone(arguments.path)
+        self.assertIsNone(arguments.save)
+        self.assertEqual(arguments.compare, 'base.json')
+        self.assertEqual(arguments.threshold, 0.05)
+        self.assertEqual(arguments.alpha, 0.01)
+        self.assertEqual(arguments.func, kiroku.micro_bench)
+
+        arguments = kiroku.parse_commandline(['serve-search', 'foo',
+                                              '--workers', '3'])
+        self.assertEqual(arguments.func, kiroku.serve_search)
+        self.assertEqual(arguments.path, 'foo')
+        self.assertEqual(arguments.port, 8001)
+        self.assertEqual(arguments.workers, 3)
+
+        self.assertRaises(SystemExit, kiroku.parse_commandline,
+                          ['search-bench'])
+        arguments = kiroku.parse_commandline(['search-bench', '--log', 'q'])
+        self.assertEqual(arguments.func, kiroku.search_bench)
+        self.assertEqual(arguments.path, '.')
+        self.assertEqual(arguments.log, 'q')
+        self.assertEqual(arguments.repeat, 1)
+
+    def test_search_bench(self):
+        """Test search_bench function"""
+        arg = MockArgParse(self._dir)
+        self.assertEqual(kiroku.search_bench(arg, kiroku.CONFIG), 1)
+
+    def test_serve_search(self):
+        """Test serve_search function"""
+        arg = MockArgParse(self._dir)
+        self.assertEqual(kiroku.serve_search(arg, kiroku.CONFIG), 1)
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Tests for HTML minifier
+"""
+import unittest
+
+from kiroku import minify
+
+
+HTML = """<!DOCTYPE html>
+<html>
+    <head>
+        <!-- some comment -->
+        <link rel="stylesheet" href="css/style.css" type="text/css"
+            media="screen" />
+        <script src="js/search.min.js"></script>
+    </head>
+    <body>
+        <ul class="tags">
+            <li><a href="tag-foo.html" title="Foo bar">foo</a></li>
+            <li><a href="/">home</a></li>
+        </ul>
+        <!--#include virtual="/tag_cloud.html" -->
+        <pre class="code">
+def foo():
+    return  1
+</pre>
+        <p>Some    <code>a  =  1</code>   text</p>
+        <script>if (a  <  b) { foo(); }</script>
+    </body>
+</html>
+"""
+
+EXPECTED = ('<!DOCTYPE html> <html> <head> <link rel=stylesheet '
+            'href=css/style.css type=text/css media=screen> '
+            '<script src=js/search.min.js></script> </head> <body> '
+            '<ul class=tags> <li><a href=tag-foo.html title="Foo bar">foo</a> '
+            '<li><a href="/">home</a> </ul> '
+            '<!--#include virtual="/tag_cloud.html" --> '
+            '<pre class=code>\ndef foo():\n    return  1\n</pre> '
+            '<p>Some <code>a  =  1</code> text</p> '
+            '<script>if (a  <  b) { foo(); }</script> </body> </html> ')
+
+
+class TestHtmlMinifier(unittest.TestCase):
+    """Test HtmlMinifier class"""
+
+    def test_feed(self):
+        """Test minifying whole document at once"""
+        minifier = minify.HtmlMinifier()
+        self.assertEqual(minifier.feed(HTML, True), EXPECTED)
+
+    def test_chunks(self):
+        """Test minifying document split at every possible place"""
+        for size in (1, 2, 3, 7, 64):
+            minifier = minify.HtmlMinifier()
+            result = "".join(minifier.feed(HTML[idx:idx + size])
+                             for idx in range(0, len(HTML), size))
+            result += minifier.feed("", True)
+            self.assertEqual(result, EXPECTED, "chunk size %d" % size)
+
+    def test_filter(self):
+        """Test filtering utf-8 encoded chunks"""
+        data = "<p  class=\"x\">zażółć   gęślą</p>".encode("utf-8")
+        minifier = minify.HtmlMinifier()
+        # split in the middle of the multibyte characters
+        result = b"".join(minifier.filter(data[idx:idx + 3]
+                                          for idx in range(0, len(data), 3)))
+        self.assertEqual(result.decode("utf-8"),
+                         "<p class=x>zażółć gęślą</p>")
+        self.assertEqual(minifier.size_in, len(data))
+        self.assertEqual(minifier.size_out, len(result))
+        self.assertEqual(minifier.saved, len(data) - len(result))
+
+    def test_attributes(self):
+        """Test attribute values quoting"""
+        minifier = minify.HtmlMinifier()
+        self.assertEqual(minifier.feed("<input type='text' disabled "
+                                       "value=\"\" name=q/>", True),
+                         '<input type=text disabled value="" name=q/>')
+        self.assertEqual(minifier.feed('<svg><path d="M 0 0"/></svg>', True),
+                         '<svg><path d="M 0 0" /></svg>')
+        self.assertEqual(minifier.feed('<a href="a=b">x</a>', True),
+                         '<a href="a=b">x</a>')
+
+    def test_incomplete(self):
+        """Test incomplete tags at the end of the document"""
+        minifier = minify.HtmlMinifier()
+        self.assertEqual(minifier.feed("<p>foo</p><a href"), "<p>foo</p>")
+        self.assertEqual(minifier.feed("", True), "<a href")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Tests for build phases profiling
+"""
+import contextlib
+import io
+import os
+import pstats
+import shutil
+import tempfile
+import tracemalloc
+import unittest
+
+from kiroku import profiling
+
+
+class TestPhaseProfiler(unittest.TestCase):
+    """Test PhaseProfiler class"""
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def test_phase(self):
+        """Test writing profile for every phase"""
+        directory = os.path.join(self._dir, "profile")
+        profiler = profiling.PhaseProfiler(directory)
+        with profiler.phase("walk"):
+            sorted(range(100))
+        with profiler.phase("tag pages"):
+            pass
+
+        self.assertEqual(sorted(os.listdir(directory)),
+                         ["01-walk.pstats", "02-tag_pages.pstats"])
+        stats = pstats.Stats(profiler.files[0])
+        self.assertIn("<built-in method builtins.sorted>",
+                      [func[2] for func in stats.stats])
+
+
+class TestMemoryMonitor(unittest.TestCase):
+    """Test MemoryMonitor class"""
+
+    def test_phase(self):
+        """Test taking the snapshots after the phases"""
+        monitor = profiling.MemoryMonitor(limit=3)
+        try:
+            with monitor.phase("first"):
+                data = [str(x) for x in range(1000)]
+            with monitor.phase("second"):
+                data.append(bytearray(1024 * 1024))
+            with monitor.phase("third"):
+                # release is bigger than the growth, which is still reported
+                data.pop()
+                data.append(bytearray(64 * 1024))
+            self.assertTrue(tracemalloc.is_tracing())
+        finally:
+            monitor.stop()
+        self.assertFalse(tracemalloc.is_tracing())
+
+        self.assertEqual([phase[0] for phase in monitor.phases],
+                         ["first", "second", "third"])
+        _, traced, rss, growth = monitor.phases[1]
+        self.assertGreater(traced, 1024 * 1024)
+        self.assertGreater(rss, 0)
+        self.assertGreaterEqual(growth.size_diff, 1024 * 1024)
+        growth = monitor.phases[2][3]
+        self.assertGreaterEqual(growth.size_diff, 64 * 1024)
+        self.assertEqual(len(monitor.top()), 3)
+
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            monitor.report()
+        self.assertIn("Top 3 allocation sites:", out.getvalue())
+        self.assertIn("test_profiling.py", out.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
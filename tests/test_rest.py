@@ -2,6 +2,8 @@
 """
 Tests for reStructuredText translator and writer
 """
+import contextlib
+import io
 import locale
 import unittest
 
@@ -209,6 +211,18 @@ class TestBlogBodyWriter(unittest.TestCase):
         self.assertEqual(writer.output, "foo")
 
 
+class TestBlogHtml5Writer(unittest.TestCase):
+    """Test BlogHtml5Writer class"""
+
+    def test_initialization(self):
+        """Test BlogHtml5Writer initialization"""
+        writer = rest.BlogHtml5Writer()
+        self.assertEqual(writer.translator_class, rest.Html5Translator)
+        self.assertTrue(issubclass(rest.Html5Translator,
+                                   rest.BlogTranslatorMixin))
+        self.assertEqual(rest.WRITERS["html5"], rest.BlogHtml5Writer)
+
+
 class TestBlogArticle(unittest.TestCase):
     """Test BlogArticle class"""
 
@@ -226,6 +240,11 @@ class TestBlogArticle(unittest.TestCase):
         self.assertEqual(art.publish(), ("<p>hello</p>\n\n<!-- more -->\n\n"
                                          "<p>world</p>", {}))
 
+        art = rest.BlogArticle(":tags: foo\n\nhello\n\nSection\n-------"
+                               "\n\nworld", "html5")
+        self.assertEqual(art.publish(), ("<p>hello</p>\n<h2>Section</h2>\n"
+                                         "<p>world</p>", {"tags": "foo"}))
+
     def test__return_parsed_attrs(self):
         """Test _return_parsed_attrs method"""
         art = rest.BlogArticle(":tags: foo, bar")
@@ -236,5 +255,58 @@ class TestBlogArticle(unittest.TestCase):
                                               "data": "some data"}))
 
 
+class TestNodeProfile(unittest.TestCase):
+    """Test NodeProfile class"""
+
+    def tearDown(self):
+        rest.set_node_profile(None)
+
+    def test_publish(self):
+        """Test measuring the nodes and transforms during publishing"""
+        source = ":tags: foo\n\nhello *world*\n\nsecond **paragraph**"
+        expected = rest.BlogArticle(source).publish()
+
+        profile = rest.NodeProfile()
+        self.assertIsNone(rest.set_node_profile(profile))
+        self.assertEqual(rest.BlogArticle(source).publish(), expected)
+        self.assertEqual(rest.BlogArticle(source, "html5").publish()[1],
+                         expected[1])
+        self.assertIs(rest.set_node_profile(None), profile)
+
+        self.assertEqual(profile.nodes["paragraph"][0], 6)
+        self.assertEqual(profile.nodes["emphasis"][0], 2)
+        self.assertEqual(profile.nodes["strong"][0], 2)
+        self.assertTrue(all(total >= 0
+                            for _, total in profile.nodes.values()))
+        self.assertEqual(profile.transforms["DocInfo"][0], 2)
+
+        transformer = rest.BlogTransformer(MockDocument())
+        transformer.applied.append("foo")
+        with profile.transforms_of(transformer):
+            transformer.applied.append((0, rest.BlogTransformer, None, {}))
+        self.assertEqual(transformer.applied,
+                         ["foo", (0, rest.BlogTransformer, None, {})])
+        self.assertEqual(profile.transforms["BlogTransformer"][0], 1)
+
+        rest.BlogArticle(source).publish()
+        self.assertEqual(profile.nodes["paragraph"][0], 6)
+
+    def test_report(self):
+        """Test printing the report"""
+        profile = rest.NodeProfile()
+        profile.nodes["paragraph"] = [2, 0.5]
+        profile.nodes["literal_block"] = [1, 1.5]
+        profile.transforms["DocInfo"] = [1, 0.1]
+
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            profile.report()
+        self.assertEqual([line.split()[:2]
+                          for line in out.getvalue().splitlines()],
+                         [["node", "count"], ["literal_block", "1"],
+                          ["paragraph", "2"], ["transform", "count"],
+                          ["DocInfo", "1"]])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -12,6 +12,7 @@ from xml.etree import ElementTree as etree
 
 from kiroku import kiroku
 from kiroku import rss as rss_mod
+from kiroku import template
 
 
 class TestRss(unittest.TestCase):
@@ -38,6 +39,10 @@ class TestRss(unittest.TestCase):
         rss = rss_mod.Rss(kiroku.CONFIG)
         self.assertEqual(rss.items, [])
 
+        templ = template.Template(kiroku.CONFIG)
+        rss = rss_mod.Rss(kiroku.CONFIG, templ=templ)
+        self.assertIs(rss._templ, templ)
+
     def test_add(self):
         """Test add method"""
         rss = rss_mod.Rss(kiroku.CONFIG)
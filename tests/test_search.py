@@ -2,6 +2,11 @@
 """
 Tests for search engine indexer
 """
+import gzip
+import json
+import os
+import shutil
+import tempfile
 import unittest
 
 from kiroku import search
@@ -55,6 +60,260 @@ class="nv">SOME_MORE_CODE</span>
 
         self.assertEqual(out, result)
 
+    def test_get_text(self):
+        """Tests get_text() and get_offsets() methods of MLStripper"""
+        ml_stripper = search.MLStripper()
+        ml_stripper.feed("<h2>Some  title</h2>\n<p>Text with <b>some</b>\n"
+                         "words, a text.</p>")
+        text = ml_stripper.get_text()
+        self.assertEqual(text, "Some title Text with some words, a text.")
+
+        offsets = ml_stripper.get_offsets()
+        self.assertEqual(offsets, {'some': [0, 21],
+                                   'title': [5],
+                                   'text': [11, 35],
+                                   'with': [16],
+                                   'words': [26]})
+        self.assertEqual(text[offsets['words'][0]:].split()[0], "words,")
+
+        ml_stripper = search.MLStripper()
+        ml_stripper.feed("<p>%s</p>" % " ".join(["foo"] * 10))
+        self.assertEqual(ml_stripper.get_offsets(), {'foo': [0, 4, 8]})
+
+    def test_write_snippet_chunk(self):
+        """Tests write_snippet_chunk function"""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            ml_stripper = search.MLStripper()
+            ml_stripper.feed("<p>zażółć gęślą</p>")
+            fname = os.path.join(tmpdir, "0.json.gz")
+            search.write_snippet_chunk(fname, {3: ml_stripper})
+
+            with gzip.open(fname) as fobj:
+                self.assertEqual(json.loads(fobj.read().decode("utf-8")),
+                                 {'3': {'t': 'zażółć gęślą',
+                                        'o': {'zażółć': [0], 'gęślą': [7]}}})
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class TestRanking(unittest.TestCase):
+    """Check query functions"""
+
+    def test_split_query(self):
+        """Test split_query function"""
+        self.assertEqual(search.split_query(""), [])
+        self.assertEqual(search.split_query("  foo bar  foo "),
+                         ["foo", "bar"])
+
+    def test_rank(self):
+        """Test rank function"""
+        self.assertEqual(search.rank([]), [])
+        self.assertEqual(search.rank([[(0, 1), (2, 3), (5, 1)]]), [2, 0, 5])
+        self.assertEqual(search.rank([[(0, 1), (2, 3), (5, 1)],
+                                      [(1, 1), (2, 1), (5, 4)]]), [5, 2])
+        self.assertEqual(search.rank([[(0, 1)], [(1, 1)]]), [])
+        # once the intersection is empty, the next words cannot add anything
+        self.assertEqual(search.rank([[(0, 1)], [(1, 1)], [(0, 1), (1, 1)]]),
+                         [])
+
+    def test_index_abstract(self):
+        """Test that Index requires postings and headline methods"""
+        self.assertRaises(TypeError, search.Index)
+
+
+class TestBinaryIndex(unittest.TestCase):
+    """Check binary index"""
+
+    def setUp(self):
+        """Create index file"""
+        self._dir = tempfile.mkdtemp()
+        self.fname = os.path.join(self._dir, "search.idx")
+        self.data = {"a": ["<p>foo</p>", "<p>żółw</p>", "<p>bar</p>"],
+                     "w": {"foo": [(0, 1), (2, 3)],
+                           "bar": [(1, 1), (2, 1)],
+                           "żółw": [(1, 2)]}}
+
+    def tearDown(self):
+        """Clean up"""
+        shutil.rmtree(self._dir)
+
+    def test_index(self):
+        """Test write_binary_index function and BinaryIndex class"""
+        search.write_binary_index(self.fname, self.data)
+        index = search.BinaryIndex(self.fname)
+
+        self.assertEqual(index.articles, 3)
+        self.assertEqual([index.headline(x) for x in range(3)],
+                         self.data["a"])
+        self.assertEqual(list(index.postings("foo")), [(0, 1), (2, 3)])
+        self.assertEqual(list(index.postings("żółw")), [(1, 2)])
+        self.assertIsNone(index.postings("baz"))
+
+        self.assertEqual(index.search("foo"), [2, 0])
+        self.assertEqual(index.search("bar foo"), [2])
+        self.assertEqual(index.search("żółw bar"), [1])
+        self.assertEqual(index.search("foo baz"), [])
+        self.assertEqual(index.search(""), [])
+        index.close()
+
+        search.write_binary_index(self.fname, {"a": [], "w": {}})
+        index = search.BinaryIndex(self.fname)
+        self.assertEqual(index.articles, 0)
+        self.assertEqual(index.search("foo"), [])
+        index.close()
+
+    def test_wrong_file(self):
+        """Test opening a file which is not an index"""
+        with open(self.fname, "wb") as fobj:
+            fobj.write(b"foo" * 10)
+        self.assertRaises(ValueError, search.BinaryIndex, self.fname)
+
+
+class TestSiteSearch(unittest.TestCase):
+    """Check JsonIndex, open_index and SiteSearch"""
+
+    def setUp(self):
+        """Create fake build directory"""
+        self._dir = tempfile.mkdtemp()
+        self.data = {"a": ["<p>foo</p>", "<p>bar</p>", "<p>baz</p>"],
+                     "w": {"foo": [[0, 1], [2, 3]],
+                           "bar": [[1, 1], [2, 1]]}}
+        with open(os.path.join(self._dir, "search.json"), "w") as fobj:
+            json.dump(self.data, fobj)
+        search.write_binary_index(os.path.join(self._dir, "search.idx"),
+                                  self.data)
+        with open(os.path.join(self._dir, "search-tag-a.json"), "w") as fobj:
+            json.dump({"a": ["<p>bar</p>"], "w": {"bar": [[0, 1]]},
+                       "i": [1]}, fobj)
+
+        bloom = search.BloomFilter(2)
+        bloom.add("foo")
+        bloom.add("bar")
+        self.templates = {"b": bloom.to_dict(), "p": ["tag-a"]}
+        self._write_templates()
+
+    def tearDown(self):
+        """Clean up"""
+        shutil.rmtree(self._dir)
+
+    def _write_templates(self):
+        """Write templates.json file"""
+        with open(os.path.join(self._dir, "templates.json"), "w") as fobj:
+            json.dump(self.templates, fobj)
+
+    def test_open_index(self):
+        """Test open_index function"""
+        for fname, class_ in (("search.json", search.JsonIndex),
+                              ("search.idx", search.BinaryIndex)):
+            index = search.open_index(os.path.join(self._dir, fname))
+            self.assertIsInstance(index, class_)
+            self.assertEqual(index.size, os.path.getsize(
+                os.path.join(self._dir, fname)))
+            self.assertEqual(index.articles, 3)
+            self.assertEqual(index.search("foo"), [2, 0])
+            self.assertEqual(index.search("foo bar"), [2])
+            self.assertEqual(index.search("baz"), [])
+            self.assertEqual(index.headline(1), "<p>bar</p>")
+            index.close()
+
+        index = search.open_index(os.path.join(self._dir,
+                                               "search-tag-a.json"))
+        self.assertEqual(index.ids, [1])
+
+    def test_query(self):
+        """Test SiteSearch.query method"""
+        json_size = os.path.getsize(os.path.join(self._dir, "search.json"))
+        part_size = os.path.getsize(os.path.join(self._dir,
+                                                 "search-tag-a.json"))
+        site = search.SiteSearch(self._dir)
+        self.assertTrue(site.index_fname.endswith("search.json"))
+
+        # not in the vocabulary
+        self.assertEqual(site.query("baz"), ([], 0))
+        self.assertEqual(site.query("foo"),
+                         (["<p>baz</p>", "<p>foo</p>"], json_size))
+        # found in the partition
+        self.assertEqual(site.query("bar", "tag-a"),
+                         (["<p>bar</p>"], part_size))
+        # not found in the partition, fall back to the global index
+        self.assertEqual(site.query("foo", "tag-a"),
+                         (["<p>baz</p>", "<p>foo</p>"],
+                          part_size + json_size))
+        # unknown partition
+        self.assertEqual(site.query("foo", "tag-b"),
+                         (["<p>baz</p>", "<p>foo</p>"], json_size))
+        site.close()
+
+        self.templates["s"] = "/search"
+        self._write_templates()
+        site = search.SiteSearch(self._dir)
+        self.assertTrue(site.index_fname.endswith("search.idx"))
+        headlines, size = site.query("foo bar")
+        self.assertEqual(headlines, ["<p>baz</p>"])
+        self.assertEqual(size, len('{"a": ["<p>baz</p>"]}'))
+        site.close()
+
+
+class TestBloomFilter(unittest.TestCase):
+    """Check BloomFilter"""
+
+    def test_fnv1a(self):
+        """Test fnv1a function against known values"""
+        self.assertEqual(search.fnv1a(b""), 0x811c9dc5)
+        self.assertEqual(search.fnv1a(b"a"), 0xe40c292c)
+        self.assertEqual(search.fnv1a(b"foobar"), 0xbf9cf968)
+
+    def test_membership(self):
+        """Test add() and containment check"""
+        words = ['zażółć', 'gęślą', 'jaźń', '喜六', 'foo', 'bar']
+        bloom = search.BloomFilter(len(words))
+        for word in words:
+            self.assertNotIn(word, bloom)
+            bloom.add(word)
+
+        for word in words:
+            self.assertIn(word, bloom)
+
+        bloom = search.BloomFilter(1000)
+        for idx in range(1000):
+            bloom.add("word%d" % idx)
+        false_positives = [idx for idx in range(1000)
+                           if "other%d" % idx in bloom]
+        self.assertLess(len(false_positives), 50)
+
+    def test_max_bytes(self):
+        """Test capping the filter size"""
+        bloom = search.BloomFilter(100)
+        self.assertLess(bloom.error_rate(), 0.011)
+
+        bloom = search.BloomFilter(1000, max_bytes=256)
+        self.assertEqual(bloom.size, 2048)
+        self.assertEqual(bloom.hashes, 1)
+        self.assertGreater(bloom.error_rate(), 0.3)
+        for idx in range(1000):
+            bloom.add("word%d" % idx)
+        self.assertIn("word999", bloom)
+
+        self.assertEqual(search.BloomFilter(10, max_bytes=256).size,
+                         search.BloomFilter(10).size)
+
+    def test_serialization(self):
+        """Test to_dict() and from_dict() methods"""
+        bloom = search.BloomFilter(0)
+        self.assertEqual(bloom.to_dict(), {"m": 16, "k": 11, "b": "AAA="})
+
+        bloom = search.BloomFilter(10)
+        bloom.add("foo")
+        data = bloom.to_dict()
+        self.assertEqual(data["m"] % 8, 0)
+        self.assertEqual(len(bloom.bits), data["m"] // 8)
+
+        bloom2 = search.BloomFilter.from_dict(data)
+        self.assertIn("foo", bloom2)
+        self.assertNotIn("bar", bloom2)
+        self.assertEqual(bloom2.to_dict(), data)
+
 
 if __name__ == '__main__':
     unittest.main()
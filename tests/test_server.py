@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Tests for search service
+"""
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from kiroku import search
+from kiroku import server
+
+
+class TestSearchService(unittest.TestCase):
+    """Check SearchService class"""
+
+    def setUp(self):
+        """Create index file"""
+        self._dir = tempfile.mkdtemp()
+        fname = os.path.join(self._dir, "search.idx")
+        search.write_binary_index(fname, {"a": ["<p>foo</p>", "<p>bar</p>"],
+                                          "w": {"foo": [(0, 1), (1, 2)],
+                                                "bar": [(1, 1)]}})
+        self.index = search.BinaryIndex(fname)
+
+    def tearDown(self):
+        """Clean up"""
+        self.index.close()
+        shutil.rmtree(self._dir)
+
+    def test_respond(self):
+        """Test respond method"""
+        service = server.SearchService(self.index)
+        self.assertEqual(service.respond("/search?q=foo"),
+                         ("200 OK", {"a": ["<p>bar</p>", "<p>foo</p>"],
+                                     "i": [1, 0]}))
+        self.assertEqual(service.respond("/search/?q=foo+bar"),
+                         ("200 OK", {"a": ["<p>bar</p>"], "i": [1]}))
+        self.assertEqual(service.respond("/search?q=baz"),
+                         ("200 OK", {"a": [], "i": []}))
+        self.assertEqual(service.respond("/search"),
+                         ("200 OK", {"a": [], "i": []}))
+        self.assertEqual(service.respond("/foo?q=foo")[0], "404 Not Found")
+
+    def test_handle(self):
+        """Test handle method with the real connection"""
+        service = server.SearchService(self.index)
+
+        async def request(data):
+            srv = await asyncio.start_server(service.handle, "127.0.0.1", 0)
+            port = srv.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(data)
+            response = await reader.read()
+            writer.close()
+            srv.close()
+            await srv.wait_closed()
+            return response
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self.addCleanup(loop.close)
+        response = loop.run_until_complete(
+            request(b"GET /search?q=bar HTTP/1.1\r\nHost: localhost\r\n\r\n"))
+        headers, body = response.split(b"\r\n\r\n", 1)
+        self.assertTrue(headers.startswith(b"HTTP/1.1 200 OK\r\n"))
+        self.assertIn(b"Content-Length: %d" % len(body), headers)
+        self.assertEqual(json.loads(body.decode("utf-8")),
+                         {"a": ["<p>bar</p>"], "i": [1]})
+
+        response = loop.run_until_complete(
+            request(b"POST /search HTTP/1.1\r\n\r\n"))
+        self.assertTrue(response.startswith(b"HTTP/1.1 400 Bad Request"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Tests for build statistics
+"""
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+
+from kiroku import stats
+
+
+class TestBuildStats(unittest.TestCase):
+    """Test BuildStats class"""
+
+    def test_phase(self):
+        """Test measuring the phases"""
+        bstats = stats.BuildStats()
+        with bstats.phase("foo"):
+            sum(range(1000))
+        with self.assertRaises(ValueError):
+            with bstats.phase("bar"):
+                raise ValueError()
+
+        self.assertEqual([phase[0] for phase in bstats.phases],
+                         ["foo", "bar"])
+        self.assertTrue(all(phase[1] >= 0 and phase[2] >= 0
+                            for phase in bstats.phases))
+
+    def test_counters(self):
+        """Test counting articles and files"""
+        bstats = stats.BuildStats()
+        self.assertEqual(bstats.articles_per_second, 0)
+        bstats.written(10)
+        bstats.written(5)
+        bstats.skipped()
+        bstats.articles = 3
+        bstats.finish()
+
+        data = bstats.to_dict()
+        self.assertEqual(data["files_written"], 2)
+        self.assertEqual(data["bytes_written"], 15)
+        self.assertEqual(data["files_skipped"], 1)
+        self.assertEqual(data["articles"], 3)
+        self.assertGreater(data["articles_per_second"], 0)
+        self.assertEqual(data["phases"], [])
+
+    def test_articles(self):
+        """Test measuring the articles processing"""
+        bstats = stats.BuildStats()
+        with bstats.article_step("a.rst", "publish"):
+            sum(range(100000))
+        with bstats.article_step("b.rst", "publish"):
+            pass
+        with bstats.article_step("b.rst", "write"):
+            pass
+        bstats.article_size("a.rst", source=10)
+        bstats.article_size("a.rst", output=20)
+
+        self.assertEqual([item[0] for item in bstats.slowest(5)],
+                         ["a.rst", "b.rst"])
+        fname, data, total = bstats.slowest(1)[0]
+        self.assertEqual(fname, "a.rst")
+        self.assertEqual(data["source"], 10)
+        self.assertEqual(data["output"], 20)
+        self.assertEqual(data["words"], 0)
+        self.assertEqual(total, data["publish"])
+        self.assertEqual(bstats.over_budget(total), [])
+        self.assertEqual(bstats.over_budget(0)[0], ("a.rst", total))
+
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            bstats.print_slowest(1)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0].split(), ["article", "publish", "words",
+                                            "write", "total", "[s]", "source",
+                                            "[B]", "output", "[B]"])
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[1].split()[0], "a.rst")
+        self.assertEqual(lines[1].split()[-2:], ["10", "20"])
+
+    def test_write_prometheus(self):
+        """Test writing the statistics in Prometheus text format"""
+        bstats = stats.BuildStats()
+        with bstats.phase("tag pages"):
+            pass
+        bstats.cached(True)
+        bstats.cached(False)
+        bstats.cached(False)
+        bstats.errors.append("foo")
+        bstats.finish()
+
+        fname = tempfile.mktemp()
+        try:
+            bstats.write_prometheus(fname, 1500000000)
+            with open(fname) as fobj:
+                lines = fobj.read().splitlines()
+        finally:
+            os.unlink(fname)
+
+        self.assertIn("# TYPE kiroku_build_cache_hits gauge", lines)
+        self.assertIn("kiroku_build_cache_hits 1", lines)
+        self.assertIn("kiroku_build_cache_misses 2", lines)
+        self.assertIn("kiroku_build_errors 1", lines)
+        self.assertIn("kiroku_build_last_run_timestamp_seconds 1500000000",
+                      lines)
+        self.assertTrue([line for line in lines if line.startswith(
+            'kiroku_build_phase_duration_seconds{phase="tag pages"} ')])
+        self.assertFalse(os.path.exists(fname + ".tmp"))
+
+    def test_reports(self):
+        """Test printing and writing the statistics"""
+        bstats = stats.BuildStats()
+        with bstats.phase("walk"):
+            pass
+        bstats.finish()
+
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            bstats.print_timings()
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0].split()[0], "phase")
+        self.assertEqual(lines[1].split()[0], "walk")
+        self.assertEqual(lines[2].split()[0], "total")
+
+        fname = tempfile.mktemp()
+        try:
+            bstats.write_json(fname)
+            with open(fname) as fobj:
+                self.assertEqual(json.load(fobj)["phases"][0]["name"],
+                                 "walk")
+        finally:
+            os.unlink(fname)
+
+
+class TestHistory(unittest.TestCase):
+    """Test build history functions"""
+
+    def _records(self):
+        """Return build records"""
+        return [{"wall": 1.0, "output_bytes": 100, "search_bytes": 10},
+                {"wall": 1.2, "output_bytes": 100, "search_bytes": 10},
+                {"wall": 0.9, "output_bytes": 110, "search_bytes": 10},
+                {"wall": 1.1, "output_bytes": 250, "search_bytes": 12},
+                {"wall": 3.0, "output_bytes": 250, "search_bytes": 0,
+                 "commit": "abc1234", "time": "2020-01-01 10:00:00",
+                 "articles": 3}]
+
+    def test_append_history(self):
+        """Test writing and reading the history"""
+        fname = tempfile.mktemp()
+        try:
+            stats.append_history(fname, {"wall": 1})
+            with open(fname, "a") as fobj:
+                fobj.write("broken\n")
+            stats.append_history(fname, {"wall": 2})
+            self.assertEqual(stats.read_history(fname),
+                             [{"wall": 1}, {"wall": 2}])
+        finally:
+            os.unlink(fname)
+
+    def test_history_jumps(self):
+        """Test flagging the jumps"""
+        jumps = stats.history_jumps(self._records(), 0.25)
+        self.assertEqual(jumps[:3], [[], [], []])
+        self.assertEqual([label for label, _ in jumps[3]], ["output"])
+        self.assertAlmostEqual(jumps[3][0][1], 1.5)
+        # output stays flagged, until it's the median of the previous builds
+        self.assertEqual([label for label, _ in jumps[4]],
+                         ["build time", "output"])
+        self.assertEqual(stats.history_jumps(self._records(), 2), [[]] * 5)
+
+    def test_print_history(self):
+        """Test printing the history"""
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            stats.print_history(self._records(), 2)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertIn("output +150%", lines[1])
+        self.assertEqual(lines[2].split()[:4],
+                         ["2020-01-01", "10:00:00", "abc1234", "3"])
+        self.assertTrue(lines[2].endswith("build time +186%, output +138%"))
+        self.assertEqual(lines[3], "Trend over 2 builds: build time "
+                         "+172.7%, output +0.0%, search index -100.0%")
+
+
+if __name__ == '__main__':
+    unittest.main()
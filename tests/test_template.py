@@ -38,6 +38,7 @@ class TestTemplate(unittest.TestCase):
         self.assertRaises(TypeError, template.Template)
         tpl = template.Template({})
         self.assertEqual(tpl.templates, {})
+        self.assertEqual(tpl.compiled, {})
 
     def test_call(self):
         """Test __call__ method"""
@@ -66,43 +67,202 @@ class TestTemplate(unittest.TestCase):
         self.assertEqual(tpl('foo', {}), "<span>foo</span>")
         self.assertEqual(len(tpl.templates), 3)
 
-    def test_get_updated_template(self):
-        """Test _get_updated_template method"""
-
+    def test_read_template_fallback(self):
+        """Test reading templates missing in the site from kiroku data"""
         tpl = template.Template({})
-        self.assertRaises(TypeError, tpl._get_updated_template)
-        self.assertRaises(TypeError, tpl._get_updated_template, '')
-        self.assertRaises(TypeError, tpl._get_updated_template, '', None)
+        self.assertEqual(tpl('pagination_link', {"class": "older",
+                                                 "url": "index-2.html",
+                                                 "label": "Older"}),
+                         '<a class="older" href="index-2.html">Older</a>')
+
+    def test_get_defaults(self):
+        """Test interpolating templates got by get() with defaults"""
+        with open(".templates/blah.html", "w") as fobj:
+            fobj.write("blah")
+        with open(".templates/foo.html", "w") as fobj:
+            fobj.write("blah %(foo)s")
+        with open(".templates/foobar.html", "w") as fobj:
+            fobj.write("blah %(foo)s, %(bar)s")
 
         tpl = template.Template({})
-        self.assertEqual(tpl._get_updated_template("blah", {}), "blah")
-        self.assertRaises(KeyError, tpl._get_updated_template, "blah %(foo)s",
-                          {})
-        self.assertRaises(KeyError, tpl._get_updated_template,
-                          "blah %(foo)s, %(bar)s",
-                          {"foo": 1})
+        self.assertRaises(TypeError, tpl.get)
+        self.assertRaises(TypeError, tpl.get('blah'))
+        self.assertEqual(tpl.get('blah')({}), "blah")
+        self.assertRaises(KeyError, tpl.get('foo'), {})
+        self.assertRaises(KeyError, tpl.get('foobar'), {"foo": 1})
 
         # we have some defaults, and we passed some more values, than expected
         tpl = template.Template({"foo": 1})
-        self.assertEqual(tpl._get_updated_template("blah %(foo)s",
-                                                   {"foo": 1}),
-                         "blah 1")
-        self.assertEqual(tpl._get_updated_template("blah %(foo)s",
-                                                   {"foo": 1, "burp": "pi"}),
-                         "blah 1")
+        self.assertEqual(tpl.get('foo')({"foo": 1}), "blah 1")
+        self.assertEqual(tpl.get('foo')({"foo": 1, "burp": "pi"}), "blah 1")
 
         # we have some defaults and it is not enough to fill the template,
         # unless provided some data as an argument
         tpl = template.Template({"bar": 2})
-        _method = tpl._get_updated_template
-
-        self.assertEqual(_method("blah", {}), "blah")
-        self.assertRaises(KeyError, _method, "blah %(foo)s", {})
-        self.assertEqual(_method("blah %(foo)s, %(bar)s", {"foo": 1}),
-                         "blah 1, 2")
+        self.assertEqual(tpl.get('blah')({}), "blah")
+        self.assertRaises(KeyError, tpl.get('foo'), {})
+        self.assertEqual(tpl.get('foobar')({"foo": 1}), "blah 1, 2")
         # data passed as argument overcomes the defaults
-        self.assertEqual(_method("blah %(foo)s, %(bar)s",
-                                 {"foo": 1, "bar": 3}), "blah 1, 3")
+        self.assertEqual(tpl.get('foobar')({"foo": 1, "bar": 3}),
+                         "blah 1, 3")
+
+    def test_get(self):
+        """Test get method"""
+        tpl = template.Template({"bar": 2})
+        with open(".templates/foo.html", "w") as fobj:
+            fobj.write("<span>%(foo)s %(bar)d</span>")
+
+        compiled = tpl.get('foo')
+        self.assertIsInstance(compiled, template.CompiledTemplate)
+        self.assertIs(tpl.get('foo'), compiled)
+        self.assertEqual(compiled({"foo": 1}), "<span>1 2</span>")
+        self.assertEqual(tpl('foo', {"foo": 1}), "<span>1 2</span>")
+
+    def test_tracker(self):
+        """Test recording templates used by the pages"""
+        tpl = template.Template({})
+        # not recorded for any page
+        tpl('bar', {})
+        with tpl.tracker.recording() as shared:
+            tpl('baz', {})
+        with tpl.tracker.page("foo.html"):
+            tpl('foo', {})
+        with tpl.tracker.page("baz.html"):
+            tpl.tracker.use(*shared)
+            with tpl.tracker.recording(set(["bar"])) as nested:
+                tpl('foo', {})
+        with tpl.tracker.page("empty.html"):
+            pass
+
+        self.assertEqual(shared, {"baz"})
+        self.assertEqual(nested, {"foo", "bar"})
+        self.assertEqual(tpl.tracker.pages, {"foo.html": {"foo"},
+                                             "baz.html": {"foo", "baz"},
+                                             "empty.html": set()})
+
+
+class TestTemplateRegistry(unittest.TestCase):
+    """Test TemplateRegistry class"""
+
+    def test_load(self):
+        """Test loading and validating template files"""
+        fname = tempfile.mktemp()
+        registry = template.TemplateRegistry()
+        try:
+            with open(fname, "w") as fobj:
+                fobj.write("<p>foo</p>\n<!-- x -->\n")
+            content, digest = registry.load(fname)
+            self.assertEqual(content, "<p>foo</p>")
+            self.assertIs(registry.load(fname)[0], content)
+            self.assertFalse(registry.changed(fname, digest))
+
+            with open(fname, "w") as fobj:
+                fobj.write("<p>bar</p>")
+            self.assertTrue(registry.changed(fname, digest))
+            self.assertEqual(registry.load(fname)[0], "<p>bar</p>")
+        finally:
+            os.unlink(fname)
+        self.assertTrue(registry.changed(fname, digest))
+
+    def test_relative_path(self):
+        """Test that entries don't depend on the working directory"""
+        registry = template.TemplateRegistry()
+        curdir = os.path.abspath(os.curdir)
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            for name, content in (("one", "<p>1</p>"), ("two", "<p>22</p>")):
+                os.makedirs(os.path.join(tmp_dir, name, ".templates"))
+                with open(os.path.join(tmp_dir, name, ".templates",
+                                       "foo.html"), "w") as fobj:
+                    fobj.write(content)
+
+            for name, content in (("one", "<p>1</p>"), ("two", "<p>22</p>")):
+                os.chdir(os.path.join(tmp_dir, name))
+                self.assertEqual(registry.load("./.templates/foo.html")[0],
+                                 content)
+        finally:
+            os.chdir(curdir)
+            shutil.rmtree(tmp_dir)
+
+    def test_shared(self):
+        """Test sharing the registry between the Template objects"""
+        self.assertIsInstance(template.REGISTRY, template.TemplateRegistry)
+        self.assertIs(template.Template({}).registry, template.REGISTRY)
+
+
+class TestCompiledTemplate(unittest.TestCase):
+    """Test CompiledTemplate class"""
+
+    def test_compile(self):
+        """Test splitting template into parts and slots"""
+        tpl = template.CompiledTemplate("", {})
+        self.assertEqual(tpl.parts, [""])
+        self.assertEqual(tpl.slots, [])
+
+        tpl = template.CompiledTemplate("a %(foo)s b %(bar)05.1f%% c", {})
+        self.assertEqual(tpl.parts, ["a ", None, " b ", None, "% c"])
+        self.assertEqual(tpl.slots, [(1, "foo", None), (3, "bar", "%05.1f")])
+
+        # not a valid template - compilation is not possible
+        tpl = template.CompiledTemplate("width: 100%;", {})
+        self.assertIsNone(tpl.parts)
+
+    def test_fold(self):
+        """Test substituting defaults during compilation"""
+        defaults = {"a": 1, "c": 2, "d": "x"}
+        tpl = template.CompiledTemplate("<%(a)s>%(b)s:%(c)d%(d)d|", defaults)
+        self.assertEqual(tpl.folded, frozenset(["a", "c"]))
+        # "d" can't be formatted with the default, so it is still a slot
+        self.assertEqual(tpl.parts, ["<1>", None, ":2", None, "|"])
+        self.assertEqual(tpl.slots, [(1, "b", None), (3, "d", "%d")])
+        self.assertEqual(tpl({"b": "B", "d": 3}), "<1>B:23|")
+
+        # data overrides folded value
+        self.assertEqual(tpl({"b": "B", "d": 3, "a": "A"}), "<A>B:23|")
+        self.assertEqual(tpl({"b": "B", "d": 3, "c": 9}), "<1>B:93|")
+        self.assertRaises(TypeError, tpl, {"b": "B"})
+
+        tpl = template.CompiledTemplate("%(a)s%(a)s", {"a": 1})
+        self.assertEqual(tpl.parts, ["11"])
+        self.assertEqual(tpl.slots, [])
+        self.assertEqual(tpl({}), "11")
+
+    def test_chunks(self):
+        """Test streaming the template"""
+        tpl = template.CompiledTemplate("<%(a)s>%(body)s</%(b)s>", {"a": 1})
+        self.assertEqual(list(tpl.chunks({"b": 2, "body": ["x", "ż"]},
+                                         "body")),
+                         [b"<1>", b"x", "ż".encode("utf-8"), b"</", b"2",
+                          b">"])
+        self.assertEqual(list(tpl.chunks({"b": 2, "body": iter([])},
+                                         "body")),
+                         [b"<1>", b"</", b"2", b">"])
+        # folded key overridden
+        self.assertEqual(b"".join(tpl.chunks({"a": 0, "b": 2, "body": ["x"]},
+                                             "body")), b"<0>x</2>")
+
+        tpl = template.CompiledTemplate("%(body)5s|", {})
+        self.assertEqual(b"".join(tpl.chunks({"body": ["a", "b"]}, "body")),
+                         b"   ab|")
+
+        tpl = template.CompiledTemplate("100%; %(body)s", {})
+        self.assertRaises(ValueError, list, tpl.chunks({"body": []}, "body"))
+
+    def test_call(self):
+        """Test rendering compiled template"""
+        source = "%(a)s, %(b)d, %(c)r, %%(a)s, %(a)s"
+        data = {"a": "x", "b": 7.9, "c": "y"}
+        tpl = template.CompiledTemplate(source, {"b": 1})
+        self.assertEqual(tpl(data), source % data)
+        self.assertEqual(tpl({"a": 1, "c": 2}), "1, 1, 2, %(a)s, 1")
+        self.assertEqual(tpl([("a", 1), ("c", 2)]), "1, 1, 2, %(a)s, 1")
+
+        self.assertRaises(KeyError, tpl, {"a": 1})
+        self.assertRaises(TypeError, tpl, None)
+        self.assertRaises(ValueError, tpl, "foo")
+
+        tpl = template.CompiledTemplate("width: 100%;", {})
+        self.assertRaises(ValueError, tpl, {})
 
 
 if __name__ == '__main__':
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Tests for build tracing
+"""
+import json
+import os
+import tempfile
+import unittest
+
+from kiroku import trace
+
+
+class TestTracer(unittest.TestCase):
+    """Test Tracer class"""
+
+    def test_span(self):
+        """Test recording the spans"""
+        tracer = trace.Tracer()
+        with tracer.span("outer", "phase"):
+            with tracer.span("inner", "write", fname="foo.html"):
+                pass
+
+        inner, outer = tracer.events
+        self.assertEqual(inner["name"], "inner")
+        self.assertEqual(inner["cat"], "write")
+        self.assertEqual(inner["ph"], "X")
+        self.assertEqual(inner["args"], {"fname": "foo.html"})
+        self.assertEqual(inner["pid"], os.getpid())
+        self.assertLessEqual(outer["ts"], inner["ts"])
+        self.assertGreaterEqual(outer["ts"] + outer["dur"],
+                                inner["ts"] + inner["dur"])
+
+    def test_write(self):
+        """Test writing the trace file"""
+        tracer = trace.Tracer()
+        with tracer.span("foo", "phase"):
+            pass
+
+        fname = tempfile.mktemp()
+        try:
+            tracer.write(fname)
+            with open(fname) as fobj:
+                data = json.load(fobj)
+        finally:
+            os.unlink(fname)
+
+        self.assertEqual([event["ph"] for event in data["traceEvents"]],
+                         ["M", "X"])
+        self.assertEqual(data["traceEvents"][1]["name"], "foo")
+
+
+class TestFunctions(unittest.TestCase):
+    """Test module functions"""
+
+    def test_set_tracer(self):
+        """Test replacing the current tracer"""
+        self.assertFalse(trace.TRACER.enabled)
+        tracer = trace.Tracer()
+        previous = trace.set_tracer(tracer)
+        try:
+            with trace.span("foo", "phase"):
+                pass
+        finally:
+            self.assertIs(trace.set_tracer(previous), tracer)
+
+        self.assertEqual(len(tracer.events), 1)
+        self.assertIs(trace.TRACER, previous)
+        with trace.span("bar", "phase"):
+            pass
+        self.assertEqual(len(tracer.events), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()